@@ -0,0 +1,5 @@
+from vintage_pi_tv.utils import init_logger
+
+
+# Adds the trace level that the app's modules log with, same as at startup
+init_logger()
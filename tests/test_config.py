@@ -0,0 +1,94 @@
+from pathlib import Path
+
+import pytest
+
+from vintage_pi_tv.config import LIBRARY_SETTINGS, Config, ConfigDiff
+from vintage_pi_tv.exceptions import InvalidConfigError
+
+
+@pytest.fixture
+def config_file(tmp_path: Path) -> Path:
+    path = tmp_path / "config.toml"
+    path.write_text("static-time = 2.0\nstarting-volume = 50\n[keyboard]\nenabled = true\n")
+    return path
+
+
+def reloaded(config: Config, path: Path, toml: str) -> tuple[Config, ConfigDiff]:
+    path.write_text(toml)
+    new = config.reload()
+    return new, config.diff(new)
+
+
+def test_no_changes(config_file):
+    config = Config(path=config_file)
+    diff = config.diff(config.reload())
+    assert not diff
+    assert diff.restart_reasons == diff.next_startup == []
+
+
+def test_reloadable_change(config_file):
+    config = Config(path=config_file)
+    _, diff = reloaded(config, config_file, "static-time = 5.0\nstarting-volume = 50\n[keyboard]\nenabled = true\n")
+    assert diff.changed == {"static_time": (2.0, 5.0)}
+    assert "static_time" in diff
+    assert diff.restart_reasons == []
+    assert not diff.touches(LIBRARY_SETTINGS)
+
+
+def test_library_change(config_file, tmp_path):
+    config = Config(path=config_file)
+    toml = f'search-dirs = ["{tmp_path}"]\nstatic-time = 2.0\nstarting-volume = 50\n[keyboard]\nenabled = true\n'
+    _, diff = reloaded(config, config_file, toml)
+    assert diff.touches(LIBRARY_SETTINGS)
+    assert diff.restart_reasons == []
+
+
+def test_startup_change(config_file):
+    config = Config(path=config_file)
+    _, diff = reloaded(config, config_file, "static-time = 2.0\nstarting-volume = 80\n[keyboard]\nenabled = true\n")
+    assert diff.next_startup == ["starting_volume"]
+    assert diff.restart_reasons == []  # Not worth restarting for
+
+
+def test_restart_reasons(config_file):
+    config = Config(path=config_file)
+    toml = "static-time = 2.0\nstarting-volume = 50\ncrt-filter = true\nshow-fps = true\n[keyboard]\nenabled = false\n"
+    _, diff = reloaded(config, config_file, toml)
+    assert diff.restart_reasons == ["crt_filter", "keyboard.enabled", "show_fps"]
+
+
+def test_without_restart(config_file):
+    config = Config(path=config_file)
+    toml = "static-time = 5.0\nstarting-volume = 50\ncrt-filter = true\n[keyboard]\nenabled = false\n"
+    _, diff = reloaded(config, config_file, toml)
+    reloadable = diff.without_restart()
+    assert set(reloadable.changed) == {"static_time", "keyboard"}  # Keys still apply, just not enabling
+    assert reloadable.restart_reasons == ["keyboard.enabled"]
+    config.update(reloadable)
+    assert config.static_time == 5.0
+    assert config.crt_filter is False
+
+
+def test_keyboard_keys_dont_need_restart(config_file):
+    config = Config(path=config_file)
+    toml = 'static-time = 2.0\nstarting-volume = 50\n[keyboard]\nenabled = true\nmute = "KEY_9"\n'
+    _, diff = reloaded(config, config_file, toml)
+    assert "keyboard" in diff
+    assert diff.restart_reasons == []
+
+
+def test_update_applies_diff(config_file):
+    config = Config(path=config_file)
+    new, diff = reloaded(config, config_file, "static-time = 5.0\nstarting-volume = 80\n[keyboard]\nenabled = true\n")
+    config.update(diff)
+    assert config.static_time == 5.0
+    assert config.starting_volume == 80
+    assert not config.diff(new)
+
+
+def test_invalid_reload_raises(config_file):
+    config = Config(path=config_file)
+    config_file.write_text("static-time = -1\n")
+    with pytest.raises(InvalidConfigError):
+        config.reload()
+    assert config.static_time == 2.0  # Unchanged
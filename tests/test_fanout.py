@@ -0,0 +1,103 @@
+import asyncio
+import json
+
+from vintage_pi_tv.fanout import CLIENT_QUEUE_SIZE, FanOut, decode, encode, negotiate_encoding
+
+
+class FakeWebSocket:
+    # Holds every send until opened, like a client on a slow link
+    client = None
+
+    def __init__(self, open: bool = True):
+        self.sent: list[str | bytes] = []
+        self.gate = asyncio.Event()
+        if open:
+            self.gate.set()
+
+    async def send_text(self, data: str):
+        await self.gate.wait()
+        self.sent.append(data)
+
+    async def send_bytes(self, data: bytes):
+        await self.gate.wait()
+        self.sent.append(data)
+
+
+async def drain():
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+def test_encode_decode_round_trip():
+    message = {"topic": "state", "data": {"name": "Café"}}
+    assert decode(encode(message)) == message
+    assert negotiate_encoding(None) == "json"
+    assert negotiate_encoding(["bogus"]) == "json"
+
+
+def test_new_client_gets_hello_then_messages():
+    async def run():
+        fanout = FanOut(hello=lambda: {"type": "hello"})
+        websocket = FakeWebSocket()
+        fanout.add(websocket)
+        fanout.publish({"type": "patch", "n": 1})
+        await drain()
+        return fanout, [json.loads(data) for data in websocket.sent]
+
+    fanout, sent = asyncio.run(run())
+    assert sent == [{"type": "hello"}, {"type": "patch", "n": 1}]
+    assert fanout.stats()["sent"] == 2
+    assert fanout.stats()["resyncs"] == 0  # Initial hello isn't a resync
+
+
+def test_resumed_client_skips_hello():
+    async def run():
+        fanout = FanOut(hello=lambda: {"type": "hello"})
+        websocket = FakeWebSocket()
+        fanout.add(websocket, resume={"type": "resume"})
+        await drain()
+        return fanout, [json.loads(data) for data in websocket.sent]
+
+    fanout, sent = asyncio.run(run())
+    assert sent == [{"type": "resume"}]
+    assert fanout.resumed == 1
+
+
+def test_slow_client_overflows_and_resyncs():
+    async def run():
+        fanout = FanOut(hello=lambda: {"type": "hello"})
+        slow, fast = FakeWebSocket(open=False), FakeWebSocket()
+        slow_client = fanout.add(slow)
+        fanout.add(fast)
+        await drain()  # Slow writer is now stuck sending its hello, so its queue is empty
+        for n in range(CLIENT_QUEUE_SIZE + 1):
+            fanout.publish({"type": "patch", "n": n})
+            await drain()
+        slow.gate.set()
+        await drain()
+        return fanout, slow_client, slow, fast
+
+    fanout, slow_client, slow, fast = asyncio.run(run())
+    # Fast client got everything, slow one its first hello, then a fresh hello in place of what it missed
+    assert len(fast.sent) == CLIENT_QUEUE_SIZE + 2
+    assert [json.loads(data) for data in slow.sent] == [{"type": "hello"}, {"type": "hello"}]
+    assert slow_client.resyncs == 1
+    assert slow_client.dropped == CLIENT_QUEUE_SIZE
+    stats = fanout.stats()
+    assert stats["resyncs"] == 1
+    assert stats["dropped"] == CLIENT_QUEUE_SIZE
+    assert stats["published"] == CLIENT_QUEUE_SIZE + 1
+
+
+def test_failed_send_removes_client():
+    class BrokenWebSocket(FakeWebSocket):
+        async def send_text(self, data: str):
+            raise ConnectionError
+
+    async def run():
+        fanout = FanOut(hello=lambda: {"type": "hello"})
+        fanout.add(BrokenWebSocket())
+        await drain()
+        return fanout
+
+    assert asyncio.run(run()).stats()["clients"] == 0
@@ -0,0 +1,57 @@
+import pytest
+
+from vintage_pi_tv.metrics import Registry
+
+
+def test_render_owned_values():
+    registry = Registry()
+    counter = registry.counter("things_total", "Things that happened")
+    gauge = registry.gauge("temperature", "How hot it is")
+    counter.inc()
+    counter.inc(2)
+    gauge.set(21.5)
+    assert (
+        registry.render()
+        == "# HELP vintage_pi_tv_things_total Things that happened\n"
+        "# TYPE vintage_pi_tv_things_total counter\n"
+        "vintage_pi_tv_things_total 3.0\n"
+        "# HELP vintage_pi_tv_temperature How hot it is\n"
+        "# TYPE vintage_pi_tv_temperature gauge\n"
+        "vintage_pi_tv_temperature 21.5\n"
+    )
+
+
+def test_render_labels_are_escaped():
+    registry = Registry()
+    counter = registry.counter("updates_total", "Updates", label="layer")
+    counter.inc(label_value="osd")
+    counter.inc(label_value='say "hi"\\\n')
+    lines = registry.render().splitlines()[2:]
+    assert lines == [
+        'vintage_pi_tv_updates_total{layer="osd"} 1.0',
+        'vintage_pi_tv_updates_total{layer="say \\"hi\\"\\\\\\n"} 1.0',
+    ]
+
+
+def test_render_collected_values():
+    registry = Registry()
+    registry.gauge("clients", "Connected clients", func=lambda: 2)
+    registry.gauge("encodings", "Clients by encoding", label="encoding", func=lambda: {"json": 1, "msgpack": 1})
+    rendered = registry.render()
+    assert "vintage_pi_tv_clients 2.0\n" in rendered
+    assert 'vintage_pi_tv_encodings{encoding="msgpack"} 1.0\n' in rendered
+
+
+def test_failing_collector_doesnt_break_render():
+    registry = Registry()
+    registry.gauge("broken", "Always fails", func=lambda: 1 / 0)
+    registry.gauge("fine", "Always works", func=lambda: 1)
+    assert registry.render().endswith("vintage_pi_tv_fine 1.0\n")
+    assert "vintage_pi_tv_broken" not in registry.render()
+
+
+def test_duplicate_name_rejected():
+    registry = Registry()
+    registry.counter("things_total", "Things")
+    with pytest.raises(ValueError):
+        registry.gauge("things_total", "Things again")
@@ -0,0 +1,91 @@
+from vintage_pi_tv.protocol import TOPIC_HISTORY_SIZE, Topics, apply_message
+
+
+def client_copy(topics: Topics) -> dict[str, dict]:
+    copy = {}
+    assert apply_message(copy, topics.hello())
+    return copy
+
+
+def test_unchanged_update_sends_nothing():
+    topics = Topics()
+    assert topics.update("state", {"a": 1}) is not None
+    assert topics.update("state", {"a": 1}) is None
+
+
+def test_small_change_is_a_patch():
+    topics = Topics()
+    topics.update("state", {"a": 1, "b": 2, "c": 3, "d": 4})
+    message = topics.update("state", {"a": 1, "b": 20, "d": 4})
+    assert message == {
+        "topic": "state",
+        "version": 2,
+        "base": 1,
+        "patch": {"changed": {"b": 20}, "removed": ["c"]},
+    }
+
+
+def test_big_change_is_sent_in_full():
+    topics = Topics()
+    topics.update("state", {"a": 1, "b": 2})
+    message = topics.update("state", {"a": 10, "b": 20})
+    assert message == {"topic": "state", "version": 2, "data": {"a": 10, "b": 20}}
+    assert topics.update("volume", 0.5)["data"] == 0.5  # Non-dicts always are
+
+
+def test_client_follows_patches():
+    topics = Topics()
+    topics.update("state", {"a": 1, "b": 2, "c": 3})
+    client = client_copy(topics)
+    for data in ({"a": 1, "b": 2, "c": 4}, {"a": 1, "b": 2}, {"a": 1, "b": 2, "d": 5}):
+        assert apply_message(client, topics.update("state", data))
+    assert client == {"state": {"version": 4, "data": {"a": 1, "b": 2, "d": 5}}}
+
+
+def test_client_detects_missed_patch():
+    topics = Topics()
+    topics.update("state", {"a": 1, "b": 2, "c": 3})
+    client = client_copy(topics)
+    topics.update("state", {"a": 1, "b": 2, "c": 4})  # Never gets this one
+    assert not apply_message(client, topics.update("state", {"a": 1, "b": 2, "c": 5}))
+
+
+def test_resume_sends_only_what_was_missed():
+    topics = Topics()
+    topics.update("state", {"a": 1, "b": 2, "c": 3})
+    topics.update("volume", 0.5)
+    client = client_copy(topics)
+    topics.update("state", {"a": 1, "b": 2, "c": 4})
+    topics.update("state", {"a": 1, "b": 2, "c": 5})
+
+    versions = {name: topic["version"] for name, topic in client.items()}
+    resume = topics.resume(topics.session, versions)
+    assert [message["version"] for message in resume["resume"]] == [2, 3]  # Volume is up to date
+    assert apply_message(client, resume)
+    assert client == client_copy(topics)
+
+
+def test_resume_up_to_date():
+    topics = Topics()
+    topics.update("state", {"a": 1})
+    assert topics.resume(topics.session, {"state": 1})["resume"] == []
+
+
+def test_resume_too_far_behind_gets_current_data():
+    topics = Topics()
+    topics.update("state", {"a": 1, "b": 2, "c": 0})
+    client = client_copy(topics)
+    for n in range(1, TOPIC_HISTORY_SIZE + 2):  # More than the history holds
+        topics.update("state", {"a": 1, "b": 2, "c": n})
+
+    resume = topics.resume(topics.session, {"state": 1})
+    assert resume["resume"] == [{"topic": "state", "version": TOPIC_HISTORY_SIZE + 2, "data": topics.get("state")}]
+    assert apply_message(client, resume)
+    assert client == client_copy(topics)
+
+
+def test_resume_from_another_session_needs_hello():
+    topics = Topics()
+    topics.update("state", {"a": 1})
+    assert topics.resume("old-session", {"state": 1}) is None
+    assert topics.resume(topics.session, None) is None
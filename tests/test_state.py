@@ -0,0 +1,42 @@
+import pytest
+
+from vintage_pi_tv.constants import PlayerState
+from vintage_pi_tv.state import StateSnapshot
+
+
+def test_evolve_bumps_version():
+    snapshot = StateSnapshot()
+    evolved = snapshot.evolve(state=PlayerState.PLAYING, duration=60.0)
+    assert evolved.version == snapshot.version + 1
+    assert evolved.state == PlayerState.PLAYING
+    assert evolved.duration == 60.0
+    assert snapshot.state == PlayerState.LOADING  # Original untouched
+
+
+def test_position_at_advances_while_playing():
+    snapshot = StateSnapshot(state=PlayerState.PLAYING, anchor_position=10.0, anchor_time=100.0)
+    assert snapshot.position_at(100.0) == 10.0
+    assert snapshot.position_at(102.5) == 12.5
+
+
+def test_position_at_scales_with_speed():
+    snapshot = StateSnapshot(state=PlayerState.PLAYING, speed=2.0, anchor_position=10.0, anchor_time=100.0)
+    assert snapshot.position_at(103.0) == 16.0
+
+
+@pytest.mark.parametrize("state", [PlayerState.PAUSED, PlayerState.LOADING, PlayerState.NEEDS_FILES])
+def test_position_at_holds_when_not_playing(state):
+    snapshot = StateSnapshot(state=state, anchor_position=10.0, anchor_time=100.0)
+    assert snapshot.position_at(500.0) == 10.0
+
+
+def test_serialize():
+    snapshot = StateSnapshot(state=PlayerState.PAUSED, duration=60.0, speed=1.5, anchor_position=5.0, anchor_time=9.0)
+    assert snapshot.serialize() == {
+        "anchor": {"position": 5.0, "time": 9.0, "rate": 1.5, "paused": True},
+        "duration": 60.0,
+        "state": PlayerState.PAUSED,
+        "video": None,
+    }
+    assert "fps_actual" not in snapshot.serialize()
+    assert snapshot.evolve(fps_actual=29.97).serialize(show_fps=True)["fps_actual"] == 29.97
@@ -0,0 +1,58 @@
+from pathlib import Path
+import queue
+
+import pytest
+
+from vintage_pi_tv.config import Config
+from vintage_pi_tv.videos import VideosDB
+
+
+NAMES = ["delta-dawn", "alpha_one", "charlie-brown", "bravo-two", "echo-park"]
+
+
+@pytest.fixture
+def videos_db(tmp_path: Path) -> VideosDB:
+    for name in NAMES:
+        (tmp_path / f"{name}.mp4").touch()
+    config = Config(path=None, search_dirs=[str(tmp_path)], channel_mode="alphabetical", log_level="WARNING")
+    return VideosDB(config=config, websocket_updates_queue=queue.Queue())
+
+
+def names(page) -> list[str]:
+    return [video.name for video in page]
+
+
+def test_query_everything_in_channel_order(videos_db):
+    version, total, page = videos_db.query()
+    assert version == videos_db.version
+    assert total == len(NAMES)
+    assert names(page) == ["Alpha One", "Bravo Two", "Charlie Brown", "Delta Dawn", "Echo Park"]
+
+
+def test_query_pages(videos_db):
+    _, total, first = videos_db.query(limit=2)
+    _, _, second = videos_db.query(offset=2, limit=2)
+    _, _, past_end = videos_db.query(offset=10, limit=2)
+    assert total == len(NAMES)  # Total is all matches, not just the page
+    assert names(first) == ["Alpha One", "Bravo Two"]
+    assert names(second) == ["Charlie Brown", "Delta Dawn"]
+    assert past_end == []
+
+
+def test_query_searches_name_and_filename(videos_db):
+    _, total, page = videos_db.query(search="TWO")
+    assert (total, names(page)) == (1, ["Bravo Two"])
+    _, total, page = videos_db.query(search="park echo")  # Every term has to match, in any order
+    assert (total, names(page)) == (1, ["Echo Park"])
+    _, total, page = videos_db.query(search="alpha_one.mp4")
+    assert (total, names(page)) == (1, ["Alpha One"])
+    assert videos_db.query(search="zulu")[1:] == (0, [])
+
+
+def test_query_sorts(videos_db):
+    _, _, page = videos_db.query(sort="-name")
+    assert names(page) == ["Echo Park", "Delta Dawn", "Charlie Brown", "Bravo Two", "Alpha One"]
+    _, _, page = videos_db.query(sort="-channel", limit=2)  # Sorted before paging
+    assert names(page) == ["Echo Park", "Delta Dawn"]
+    _, _, page = videos_db.query(sort="filename", search="o")
+    assert [video.filename for video in page] == sorted(video.filename for video in page)
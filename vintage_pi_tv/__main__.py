@@ -1,12 +1,17 @@
 import argparse
+import atexit
 import json
 import os
 from pathlib import Path
 import sys
 
-import uvicorn
-
-from vintage_pi_tv.constants import DEFAULT_CONFIG_PATHS, DEFAULT_PORT, ENV_ARGS_VAR_NAME, ENV_RELOAD_PID_NAME
+from vintage_pi_tv.constants import (
+    DEFAULT_CONFIG_PATHS,
+    DEFAULT_PORT,
+    ENV_ARGS_VAR_NAME,
+    ENV_RELOAD_PID_NAME,
+    ENV_RESTART_NAME,
+)
 from vintage_pi_tv.utils import is_docker
 
 
@@ -48,7 +53,17 @@ def generate_videos_config(config_file: Path, extra_search_dirs):
     print(tomlkit.dumps(toml))
 
 
+def restart_if_requested():
+    # Set by utils.restart(). Registered before anything else, so it runs after every other atexit function, ie once
+    # mpv and the OSD renderer have been cleaned up.
+    if os.environ.pop(ENV_RESTART_NAME, None):
+        sys.stdout.flush()
+        sys.stderr.flush()
+        os.execv(sys.executable, [sys.executable, *sys.orig_argv[1:]])
+
+
 def run(args=None):
+    atexit.register(restart_if_requested)
     parser = argparse.ArgumentParser(description="Run Vintage Pi TV")
     config_group = parser.add_mutually_exclusive_group()
     if is_docker():
@@ -57,6 +72,15 @@ def run(args=None):
         absolute_default_config_paths = map(lambda p: str(Path(p).absolute()), DEFAULT_CONFIG_PATHS)
         config_help_str = f"if empty will try these in order: {', '.join(absolute_default_config_paths)}"
     config_group.add_argument("-c", "--config", dest="config_file", help=config_help_str, metavar="config.toml")
+    config_group.add_argument(
+        "--fleet",
+        action="append",
+        help=(
+            "run in fleet mode, a web UI for several Vintage Pi TVs instead of a TV, by specifying this once per unit"
+            f" as host[:port] (port defaults to {DEFAULT_PORT}), or ws://[:password@]host:port/ws"
+        ),
+        metavar="<url>",
+    )
     parser.add_argument(
         "-w",
         "--wait-for-config-seconds",
@@ -96,12 +120,30 @@ def run(args=None):
             f"{' (in Docker container /videos is added if none are specified)' if is_docker() else ''}"
         ),
     )
+    parser.add_argument(
+        "--fleet-password", help="password for the fleet mode web UI [default: none]", metavar="<password>"
+    )
     parser.add_argument(
         "--generate-videos-config", action="store_true", help="generate [[video]] for any discovered videos"
     )
+    parser.add_argument(
+        "--profile-startup",
+        help="write a report of module import times and init phase timings to this file once started up",
+        metavar="<path>",
+    )
     args = parser.parse_args(args)
 
-    if is_docker() and not args.extra_search_dirs:
+    if args.fleet and (args.extra_search_dirs or args.generate_videos_config or args.profile_startup):
+        parser.error("--fleet can't be used with search dirs, --generate-videos-config or --profile-startup")
+
+    if args.profile_startup:
+        if args.reload:
+            parser.error("--profile-startup can't be used with --reload")
+        from vintage_pi_tv.profiling import start_profiling
+
+        start_profiling(args.profile_startup)  # Before anything heavy (uvicorn, the app) gets imported
+
+    if is_docker() and not args.extra_search_dirs and not args.fleet:
         args.extra_search_dirs.append("/app/videos")
 
     if args.generate_videos_config:
@@ -112,13 +154,14 @@ def run(args=None):
         parser.error("--wait-for-config-seconds should greater than or equal to 0")
 
     # Since uvicorn needs to completely load program for --reload to work, most of these as environment variables
-    env = {
-        key: getattr(args, key)
-        for key in vars(args).keys()
-        if key not in ("reload", "host", "port", "generate_videos_config")
-    }
+    if args.fleet:
+        app, keys = "vintage_pi_tv.fleet_app:app", ("fleet", "fleet_password", "log_level_override")
+    else:
+        app, keys = "vintage_pi_tv.app:app", ("config_file", "config_wait", "log_level_override", "extra_search_dirs")
+    env = {key: getattr(args, key) for key in keys}
 
-    uvicorn_kwargs = {"host": args.host, "port": args.port}
+    # Compression mostly pays off for hello messages, and it's cheap for the small messages that make up the rest
+    uvicorn_kwargs = {"host": args.host, "port": args.port, "ws": "websockets", "ws_per_message_deflate": True}
     if args.reload:
         uvicorn_kwargs.update(
             {"reload": True, "reload_includes": ["*.py", "*.toml"], "reload_dirs": [Path(__file__).resolve().parent]}
@@ -127,7 +170,10 @@ def run(args=None):
 
     os.environ[ENV_ARGS_VAR_NAME] = json.dumps(env, sort_keys=True, separators=(",", ":"))
     os.environ["PYGAME_HIDE_SUPPORT_PROMPT"] = "1"
-    uvicorn.run("vintage_pi_tv.app:app", **uvicorn_kwargs)
+
+    import uvicorn
+
+    uvicorn.run(app, **uvicorn_kwargs)
 
 
 if __name__ == "__main__":
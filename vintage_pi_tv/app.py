@@ -1,22 +1,30 @@
 import asyncio
+from collections import Counter
 import hmac
 import json
 import logging
 import os
-from pathlib import Path
 import sys
 from time import monotonic as tick
-import weakref
 
 import janus
 from starlette.applications import Starlette
-from starlette.routing import Mount, WebSocketRoute
-from starlette.staticfiles import StaticFiles
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.requests import Request
+from starlette.responses import FileResponse, JSONResponse, Response
+from starlette.routing import Mount, Route, WebSocketRoute
 from starlette.websockets import WebSocket
 
-from .constants import ENV_ARGS_VAR_NAME, PROTOCOL_VERSION
+from . import metrics, profiling
+from .assets import WEB_DIST_DIR, PrecompressedStaticFiles
+from .constants import ENV_ARGS_VAR_NAME, PASSWORD_HEADER
+from .fanout import FanOut, handshake
+from .protocol import Topics
+from .thumbnails import CACHE_CONTROL as THUMBNAIL_CACHE_CONTROL
 from .tv import VintagePiTV
 from .utils import exit, get_vintage_pi_tv_version
+from .videos import LIBRARY_MAX_PAGE_SIZE, LIBRARY_PAGE_SIZE, LIBRARY_SORT_KEYS
 
 
 if sys.version_info < (3, 7):
@@ -25,34 +33,139 @@ if sys.version_info < (3, 7):
 
 logger = logging.getLogger(__name__)
 
-REQUIRED_BROADCAST_DATA_KEYS_TO_START = ("state", "current_rating", "ratings", "videos_db", "version", "volume")
-broadcast_data = {"version": get_vintage_pi_tv_version()}
-websockets: weakref.WeakSet[WebSocket] = weakref.WeakSet()
+REQUIRED_TOPICS_TO_START = ("state", "current_rating", "ratings", "library", "version", "volume")
+topics = Topics()
+topics.update("version", get_vintage_pi_tv_version())
+fanout = FanOut(hello=topics.hello)
 websocket_updates_queue: janus.Queue[dict] = janus.Queue()
 event_queue: janus.Queue[dict] = janus.Queue()
 
 
-async def websocket_index(websocket: WebSocket):
-    await websocket.accept()
-    greeting = await websocket.receive_json()
-    protocol_version, password = greeting.get("protocol_version"), greeting.get("password")
-
-    if protocol_version is None or password is None:
-        await websocket.close(4001, "Invalid handshake. Something went wrong.")
-
-    elif protocol_version != PROTOCOL_VERSION:
-        what, action = ("an older", "downgrade") if protocol_version > PROTOCOL_VERSION else ("a newer", "upgrade")
-        await websocket.close(4001, f"Server running {what} protocol than you. You'll need to {action} Vintage Pi TV.")
+def is_valid_password(password: str) -> bool:
+    return not tv.config.web_password or hmac.compare_digest(password, tv.config.web_password)
 
-    elif tv.config.web_password and not hmac.compare_digest(password, tv.config.web_password):
-        await websocket.close(4000, "Invalid password. Try again.")
 
-    else:
-        await websocket.send_json(broadcast_data)  # Hello message
-        websockets.add(websocket)
-        async for data in websocket.iter_json():
-            action = data.pop("action")
-            await event_queue.async_q.put({"event": "user-action", "action": action, "extras": data})
+async def websocket_index(websocket: WebSocket):
+    client = await handshake(websocket, topics, fanout, is_valid_password)
+    if client is not None:
+        try:
+            async for data in websocket.iter_json():
+                action = data.pop("action")
+                if action == "resync":  # Client missed a version of a topic, so can't apply patches to it
+                    client.resync()
+                else:
+                    await event_queue.async_q.put({"event": "user-action", "action": action, "extras": data})
+        finally:
+            fanout.remove(client)
+
+
+async def stats(request: Request):
+    return JSONResponse({"overlay_memory": tv.mpv.overlay_memory_usage(), "websockets": fanout.stats()})
+
+
+async def prometheus_metrics(request: Request):
+    return Response(metrics.registry.render(), media_type=metrics.CONTENT_TYPE)
+
+
+def register_metrics():
+    # Collected when scraped, from counters kept by whatever they measure
+    registry = metrics.registry
+    registry.gauge(
+        "info", "Always 1, with version as a label", label="version", func=lambda: {topics.get("version"): 1}
+    )
+    registry.gauge("event_queue_depth", "Events waiting for the player", func=event_queue.sync_q.qsize)
+    registry.gauge(
+        "websocket_updates_queue_depth", "Updates waiting to be published", func=websocket_updates_queue.sync_q.qsize
+    )
+    registry.gauge(
+        "library_videos",
+        "Videos in the library, by rating",
+        label="rating",
+        func=lambda: dict(Counter(video.rating or "none" for video in tv.videos.videos)),
+    )
+    registry.gauge(
+        "fps",
+        "Frames per second, by source (only observed with show-fps)",
+        label="source",
+        func=lambda: {"actual": tv.player.state.fps_actual, "video": tv.player.state.fps_video},
+    )
+    registry.gauge(
+        "overlay_memory_bytes",
+        "Overlay buffer memory held, by layer",
+        label="layer",
+        func=lambda: tv.mpv.overlay_memory_usage()["layers"],
+    )
+    registry.gauge(
+        "overlay_pool_bytes",
+        "Overlay buffer memory in the reuse pool, idle or allocated in total",
+        label="state",
+        func=lambda: {
+            key.removeprefix("pool_"): value for key, value in tv.mpv.overlay_memory_usage().items() if key != "layers"
+        },
+    )
+    registry.gauge("websocket_clients", "Connected websocket clients", func=lambda: len(fanout.clients))
+    registry.counter("websocket_published_total", "Messages published to clients", func=lambda: fanout.published)
+    registry.counter("websocket_sent_total", "Messages sent to clients", func=lambda: fanout.sent)
+    registry.counter("websocket_sent_bytes_total", "Bytes sent to clients", func=lambda: fanout.bytes_sent)
+    registry.counter("websocket_dropped_total", "Messages dropped for slow clients", func=lambda: fanout.dropped)
+    registry.counter("websocket_resyncs_total", "Hellos sent to clients that fell behind", func=lambda: fanout.resyncs)
+    registry.counter("websocket_resumed_total", "Clients that resumed their session", func=lambda: fanout.resumed)
+    registry.counter(
+        "websocket_send_latency_seconds_total",
+        "Time from publish to sent, summed over messages sent",
+        func=lambda: fanout.latency_total,
+    )
+    registry.gauge(
+        "websocket_send_latency_max_seconds", "Longest time from publish to sent", func=lambda: fanout.latency_max
+    )
+    if tv.thumbnails:
+        registry.counter(
+            "thumbnails_generated_total", "Videos thumbnails were generated for", func=lambda: tv.thumbnails.generated
+        )
+
+
+def library_etag(version: int) -> str:
+    # Responses only change when the library is rebuilt or thumbnails are generated
+    return f'"{version}.{tv.thumbnails.generated if tv.thumbnails else 0}"'
+
+
+def videos(request: Request):  # Sync, so Starlette runs it in a thread and searching doesn't block the event loop
+    if not is_valid_password(request.headers.get(PASSWORD_HEADER, "")):
+        return JSONResponse({"error": "Invalid password"}, status_code=401)
+
+    params = request.query_params
+    try:
+        offset = max(int(params.get("offset", 0)), 0)
+        limit = min(max(int(params.get("limit", LIBRARY_PAGE_SIZE)), 1), LIBRARY_MAX_PAGE_SIZE)
+    except ValueError:
+        return JSONResponse({"error": "offset and limit must be integers"}, status_code=400)
+    sort = params.get("sort", "channel")
+    if sort.removeprefix("-") not in LIBRARY_SORT_KEYS:
+        return JSONResponse({"error": f"sort must be one of {', '.join(LIBRARY_SORT_KEYS)}"}, status_code=400)
+    rating = params.get("rating") or False
+    if rating and rating not in tv.config.ratings_dict:
+        return JSONResponse({"error": f"Invalid rating: {rating}"}, status_code=400)
+
+    headers = {"ETag": library_etag(tv.videos.version), "Cache-Control": "no-cache"}
+    if request.headers.get("If-None-Match") == headers["ETag"]:
+        return Response(status_code=304, headers=headers)
+
+    version, total, page = tv.videos.query(params.get("q", ""), rating, sort, offset, limit)
+    headers["ETag"] = library_etag(version)
+    thumbnails = tv.thumbnails
+    videos = [{**video.serialize(), "thumbnail": thumbnails and thumbnails.signature(video.path)} for video in page]
+    return JSONResponse({"version": version, "total": total, "offset": offset, "videos": videos}, headers=headers)
+
+
+async def thumbnail(request: Request):
+    # Named by a signature of the video file, so can be cached forever. The web UI fetches these with the password
+    # header rather than using them as image URLs directly, since frames give away what's in the library.
+    if not is_valid_password(request.headers.get(PASSWORD_HEADER, "")):
+        return JSONResponse({"error": "Invalid password"}, status_code=401)
+    path = tv.thumbnails and tv.thumbnails.path(request.path_params["filename"])
+    if not path:
+        return Response(status_code=404)
+    return FileResponse(path, headers={"Cache-Control": THUMBNAIL_CACHE_CONTROL})
 
 
 # __main__.py passes these arguments as environment variables
@@ -66,18 +179,20 @@ if env_args := os.environ.get(ENV_ARGS_VAR_NAME):
 
 tv = VintagePiTV(websocket_updates_queue=websocket_updates_queue.sync_q, event_queue=event_queue.sync_q, **kwargs)
 background_tasks = set()
+register_metrics()
 
 
 async def websocket_publisher():
     while True:
         data = await websocket_updates_queue.async_q.get()
-        broadcast_data[data["type"]] = data["data"]
-        for websocket in websockets:
-            try:
-                await websocket.send_json({data["type"]: data["data"]})
-            except Exception:
-                logger.exception("Error writing to websocket")
-        websocket = None  # Remove reference, so weakset can recycle
+        if data["type"] == "state":
+            snapshot = data["data"]
+            if snapshot.version != tv.player.websocket_state_version:
+                continue  # Superseded by a newer snapshot, which is guaranteed to be further along in the queue
+            data = {"type": "state", "data": snapshot.serialize(show_fps=tv.config.show_fps)}
+        message = topics.update(data["type"], data["data"])
+        if message is not None:
+            fanout.publish(message)
 
 
 async def startup():
@@ -87,8 +202,9 @@ async def startup():
     error_after = tick() + 15.0  # Wait to startup for 15 seconds, then bail with error
 
     while True:
-        if all(key in broadcast_data for key in REQUIRED_BROADCAST_DATA_KEYS_TO_START):
+        if topics.has(*REQUIRED_TOPICS_TO_START):
             logger.info("Web app got required data to start. Starting...")
+            profiling.write_report(tv.startup_timer)
             break
         await asyncio.sleep(0.05)
 
@@ -103,12 +219,20 @@ async def shutdown():
 
 routes = [
     WebSocketRoute("/ws", websocket_index),
-    Mount("/", app=StaticFiles(directory=Path(__file__).parent.parent / "web" / "dist", html=True, check_dir=False)),
+    Route("/api/stats", stats),
+    Route("/metrics", prometheus_metrics),
+    Route("/api/videos", videos),
+    Route("/api/thumbnails/{filename}", thumbnail),
+    Mount("/", app=PrecompressedStaticFiles(directory=WEB_DIST_DIR, html=True, check_dir=False)),
 ]
 
 
 app = Starlette(
     routes=routes,
+    middleware=[
+        # The web client may be served from somewhere else, and connect to a server at a different URL
+        Middleware(CORSMiddleware, allow_origins=["*"], allow_headers=[PASSWORD_HEADER], expose_headers=["ETag"]),
+    ],
     debug=tv.config.log_level == "DEBUG",
     on_startup=[tv.startup, startup],
     on_shutdown=[tv.shutdown, shutdown],
@@ -0,0 +1,127 @@
+from dataclasses import dataclass
+from email.utils import formatdate
+import hashlib
+import logging
+import mimetypes
+import os
+from pathlib import Path
+import re
+import stat
+
+from starlette.datastructures import Headers
+from starlette.responses import Response
+from starlette.staticfiles import NotModifiedResponse, StaticFiles
+from starlette.types import Scope
+
+
+logger = logging.getLogger(__name__)
+
+WEB_DIST_DIR = Path(__file__).parent.parent / "web" / "dist"
+# In order of preference. Written next to each file by the precompress plugin in vite.config.js.
+ENCODINGS = (("br", ".br"), ("gzip", ".gz"))
+HASHED_FILENAME_RE = re.compile(r"/assets/[^/]+-[\w-]{8}\.\w+$")  # How vite names build output
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+MAX_CACHED_FILE_SIZE = 4 * 1024 * 1024  # Anything bigger is served from disk as usual
+
+
+def accepted_encodings(accept_encoding: str) -> set[str]:
+    accepted = set()
+    for part in accept_encoding.split(","):
+        encoding, _, params = part.partition(";")
+        params = params.strip()
+        try:
+            if not params.startswith("q=") or float(params.removeprefix("q=")) > 0:
+                accepted.add(encoding.strip().lower())
+        except ValueError:
+            pass
+    return accepted
+
+
+@dataclass(frozen=True, slots=True)
+class Asset:
+    mtime_ns: int
+    size: int
+    media_type: str
+    etag: str
+    last_modified: str
+    cache_control: str
+    bodies: dict[str, bytes]  # Encoding (or "identity") to bytes
+
+
+class PrecompressedStaticFiles(StaticFiles):
+    # Serves the web UI's build from memory, using the .br or .gz built alongside each file if the client accepts it.
+    # Files are read once, when first requested, and again only if they change. Hashed filenames never change, so they
+    # get cached forever by browsers, and everything else (ie index.html) gets revalidated with its ETag.
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._cache: dict[str, Asset] = {}
+
+    def _load(self, full_path: str, stat_result: os.stat_result) -> None | Asset:
+        if stat_result.st_size > MAX_CACHED_FILE_SIZE:
+            return None
+        with open(full_path, "rb") as file:
+            body = file.read()
+        bodies = {"identity": body}
+        for encoding, extension in ENCODINGS:
+            try:
+                if os.stat(full_path + extension).st_mtime_ns >= stat_result.st_mtime_ns:  # Otherwise, it's stale
+                    with open(full_path + extension, "rb") as file:
+                        bodies[encoding] = file.read()
+            except FileNotFoundError:
+                pass
+
+        return Asset(
+            mtime_ns=stat_result.st_mtime_ns,
+            size=stat_result.st_size,
+            media_type=mimetypes.guess_type(full_path)[0] or "text/plain",
+            etag=hashlib.md5(body, usedforsecurity=False).hexdigest(),
+            last_modified=formatdate(stat_result.st_mtime, usegmt=True),
+            cache_control=IMMUTABLE_CACHE_CONTROL if HASHED_FILENAME_RE.search(full_path) else "no-cache",
+            bodies=bodies,
+        )
+
+    def lookup_path(self, path: str) -> tuple[str, None | os.stat_result]:
+        # Runs in a thread, so reading the file into the cache here doesn't block the event loop
+        full_path, stat_result = super().lookup_path(path)
+        if stat_result is not None and stat.S_ISREG(stat_result.st_mode):
+            asset = self._cache.get(full_path)
+            if asset is None or (asset.mtime_ns, asset.size) != (stat_result.st_mtime_ns, stat_result.st_size):
+                try:
+                    asset = self._load(full_path, stat_result)
+                except OSError:
+                    logger.exception(f"Error reading {full_path}")
+                    asset = None
+                if asset is not None:
+                    self._cache[full_path] = asset
+                    logger.debug(f"Cached {path} with encodings: {', '.join(asset.bodies)}")
+        return full_path, stat_result
+
+    def file_response(self, full_path, stat_result: os.stat_result, scope: Scope, status_code: int = 200) -> Response:
+        asset = self._cache.get(str(full_path))
+        if asset is None or (asset.mtime_ns, asset.size) != (stat_result.st_mtime_ns, stat_result.st_size):
+            return super().file_response(full_path, stat_result, scope, status_code)
+
+        request_headers = Headers(scope=scope)
+        accepted = accepted_encodings(request_headers.get("accept-encoding", ""))
+        encoding = next(
+            (
+                encoding
+                for encoding, _ in ENCODINGS
+                if encoding in asset.bodies and (encoding in accepted or "*" in accepted)
+            ),
+            "identity",
+        )
+
+        headers = {
+            # Each encoding is its own representation, so it needs its own ETag
+            "ETag": f'"{asset.etag}"' if encoding == "identity" else f'"{asset.etag}-{encoding}"',
+            "Last-Modified": asset.last_modified,
+            "Cache-Control": asset.cache_control,
+        }
+        if len(asset.bodies) > 1:
+            headers["Vary"] = "Accept-Encoding"
+        if encoding != "identity":
+            headers["Content-Encoding"] = encoding
+        if self.is_not_modified(Headers(headers), request_headers):
+            return NotModifiedResponse(Headers(headers))
+        return Response(asset.bodies[encoding], status_code=status_code, headers=headers, media_type=asset.media_type)
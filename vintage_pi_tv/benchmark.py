@@ -0,0 +1,147 @@
+import argparse
+import os
+from pathlib import Path
+import queue
+import statistics
+import tempfile
+import time
+import tracemalloc
+
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")  # Headless, before pygame gets imported
+os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1")
+
+from .config import Config  # noqa: E402
+from .constants import PlayerState  # noqa: E402
+from .mpv_wrapper import HeadlessMPV  # noqa: E402
+from .osd import OSD  # noqa: E402
+from .state import StateSnapshot  # noqa: E402
+from .utils import init_logger, set_log_level  # noqa: E402
+from .videos import VideosDB  # noqa: E402
+
+
+RESOLUTIONS = {"720p": (1280, 720), "1080p": (1920, 1080), "4k": (3840, 2160)}
+VIDEO_NAMES = ("Big Buck Bunny", "Sintel (Director's Cut, Remastered Edition)", "Tears of Steel", "Elephants Dream")
+
+
+class RecordingPlayer:
+    # Stands in for mpv, counting what would have been submitted to it
+    def __init__(self):
+        self.updates: int = 0
+        self.bytes_submitted: int = 0
+
+    def overlay_add(self, overlay_id, x, y, file_or_fd, offset, fmt, w, h, stride):
+        self.updates += 1
+        self.bytes_submitted += w * h * 4
+
+    def overlay_remove(self, overlay_id):
+        pass
+
+    def reset(self):
+        self.updates = self.bytes_submitted = 0
+
+
+def benchmark_osd(mpv: HeadlessMPV, videos_db: VideosDB, config: Config, frames: int) -> dict:
+    player = mpv._player
+    osd = OSD(config=config, mpv=mpv, state_getter=lambda: None)
+    videos = videos_db.videos
+    state = StateSnapshot(state=PlayerState.PLAYING, video=videos[0], duration=3600.0)
+
+    # Every frame draws something different, so nothing is skipped by the OSD's own caching
+    def show_osd(i):
+        osd._show_osd(state.evolve(video=videos[i % len(videos)]))
+
+    def show_progress_bar(i):
+        osd._show_progress_bar(state.evolve(position=float(i), state=PlayerState.PAUSED if i % 2 else state.state))
+
+    def show_volume(i):
+        mpv._volume_cache = i % 101
+        osd._show_volume()
+
+    def notify(i):
+        osd.notify(f"Notification #{i}")
+
+    def update(i):
+        osd._osd.update()
+
+    return {
+        name: measure(func, player, frames)
+        for name, func in (
+            ("_show_osd", show_osd),
+            ("_show_progress_bar", show_progress_bar),
+            ("_show_volume", show_volume),
+            ("notify", notify),
+            ("Overlay.update", update),
+        )
+    }
+
+
+def measure(func, player: RecordingPlayer, frames: int) -> dict:
+    for i in range(min(frames, 10)):  # Warm up caches and lazily allocated overlay buffers
+        func(i)
+
+    player.reset()
+    timings = []
+    for i in range(frames):
+        start = time.perf_counter()
+        func(i)
+        timings.append(time.perf_counter() - start)
+    updates, bytes_submitted = player.updates, player.bytes_submitted
+
+    # Separate pass, since tracing slows everything down. Only sees allocations made through Python (including numpy),
+    # not SDL's surfaces.
+    tracemalloc.start()
+    allocated = 0
+    for i in range(frames):
+        tracemalloc.reset_peak()
+        baseline = tracemalloc.get_traced_memory()[0]
+        func(i)
+        allocated += tracemalloc.get_traced_memory()[1] - baseline
+    tracemalloc.stop()
+
+    timings.sort()
+    return {
+        "ms_per_frame": statistics.fmean(timings) * 1000,
+        "ms_p95": timings[int(len(timings) * 0.95)] * 1000,
+        "alloc_kib_per_frame": allocated / frames / 1024,
+        "kib_submitted_per_update": bytes_submitted / updates / 1024 if updates else 0.0,
+    }
+
+
+def run(args=None):
+    parser = argparse.ArgumentParser(description="Benchmark Vintage Pi TV's OSD rendering, headless")
+    parser.add_argument(
+        "-r",
+        "--resolution",
+        dest="resolutions",
+        action="append",
+        choices=RESOLUTIONS.keys(),
+        help="resolution(s) to benchmark [default: all]",
+    )
+    parser.add_argument("-f", "--frames", default=200, type=int, help="frames per measurement [default: 200]")
+    parser.add_argument("--show-fps", action="store_true", help="benchmark with the FPS counter in the OSD")
+    args = parser.parse_args(args)
+    if args.frames < 1:
+        parser.error("--frames should be at least 1")
+
+    init_logger()
+    set_log_level("WARNING")
+
+    with tempfile.TemporaryDirectory(prefix="vintage-pi-tv-benchmark-") as videos_dir:
+        for name in VIDEO_NAMES:
+            (Path(videos_dir) / f"{name}.mp4").touch()
+        config = Config(path=None, search_dirs=[videos_dir], show_fps=args.show_fps, log_level="WARNING")
+        videos_db = VideosDB(config=config, websocket_updates_queue=queue.Queue())  # Queue is never read
+
+        print(f"{'':>7} {'':<20} {'ms/frame':>9} {'p95 ms':>9} {'alloc KiB':>10} {'KiB/update':>11}")
+        for resolution in args.resolutions or RESOLUTIONS.keys():
+            mpv = HeadlessMPV(*RESOLUTIONS[resolution], player=RecordingPlayer())
+            for method, result in benchmark_osd(mpv, videos_db, config, args.frames).items():
+                print(
+                    f"{resolution:>7} {method:<20} {result['ms_per_frame']:>9.3f} {result['ms_p95']:>9.3f}"
+                    f" {result['alloc_kib_per_frame']:>10.1f} {result['kib_submitted_per_update']:>11.1f}"
+                )
+
+
+if __name__ == "__main__":
+    run()
@@ -1,3 +1,4 @@
+from dataclasses import dataclass
 import logging
 from pathlib import Path
 import queue
@@ -14,6 +15,78 @@ from .utils import exit, is_raspberry_pi
 
 logger = logging.getLogger(__name__)
 
+# Settings that take effect without a restart, because they're read each time they're used, or because something applies
+# them when they change (see VintagePiTV._apply_config_diff()). Everything else is only read when starting up, eg
+# mpv-options, which mpv is initialized with.
+RELOADABLE_SETTINGS = frozenset({
+    "channel_mode",
+    "default_rating",
+    "keyboard",  # Except for "enabled", see ConfigDiff.restart_reasons
+    "log_level",
+    "power_key_shutdown",
+    "ratings",
+    "ratings_dict",
+    "save_place_while_browsing",
+    "search_dirs",
+    "static_time",
+    "static_time_between_channels",
+    "subtitles_default_on",
+    "valid_file_extensions",
+    "videos",
+    "web_password",
+})
+# Only used when starting up, but not worth restarting for, so changes to these take effect the next time it starts
+STARTUP_SETTINGS = frozenset({"starting_rating", "starting_volume"})
+LIBRARY_SETTINGS = frozenset({  # Changes to these need the library rebuilt
+    "channel_mode",
+    "default_rating",
+    "ratings_dict",
+    "search_dirs",
+    "subtitles_default_on",
+    "valid_file_extensions",
+    "videos",
+})
+
+
+@dataclass(frozen=True, slots=True)
+class ConfigDiff:
+    # What changed between two loads of the config file
+    changed: dict[str, tuple[Any, Any]]  # Setting to (old, new), using attribute names like "search_dirs"
+
+    def __bool__(self) -> bool:
+        return bool(self.changed)
+
+    def __contains__(self, setting: str) -> bool:
+        return setting in self.changed
+
+    def touches(self, settings: frozenset[str]) -> bool:
+        return not settings.isdisjoint(self.changed)
+
+    @property
+    def restart_reasons(self) -> list[str]:
+        reasons = [
+            setting
+            for setting in self.changed
+            if setting not in RELOADABLE_SETTINGS and setting not in STARTUP_SETTINGS
+        ]
+        if "keyboard" in self.changed:
+            old, new = self.changed["keyboard"]
+            if old["enabled"] != new["enabled"]:
+                reasons.append("keyboard.enabled")
+        return sorted(reasons)
+
+    def without_restart(self) -> "ConfigDiff":
+        # Just the changes that can be applied while running
+        restart_reasons = self.restart_reasons
+        return ConfigDiff(
+            {setting: change for setting, change in self.changed.items() if setting not in restart_reasons}
+        )
+
+    @property
+    def next_startup(self) -> list[str]:
+        # Changed settings that won't do anything until the next time it starts
+        return [setting for setting in self.changed if setting in STARTUP_SETTINGS]
+
 
 class Config:
     aspect_mode: Literal["letterbox", "stretch", "zoom"]
@@ -28,13 +101,16 @@ class Config:
         "config-first-alphabetical",
     ]
     channel_osd_always_on: bool
+    continuous_play: bool
     crt_filter: bool
     default_rating: bool | str
     disable_osd: bool
     ir_remote: dict[str, Any]
     keyboard: dict[str, Any]
     log_level: Literal["CRITICAL", "ERROR", "WARNING", "INFO", "DEBUG"]
+    mpv_backend: Literal["embedded", "process"]
     mpv_options: dict[str, str]
+    osd_renderer: Literal["thread", "process"]
     overscan_margins: dict[str, int]
     password: Literal[False] | str
     ratings: list[dict[str, str]]
@@ -47,6 +123,7 @@ class Config:
     static_time_between_channels: float
     static_time: float
     subtitles_default_on: bool
+    thumbnails: dict[str, Any]
     valid_file_extensions: set[str]
     videos: list[dict]
 
@@ -56,8 +133,14 @@ class Config:
         websocket_updates_queue: None | queue.Queue = None,
         extra_search_dirs: list[Path] = (),
         log_level_override: None | str = None,
+        exit_on_invalid: bool = True,
         **overrides,
     ):
+        self.path: None | Path = path
+        self._extra_search_dirs: list[Path] = extra_search_dirs
+        self._log_level_override: None | str = log_level_override
+        self._overrides: dict[str, Any] = overrides
+
         if path is None:
             toml = {}
         else:
@@ -74,12 +157,18 @@ class Config:
             self._config = {k.replace("-", "_"): v for k, v in config_schema.validate(toml).items()}
             self._validate()
         except (SchemaError, InvalidConfigError) as e:
+            if not exit_on_invalid:
+                raise InvalidConfigError(str(e)) from e
             logger.critical(f"Invalid configuration: {e}")
             exit(1, "Invalid configuration")
 
         self.search_dirs.extend(
             {"path": Path(path).expanduser().resolve(), "recurse": False, "ignore": False} for path in extra_search_dirs
         )
+        # Settings _validate() resolved or derived go in the same dict as the rest, so update() can swap all at once
+        self._config = self.values()
+        for key in self._config:
+            self.__dict__.pop(key, None)
 
         if websocket_updates_queue is not None:
             websocket_updates_queue.put({"type": "ratings", "data": self.ratings})
@@ -110,6 +199,32 @@ class Config:
 
         self.videos = {video.pop("filename"): video for video in self._config.pop("video")}
 
+    def reload(self) -> "Config":
+        # Loads the file again with the same arguments. Raises InvalidConfigError (or tomllib.TOMLDecodeError, OSError)
+        # instead of exiting, so a bad edit doesn't take down a running TV.
+        return Config(
+            path=self.path,
+            extra_search_dirs=self._extra_search_dirs,
+            log_level_override=self._log_level_override,
+            exit_on_invalid=False,
+            **self._overrides,
+        )
+
+    def values(self) -> dict[str, Any]:
+        # Every setting, including the ones _validate() resolves or derives
+        values = {**self._config, **vars(self)}
+        return {key: value for key, value in values.items() if not key.startswith("_") and key != "path"}
+
+    def diff(self, other: "Config") -> ConfigDiff:
+        old, new = self.values(), other.values()
+        return ConfigDiff({
+            key: (old.get(key), new.get(key)) for key in sorted(old.keys() | new.keys()) if old.get(key) != new.get(key)
+        })
+
+    def update(self, diff: ConfigDiff):
+        # One assignment, so other threads never see some settings changed and not others
+        self._config = {**self._config, **{key: new for key, (_, new) in diff.changed.items()}}
+
     def __getattr__(self, key):
         try:
             return self._config[key]
@@ -5,6 +5,7 @@ from pathlib import Path
 
 ENV_ARGS_VAR_NAME = "__VINTAGE_PI_TV_ARGS"
 ENV_RELOAD_PID_NAME = "__VINTAGE_PI_TV_RELOAD_PID"
+ENV_RESTART_NAME = "__VINTAGE_PI_TV_RESTART"
 
 WHITE = (0xFF, 0xFF, 0xFF, 0xFF)
 TRANSPARENT = (0x00, 0x00, 0x00, 0x00)
@@ -22,6 +23,15 @@ OSD_NOTIFY_LAYER = 3
 STATIC_LAYER = 10  # Above OSD
 NO_FILES_LAYER = 62  # Second topmost
 LOADING_LAYER = 63  # Topmost
+LAYER_NAMES = {
+    OSD_LAYER: "osd",
+    OSD_PROGRESS_BAR_LAYER: "osd_progress_bar",
+    OSD_VOLUME_LAYER: "osd_volume",
+    OSD_NOTIFY_LAYER: "osd_notify",
+    STATIC_LAYER: "static",
+    NO_FILES_LAYER: "no_files",
+    LOADING_LAYER: "loading",
+}
 
 DEFAULT_PORT = 6672
 
@@ -31,6 +41,9 @@ LOG_LEVELS = ("trace", "debug", "info", "warning", "error", "critical")
 with open(Path(__file__).parent.parent / "constants.json") as _file:
     _data = json.load(_file)
 PROTOCOL_VERSION = _data["protocol_version"]
+PASSWORD_HEADER = _data["password_header"]
+WEBSOCKET_ENCODINGS = _data["encodings"]  # Most preferred first
+THUMBNAIL_STRIP_FRAMES = _data["thumbnail_strip_frames"]
 
 
 class PlayerState(enum.StrEnum):
@@ -68,6 +81,14 @@ ASPECT_MODE_STRETCH = "stretch"
 ASPECT_MODE_ZOOM = "zoom"
 ASPECT_MODES = (ASPECT_MODE_LETTERBOX, ASPECT_MODE_STRETCH, ASPECT_MODE_ZOOM)
 
+MPV_BACKEND_EMBEDDED = "embedded"
+MPV_BACKEND_PROCESS = "process"
+MPV_BACKENDS = (MPV_BACKEND_EMBEDDED, MPV_BACKEND_PROCESS)
+
+OSD_RENDERER_THREAD = "thread"
+OSD_RENDERER_PROCESS = "process"
+OSD_RENDERERS = (OSD_RENDERER_THREAD, OSD_RENDERER_PROCESS)
+
 DEFAULT_CONFIG_PATHS = (
     "/media/VintagePiTV/config.toml",
     "/boot/firmware/vintage-pi-tv-config.toml",  # In case third partition doesn't get created
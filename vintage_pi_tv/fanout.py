@@ -0,0 +1,209 @@
+import asyncio
+from collections.abc import Callable
+import json
+import logging
+from time import monotonic as tick
+
+from starlette.websockets import WebSocket
+
+from .constants import PROTOCOL_VERSION, WEBSOCKET_ENCODINGS
+from .protocol import Topics
+
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+logger = logging.getLogger(__name__)
+
+CLIENT_QUEUE_SIZE = 64  # Messages a client can fall behind by before it gets resynced instead
+
+ENCODERS: dict[str, Callable[[dict], str | bytes]] = {
+    # Same as Starlette's send_json(). Sent as text frames, everything else as binary frames.
+    "json": lambda message: json.dumps(message, ensure_ascii=False, separators=(",", ":")),
+}
+if msgpack is not None:
+    ENCODERS["msgpack"] = msgpack.packb
+
+
+def negotiate_encoding(offered: None | list[str]) -> str:
+    # Clients that don't say what they support (older ones) only get JSON
+    for encoding in WEBSOCKET_ENCODINGS:
+        if encoding in ENCODERS and encoding in (offered or ()):
+            return encoding
+    return "json"
+
+
+def encode(message: dict, encoding: str = "json") -> str | bytes:
+    return ENCODERS[encoding](message)
+
+
+def decode(data: str | bytes) -> dict:
+    # Text frames are JSON, binary frames msgpack, same as web/src/lib/encoding.js
+    if isinstance(data, bytes):
+        if msgpack is None:
+            raise ValueError("Got a msgpack message, but msgpack isn't installed")
+        return msgpack.unpackb(data)
+    return json.loads(data)
+
+
+class Client:
+    def __init__(self, fanout: "FanOut", websocket: WebSocket, encoding: str = "json"):
+        self.websocket: WebSocket = websocket
+        self.encoding: str = encoding
+        self._fanout: FanOut = fanout
+        self._queue: asyncio.Queue[tuple[float, str | bytes]] = asyncio.Queue(maxsize=CLIENT_QUEUE_SIZE)
+        self.sent: int = 0
+        self.bytes_sent: int = 0
+        self.dropped: int = 0
+        self.resyncs: int = 0
+        self.latency: float = 0.0  # Moving average of seconds from publish to sent
+        self.task: asyncio.Task = asyncio.create_task(self._writer())
+
+    def put(self, data: str | bytes, enqueued_at: float):
+        try:
+            self._queue.put_nowait((enqueued_at, data))
+        except asyncio.QueueFull:
+            self.resync(overflowed=True)
+
+    def resync(self, overflowed: bool = False, initial: bool = False):
+        # Anything queued is superseded by a full copy of every topic. Since patches only apply to the version right
+        # before them, this is the only way to catch up a client that fell behind.
+        dropped = 0
+        while not self._queue.empty():
+            self._queue.get_nowait()
+            dropped += 1
+        if overflowed:
+            self.dropped += dropped
+            self._fanout.dropped += dropped
+            logger.warning(f"Websocket client {self} fell behind by {dropped} messages, resyncing")
+        if not initial:
+            self.resyncs += 1
+            self._fanout.resyncs += 1
+        self._queue.put_nowait((tick(), encode(self._fanout.hello(), self.encoding)))
+
+    async def _writer(self):
+        while True:
+            enqueued_at, data = await self._queue.get()
+            try:
+                if isinstance(data, bytes):
+                    await self.websocket.send_bytes(data)
+                else:
+                    await self.websocket.send_text(data)
+            except Exception:
+                logger.debug(f"Error writing to websocket client {self}, dropping it")
+                self._fanout.remove(self)
+                return
+            latency = tick() - enqueued_at
+            self.latency = latency if self.sent == 0 else self.latency * 0.9 + latency * 0.1
+            self.sent += 1
+            self.bytes_sent += len(data)  # Characters for JSON, close enough since it's nearly all ASCII
+            self._fanout.record_sent(latency, len(data))
+
+    def __str__(self):
+        client = self.websocket.client
+        return f"{client.host}:{client.port}" if client else "unknown"
+
+
+class FanOut:
+    # Sends every message to all connected clients. Each message is encoded once per encoding in use, and each client
+    # has its own bounded queue and writer task, so a slow client can't hold up anyone else.
+    def __init__(self, hello: Callable[[], dict]):
+        self.hello: Callable[[], dict] = hello  # Not cached, since it has the current time in it
+        self.clients: set[Client] = set()
+        self.published: int = 0
+        self.resumed: int = 0
+        self.resyncs: int = 0
+        self.sent: int = 0
+        self.bytes_sent: int = 0
+        self.dropped: int = 0
+        self.latency_max: float = 0.0
+        self.latency_total: float = 0.0
+
+    def add(self, websocket: WebSocket, encoding: str = "json", resume: None | dict = None) -> Client:
+        # Client starts with hello, or just what it missed if it's resuming. Either way, queued before any message
+        # published after it.
+        client = Client(self, websocket, encoding)
+        if resume is None:
+            client.resync(initial=True)
+        else:
+            self.resumed += 1
+            client.put(encode(resume, encoding), tick())
+        self.clients.add(client)
+        logger.debug(
+            f"Websocket client {client} {'connected' if resume is None else 'resumed'} using"
+            f" {encoding} ({len(self.clients)} connected)"
+        )
+        return client
+
+    def remove(self, client: Client):
+        if client in self.clients:
+            self.clients.discard(client)
+            client.task.cancel()
+            logger.debug(
+                f"Websocket client {client} disconnected ({len(self.clients)} connected), sent {client.sent} messages"
+                f" ({client.bytes_sent} bytes, {client.latency * 1000:.1f}ms average latency), dropped"
+                f" {client.dropped}, resynced {client.resyncs} times"
+            )
+
+    def publish(self, message: dict):
+        self.published += 1
+        if self.clients:
+            encoded, now = {}, tick()
+            for client in list(self.clients):
+                if client.encoding not in encoded:
+                    encoded[client.encoding] = encode(message, client.encoding)
+                client.put(encoded[client.encoding], now)
+
+    def record_sent(self, latency: float, size: int):
+        self.sent += 1
+        self.bytes_sent += size
+        self.latency_total += latency
+        self.latency_max = max(self.latency_max, latency)
+
+    def stats(self) -> dict:
+        return {
+            "clients": len(self.clients),
+            "encodings": {
+                encoding: sum(1 for client in self.clients if client.encoding == encoding) for encoding in ENCODERS
+            },
+            "published": self.published,
+            "sent": self.sent,
+            "bytes_sent": self.bytes_sent,
+            "dropped": self.dropped,
+            "resumed": self.resumed,
+            "resyncs": self.resyncs,
+            "latency_average": self.latency_total / self.sent if self.sent else 0.0,
+            "latency_max": self.latency_max,
+        }
+
+
+async def handshake(
+    websocket: WebSocket, topics: Topics, fanout: FanOut, is_valid_password: Callable[[str], bool]
+) -> None | Client:
+    # Checks a new connection's greeting, and adds it as a client if it's good. Returns None if it got closed instead.
+    await websocket.accept()
+    greeting = await websocket.receive_json()
+    protocol_version, password = greeting.get("protocol_version"), greeting.get("password")
+
+    if protocol_version is None or password is None:
+        await websocket.close(4001, "Invalid handshake. Something went wrong.")
+
+    elif protocol_version != PROTOCOL_VERSION:
+        what, action = ("an older", "downgrade") if protocol_version > PROTOCOL_VERSION else ("a newer", "upgrade")
+        await websocket.close(4001, f"Server running {what} protocol than you. You'll need to {action} Vintage Pi TV.")
+
+    elif not is_valid_password(password):
+        await websocket.close(4000, "Invalid password. Try again.")
+
+    else:
+        # Client lists the encodings it can decode, and we pick one. Its messages to us are always JSON.
+        encoding = negotiate_encoding(greeting.get("encodings"))
+        # A reconnecting client sends the versions it has, so it only needs what it missed rather than a hello
+        resume = greeting.get("resume")
+        resume = topics.resume(resume.get("session"), resume.get("versions")) if isinstance(resume, dict) else None
+        return fanout.add(websocket, encoding=encoding, resume=resume)
+
+    return None
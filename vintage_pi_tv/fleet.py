@@ -0,0 +1,247 @@
+import asyncio
+import hmac
+import json
+import logging
+from time import monotonic as tick
+from urllib.parse import unquote, urlencode, urlsplit, urlunsplit
+import urllib.request
+
+import websockets
+from websockets.exceptions import ConnectionClosed, WebSocketException
+
+from .constants import DEFAULT_PORT, PASSWORD_HEADER, PROTOCOL_VERSION
+from .fanout import ENCODERS, FanOut, decode
+from .protocol import Topics, apply_message
+from .utils import get_vintage_pi_tv_version, retry_task_wrapper
+from .videos import LIBRARY_MAX_PAGE_SIZE, LIBRARY_PAGE_SIZE
+
+
+logger = logging.getLogger(__name__)
+logging.getLogger("websockets.client").setLevel(logging.INFO)  # Silence logs of every frame sent and received
+
+RECONNECT_DELAY = 2.0  # Same as the web client's maxReconnectionDelay
+HTTP_TIMEOUT = 15.0
+UNIT_TOPICS = ("version", "state", "current_rating", "ratings", "volume", "library")  # Passed through to fleet clients
+
+
+class Unit:
+    # One Vintage Pi TV the fleet is connected to, as a client of its websocket like the web UI is. URLs are like
+    # ws://host:port/ws, with an optional password as ws://:password@host:port/ws, or just host[:port] for short.
+    def __init__(self, fleet: "Fleet", url: str):
+        parsed = urlsplit(url if "://" in url else f"ws://{url}")
+        if parsed.scheme not in ("ws", "wss") or not parsed.hostname:
+            raise ValueError(f"Invalid unit URL {url!r}, should look like ws://host:port/ws")
+        host = f"[{parsed.hostname}]" if ":" in parsed.hostname else parsed.hostname
+        netloc = f"{host}:{parsed.port or DEFAULT_PORT}"
+
+        self.id: str = netloc
+        self.url: str = urlunsplit((parsed.scheme, netloc, parsed.path or "/ws", "", ""))  # Without the password
+        self.videos_url: str = urlunsplit(
+            ("https" if parsed.scheme == "wss" else "http", netloc, "/api/videos", "", "")
+        )
+        self.password: str = unquote(parsed.password or "")
+        self.topics: dict[str, dict] = {}
+        self.session: None | str = None
+        self.connected: bool = False
+        self.failure: None | str = None
+        self.videos: list[dict] = []  # Its whole library, fetched over HTTP whenever its version changes
+        self.library_version: None | int = None
+        self._fleet: Fleet = fleet
+        self._websocket = None
+        self._clock_offset: float = 0.0  # Our monotonic clock minus the unit's
+        self._library_changed: asyncio.Event = asyncio.Event()
+
+    def serialize(self) -> dict:
+        data = {name: self.topics[name]["data"] if name in self.topics else None for name in UNIT_TOPICS}
+        anchor = data["state"] and data["state"].get("anchor")
+        if anchor:  # Moved onto our clock, so fleet clients can extrapolate from it with the time in our hellos
+            data["state"] = {**data["state"], "anchor": {**anchor, "time": anchor["time"] + self._clock_offset}}
+        return {"url": self.url, "connected": self.connected, "failure": self.failure, **data}
+
+    def _greeting(self) -> dict:
+        greeting = {"password": self.password, "protocol_version": PROTOCOL_VERSION, "encodings": list(ENCODERS)}
+        if self.session is not None:
+            versions = {name: topic["version"] for name, topic in self.topics.items()}
+            greeting["resume"] = {"session": self.session, "versions": versions}
+        return greeting
+
+    async def send(self, message: dict):
+        if self._websocket is None:
+            logger.debug(f"Not sending {message['action']} to unit {self.id}, since it's disconnected")
+            return
+        try:
+            await self._websocket.send(json.dumps(message))
+        except ConnectionClosed:
+            pass  # Noticed by _connection_task()
+
+    async def _handle(self, message: dict):
+        if "hello" in message:
+            self.session = message["session"]
+        if "time" in message:
+            self._clock_offset = tick() - message["time"]
+        if not apply_message(self.topics, message):
+            logger.warning(f"Missed an update to {message.get('topic')} from unit {self.id}, resyncing")
+            await self.send({"action": "resync"})
+            return
+        self.connected, self.failure = True, None
+        library = self.topics.get("library")
+        if library and library["data"]["version"] != self.library_version:
+            self._library_changed.set()
+        self._fleet.unit_changed(self)
+
+    async def _connection_task(self):
+        # Reconnects forever, resuming the session where it can like the web client
+        while True:
+            try:
+                async with websockets.connect(self.url, max_size=None) as websocket:
+                    await websocket.send(json.dumps(self._greeting()))
+                    self._websocket = websocket
+                    async for data in websocket:
+                        await self._handle(decode(data))
+            except ConnectionClosed as e:
+                if e.rcvd and e.rcvd.code >= 4000:  # Closed on purpose, eg wrong password
+                    self.failure = e.rcvd.reason
+                    logger.error(f"Unit {self.id} closed the connection: {e.rcvd.reason}")
+            except (OSError, asyncio.TimeoutError, WebSocketException, ValueError) as e:
+                self.failure = f"Couldn't connect: {e}"
+                logger.debug(f"Couldn't connect to unit {self.id}: {e}")
+            finally:
+                self._websocket = None
+
+            if self.connected:
+                logger.warning(f"Lost connection to unit {self.id}, reconnecting")
+            self.connected = False
+            self._fleet.unit_changed(self)
+            await asyncio.sleep(RECONNECT_DELAY)
+
+    def _fetch_videos(self) -> tuple[int, list[dict]]:
+        # Sync, so run in a thread. Pages through the whole library, starting over if it changes while doing so.
+        version, videos = None, []
+        while True:
+            params = urlencode({"offset": len(videos), "limit": LIBRARY_MAX_PAGE_SIZE})
+            request = urllib.request.Request(f"{self.videos_url}?{params}", headers={PASSWORD_HEADER: self.password})
+            with urllib.request.urlopen(request, timeout=HTTP_TIMEOUT) as response:
+                page = json.load(response)
+            if version is not None and page["version"] != version:
+                version, videos = None, []
+                continue
+            version = page["version"]
+            videos.extend(page["videos"])
+            if not page["videos"] or len(videos) >= page["total"]:
+                return version, videos
+
+    async def _library_task(self):
+        while True:
+            await self._library_changed.wait()
+            self._library_changed.clear()
+            try:
+                version, videos = await asyncio.to_thread(self._fetch_videos)
+            except (OSError, ValueError, KeyError) as e:
+                logger.warning(f"Couldn't fetch library from unit {self.id}, retrying: {e}")
+                await asyncio.sleep(RECONNECT_DELAY)
+                self._library_changed.set()
+                continue
+            logger.info(f"Fetched {len(videos)} videos from unit {self.id}")
+            self.library_version, self.videos = version, videos
+            self._fleet.rebuild_library()
+
+    def start(self) -> list[asyncio.Task]:
+        return [
+            asyncio.create_task(retry_task_wrapper(func)(), name=f"{func.__name__.removeprefix('_')}:{self.id}")
+            for func in (self._connection_task, self._library_task)
+        ]
+
+
+class Fleet:
+    # Aggregates several Vintage Pi TVs, so one web UI can watch and control them all. Upstream it's a client of each
+    # unit's websocket, and downstream it speaks the same protocol, with a "fleet" topic of each unit's state and a
+    # "library" topic for the merged library (served over HTTP by query() the same way a unit serves its own).
+    def __init__(self, urls: list[str], password: None | str = None):
+        self.password: None | str = password
+        self.units: dict[str, Unit] = {}
+        for url in urls:
+            unit = Unit(self, url)
+            if unit.id in self.units:
+                raise ValueError(f"Unit {unit.id} specified more than once")
+            self.units[unit.id] = unit
+
+        self.topics: Topics = Topics()
+        self.fanout: FanOut = FanOut(hello=self.topics.hello)
+        # Merged library as (version, videos with a list of units that have each one, search text for each). Only ever
+        # replaced whole, so query() in a worker thread never sees one half of a rebuild.
+        self._library: tuple[int, list[dict], list[str]] = (0, [], [])
+        self._paths: dict[str, dict[str, str]] = {}  # Filename to unit ID to its path on that unit
+        self._tasks: list[asyncio.Task] = []
+
+        self._publish("version", get_vintage_pi_tv_version())
+        self._publish("library", {"version": 0, "count": 0})
+        self._publish("fleet", {unit.id: unit.serialize() for unit in self.units.values()})
+
+    def is_valid_password(self, password: str) -> bool:
+        return not self.password or hmac.compare_digest(password, self.password)
+
+    def _publish(self, name: str, data):
+        message = self.topics.update(name, data)
+        if message is not None:
+            self.fanout.publish(message)
+
+    def unit_changed(self, unit: Unit):
+        # Patched per unit, so a unit's update only sends that unit to clients
+        self._publish("fleet", {**self.topics.get("fleet"), unit.id: unit.serialize()})
+
+    def rebuild_library(self):
+        # Deduplicated by filename, which is normalized, so the same file found on several units is one video. Name and
+        # rating come from the first unit with it, in the order units were specified.
+        merged: dict[str, dict] = {}
+        paths: dict[str, dict[str, str]] = {}
+        for unit in self.units.values():
+            for video in unit.videos:
+                filename = video["filename"]
+                if filename not in merged:
+                    merged[filename] = {"name": video["name"], "filename": filename, "rating": video["rating"]}
+                    paths[filename] = {}
+                paths[filename].setdefault(unit.id, video["path"])
+
+        videos = sorted(merged.values(), key=lambda video: (video["name"].casefold(), video["filename"]))
+        for channel, video in enumerate(videos, 1):
+            video.update({"channel": channel, "units": list(paths[video["filename"]])})
+
+        self._paths = paths
+        version, current, _ = self._library
+        if videos != current:
+            version += 1
+            self._library = (version, videos, [f"{video['name']}\n{video['filename']}".casefold() for video in videos])
+            logger.info(f"Merged library has {len(videos)} videos (version {version})")
+            self._publish("library", {"version": version, "count": len(videos)})
+
+    def query(self, search: str = "", offset: int = 0, limit: int = LIBRARY_PAGE_SIZE) -> tuple[int, int, list[dict]]:
+        # Same as VideosDB.query(), minus sorting and rating. Returns (version, total matching, a page of them).
+        terms = search.casefold().split()
+        version, videos, search_texts = self._library
+        matches = [
+            video for video, search_text in zip(videos, search_texts) if all(term in search_text for term in terms)
+        ]
+        return version, len(matches), matches[offset : offset + limit]
+
+    async def action(self, action: str, extras: dict):
+        # Sent to the units listed in extras, or all of them. Videos to play are given by filename, since their paths
+        # can be different on each unit.
+        unit_ids = extras.pop("units", None)
+        units = [self.units[unit_id] for unit_id in unit_ids or self.units if unit_id in self.units]
+        if action == "play":
+            paths = self._paths.get(extras.pop("video", None), {})
+            messages = {unit: {"action": action, "path": paths[unit.id]} for unit in units if unit.id in paths}
+        else:
+            messages = {unit: {"action": action, **extras} for unit in units}
+        logger.debug(f"Sending {action} to {', '.join(unit.id for unit in messages) or 'no units'}")
+        await asyncio.gather(*(unit.send(message) for unit, message in messages.items()))
+
+    async def startup(self):
+        logger.info(f"Starting fleet of {len(self.units)} units: {', '.join(self.units)}")
+        for unit in self.units.values():
+            self._tasks.extend(unit.start())
+
+    async def shutdown(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
@@ -0,0 +1,95 @@
+import json
+import logging
+import os
+
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.requests import Request
+from starlette.responses import JSONResponse, Response
+from starlette.routing import Mount, Route, WebSocketRoute
+from starlette.websockets import WebSocket
+
+from .assets import WEB_DIST_DIR, PrecompressedStaticFiles
+from .constants import ENV_ARGS_VAR_NAME, PASSWORD_HEADER
+from .fanout import handshake
+from .fleet import Fleet
+from .utils import init_logger, set_log_level
+from .videos import LIBRARY_MAX_PAGE_SIZE, LIBRARY_PAGE_SIZE
+
+
+# Web app for fleet mode (see fleet.py), instead of app.py. Same routes as far as the web client is concerned.
+
+logger = logging.getLogger(__name__)
+
+
+async def websocket_index(websocket: WebSocket):
+    client = await handshake(websocket, fleet.topics, fleet.fanout, fleet.is_valid_password)
+    if client is not None:
+        try:
+            async for data in websocket.iter_json():
+                action = data.pop("action")
+                if action == "resync":
+                    client.resync()
+                else:
+                    await fleet.action(action, data)
+        finally:
+            fleet.fanout.remove(client)
+
+
+async def stats(request: Request):
+    return JSONResponse({
+        "websockets": fleet.fanout.stats(),
+        "units": {unit.id: {"connected": unit.connected, "videos": len(unit.videos)} for unit in fleet.units.values()},
+    })
+
+
+def videos(request: Request):
+    if not fleet.is_valid_password(request.headers.get(PASSWORD_HEADER, "")):
+        return JSONResponse({"error": "Invalid password"}, status_code=401)
+
+    params = request.query_params
+    try:
+        offset = max(int(params.get("offset", 0)), 0)
+        limit = min(max(int(params.get("limit", LIBRARY_PAGE_SIZE)), 1), LIBRARY_MAX_PAGE_SIZE)
+    except ValueError:
+        return JSONResponse({"error": "offset and limit must be integers"}, status_code=400)
+
+    version, total, page = fleet.query(params.get("q", ""), offset, limit)
+    headers = {"ETag": f'"{version}"', "Cache-Control": "no-cache"}
+    if request.headers.get("If-None-Match") == headers["ETag"]:
+        return Response(status_code=304, headers=headers)
+    return JSONResponse({"version": version, "total": total, "offset": offset, "videos": page}, headers=headers)
+
+
+# __main__.py passes these arguments as environment variables
+kwargs = {}
+if env_args := os.environ.get(ENV_ARGS_VAR_NAME):
+    try:
+        kwargs.update(json.loads(env_args))
+    except json.JSONDecodeError:
+        logger.critical(f"Error decoding JSON from environment variable {ENV_ARGS_VAR_NAME}: {env_args}")
+
+init_logger()
+log_level = (kwargs.get("log_level_override") or "info").upper()
+set_log_level(log_level)
+fleet = Fleet(urls=kwargs.get("fleet") or [], password=kwargs.get("fleet_password"))
+
+
+routes = [
+    WebSocketRoute("/ws", websocket_index),
+    Route("/api/stats", stats),
+    Route("/api/videos", videos),
+    Mount("/", app=PrecompressedStaticFiles(directory=WEB_DIST_DIR, html=True, check_dir=False)),
+]
+
+
+app = Starlette(
+    routes=routes,
+    middleware=[
+        Middleware(CORSMiddleware, allow_origins=["*"], allow_headers=[PASSWORD_HEADER], expose_headers=["ETag"]),
+    ],
+    debug=log_level == "DEBUG",
+    on_startup=[fleet.startup],
+    on_shutdown=[fleet.shutdown],
+)
@@ -10,8 +10,6 @@ import tempfile
 import time
 from typing import TYPE_CHECKING
 
-import tomlkit
-
 from .constants import DEFAULT_IR_SCANCODES, VALID_KEYS
 
 
@@ -52,16 +50,23 @@ class Keyboard:
         self._config: Config = config
         self.blocked: bool = True  # Only to be modified by player thread
 
-        self._keys_to_actions: dict[str, str] = {
-            value: key for key, value in self._config.keyboard.items() if value and key in VALID_KEYS
-        }
+        self._keys_to_actions: dict[str, str] = {}
+        self.reload_keys()
 
         if self._config.ir_remote["enabled"]:
             self._enable_ir_remote()
         else:
             logger.info("IR remote disabled")
 
+    def reload_keys(self):
+        # Replaced all at once, so the keyboard thread never sees a partial mapping
+        self._keys_to_actions = {
+            value: key for key, value in self._config.keyboard.items() if value and key in VALID_KEYS
+        }
+
     def _enable_ir_remote(self):
+        import tomlkit
+
         scancodes = tomlkit.table()
 
         for key in DEFAULT_IR_SCANCODES.keys():
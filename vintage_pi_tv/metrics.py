@@ -0,0 +1,89 @@
+from collections.abc import Callable
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+METRIC_PREFIX = "vintage_pi_tv_"
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"  # Prometheus text exposition format
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class Metric:
+    # Either owns its values, which are changed by inc() or set(), or collects them with func when scraped. Owned values
+    # can be changed from any thread (ie overlay updates come from the OSD, player and static threads) without a lock,
+    # since they're on hot paths. An increment racing another can get lost, which is fine for metrics.
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        metric_type: str,
+        label: None | str = None,
+        func: None | Callable[[], float | dict[str, float]] = None,
+    ):
+        self.name: str = METRIC_PREFIX + name
+        self.help: str = help
+        self.metric_type: str = metric_type
+        self.label: None | str = label
+        self._func: None | Callable[[], float | dict[str, float]] = func
+        self._values: dict[None | str, float] = {} if label else {None: 0}
+
+    def inc(self, amount: float = 1, label_value: None | str = None):
+        self._values[label_value] = self._values.get(label_value, 0) + amount
+
+    def set(self, value: float, label_value: None | str = None):
+        self._values[label_value] = value
+
+    def samples(self) -> dict[None | str, float]:
+        if self._func is None:
+            return self._values.copy()  # Another thread could add a label value while rendering. Copying is atomic.
+        values = self._func()
+        return values if isinstance(values, dict) else {None: values}
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.metric_type}"]
+        for label_value, value in self.samples().items():
+            labels = "" if label_value is None else f'{{{self.label}="{_escape(label_value)}"}}'
+            lines.append(f"{self.name}{labels} {float(value)!r}")
+        return "\n".join(lines)
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: dict[str, Metric] = {}
+
+    def _register(self, metric: Metric) -> Metric:
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric {metric.name} already registered")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help: str, **kwargs) -> Metric:
+        return self._register(Metric(name, help, "counter", **kwargs))
+
+    def gauge(self, name: str, help: str, **kwargs) -> Metric:
+        return self._register(Metric(name, help, "gauge", **kwargs))
+
+    def render(self) -> str:
+        rendered = []
+        for metric in self._metrics.values():
+            try:
+                rendered.append(metric.render())
+            except Exception:
+                logger.exception(f"Error collecting metric {metric.name}")
+        return "\n".join(rendered) + "\n"
+
+
+registry = Registry()
+
+# Metrics updated where things happen. The rest are collected when scraped, see app.py.
+library_rebuilds = registry.counter("library_rebuilds_total", "Times the library was rebuilt")
+library_rebuild_seconds = registry.counter("library_rebuild_seconds_total", "Time spent rebuilding the library")
+library_last_rebuild_seconds = registry.gauge("library_last_rebuild_seconds", "How long the last rebuild took")
+frames_dropped = registry.counter("frames_dropped_total", "Frames dropped by mpv, across all videos")
+overlay_updates = registry.counter(
+    "overlay_updates_total", "Overlay images submitted to mpv, by layer (osd* layers are the OSD)", label="layer"
+)
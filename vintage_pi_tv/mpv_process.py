@@ -0,0 +1,204 @@
+import atexit
+from collections import defaultdict
+from collections.abc import Callable
+import itertools
+import json
+import logging
+import shutil
+import socket
+import subprocess
+import threading
+
+
+logger = logging.getLogger(__name__)
+
+
+# Options libmpv defaults to that the mpv command line doesn't, so both backends behave the same way
+LIBMPV_DEFAULT_OPTIONS = {
+    "audio-display": "no",
+    "config": "no",
+    "idle": "yes",
+    "input-default-bindings": "no",
+    "input-terminal": "no",
+    "input-vo-keyboard": "no",
+    "osc": "no",
+    "terminal": "no",
+}
+KEY_BINDING_MESSAGE = "vintage-pi-tv-key"
+REPLY_TIMEOUT = 5.0
+
+
+class MPVProcessError(Exception):
+    pass
+
+
+class MPVProcessEvent:
+    def __init__(self, data: dict):
+        self._data: dict = data
+
+    def as_dict(self, decoder=None) -> dict:
+        # Events over JSON IPC are already decoded, so the decoder that python-mpv requires is ignored
+        return self._data
+
+
+class MPVProcess:
+    # Drop-in replacement for the subset of python-mpv's mpv.MPV used by mpv_wrapper.MPV that runs mpv as a child
+    # process, controlled over its JSON IPC protocol. Since mpv's threads don't live in our interpreter, a stall in
+    # Python (the GIL, garbage collection, etc) can't stutter playback.
+
+    # Overlays can't be passed to another process by memory address, so they need to be backed by files
+    needs_shared_memory_overlays: bool = True
+
+    def __init__(self, log_handler=None, loglevel=None, **options):
+        executable = shutil.which("mpv")
+        if executable is None:
+            raise MPVProcessError("Couldn't find mpv executable in PATH")
+
+        options = {**LIBMPV_DEFAULT_OPTIONS, **{k.replace("_", "-"): v for k, v in options.items()}}
+        parent_socket, child_socket = socket.socketpair(socket.AF_UNIX, socket.SOCK_STREAM)
+        args = [executable, f"--input-ipc-client=fd://{child_socket.fileno()}"]
+        args.extend(f"--{k}={('yes' if v else 'no') if isinstance(v, bool) else v}" for k, v in options.items())
+
+        logger.debug(f"Spawning mpv process: {' '.join(args)}")
+        self._process: subprocess.Popen = subprocess.Popen(
+            args, pass_fds=(child_socket.fileno(),), stdin=subprocess.DEVNULL
+        )
+        self._socket: socket.socket = parent_socket
+        self._write_lock: threading.Lock = threading.Lock()
+        self._request_ids: itertools.count = itertools.count(1)
+        self._observer_ids: itertools.count = itertools.count(1)
+        self._replies: dict[int, dict] = {}
+        self._event_callbacks: defaultdict[str, list] = defaultdict(list)
+        self._property_observers: dict[int, Callable] = {}
+        self._key_bindings: dict[str, Callable] = {}
+        self._log_handler = log_handler
+        child_socket.close()
+        atexit.register(self.terminate)
+
+        threading.Thread(target=self._read_thread, name="mpv_process", daemon=True).start()
+
+        if log_handler is not None:
+            self.command("request_log_messages", loglevel or "status")
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return self.command("get_property", name.replace("_", "-"))
+
+    def __setattr__(self, name, value):
+        if name.startswith("_"):
+            super().__setattr__(name, value)
+        else:
+            self.command("set_property", name.replace("_", "-"), value)
+
+    def _send(self, payload: dict):
+        data = json.dumps(payload, separators=(",", ":")).encode() + b"\n"
+        with self._write_lock:
+            self._socket.sendall(data)
+
+    def _read_thread(self):
+        with self._socket.makefile("rb") as file:
+            for line in file:
+                try:
+                    message = json.loads(line)
+                except json.JSONDecodeError:
+                    logger.warning(f"Got invalid JSON from mpv process: {line!r}")
+                    continue
+
+                if "event" in message:
+                    self._handle_event(message)
+                elif (reply := self._replies.get(message.get("request_id"))) is not None:
+                    reply["message"] = message
+                    reply["event"].set()
+
+        logger.warning("Connection to mpv process closed")
+        for reply in list(self._replies.values()):
+            reply["event"].set()  # Wake up any waiting commands, with no message
+        self._handle_event({"event": "shutdown"})
+
+    def _handle_event(self, message: dict):
+        # Runs on the read thread, so callbacks must never wait on a reply from mpv
+        name = message["event"]
+        if name == "property-change":
+            if (callback := self._property_observers.get(message.get("id"))) is not None:
+                callback(message["name"], message.get("data"))
+        elif name == "log-message":
+            if self._log_handler is not None:
+                self._log_handler(message["level"], message["prefix"], message["text"])
+        elif name == "client-message":
+            args = message.get("args", [])
+            if len(args) == 2 and args[0] == KEY_BINDING_MESSAGE and (callback := self._key_bindings.get(args[1])):
+                callback()
+
+        for callback in self._event_callbacks[name]:
+            callback(MPVProcessEvent(message))
+
+    def command(self, *args, **kwargs):
+        request_id = next(self._request_ids)
+        reply = self._replies[request_id] = {"event": threading.Event(), "message": None}
+        try:
+            self._send({"command": kwargs or list(args), "request_id": request_id})
+            if not reply["event"].wait(REPLY_TIMEOUT):
+                raise MPVProcessError(f"Timed out waiting for mpv to reply to command: {args or kwargs}")
+        finally:
+            del self._replies[request_id]
+
+        message = reply["message"]
+        if message is None:
+            raise MPVProcessError(f"Connection to mpv process closed while running command: {args or kwargs}")
+        if message.get("error") != "success":
+            raise MPVProcessError(f"mpv command {args or kwargs} failed: {message.get('error')}")
+        return message.get("data")
+
+    def event_callback(self, *event_types):
+        def wrapper(func):
+            for event_type in event_types:
+                self._event_callbacks[event_type].append(func)
+            return func
+
+        return wrapper
+
+    def property_observer(self, name: str):
+        def wrapper(func):
+            observer_id = next(self._observer_ids)
+            self._property_observers[observer_id] = func
+            self.command("observe_property", observer_id, name)
+            return func
+
+        return wrapper
+
+    def on_key_press(self, key: str):
+        def wrapper(func):
+            self._key_bindings[key] = func
+            self.command("keybind", key, f"script-message {KEY_BINDING_MESSAGE} {json.dumps(key)}")
+            return func
+
+        return wrapper
+
+    def loadfile(self, filename: str, mode: str = "replace", **options):
+        options = {k.replace("_", "-"): str(v) for k, v in options.items()}
+        self.command(name="loadfile", url=filename, flags=mode, options=options)
+
+    def playlist_clear(self):
+        self.command("playlist_clear")
+
+    def stop(self):
+        self.command("stop")
+
+    def seek(self, amount: float, reference: str = "relative"):
+        self.command("seek", amount, reference)
+
+    def overlay_add(self, overlay_id, x, y, file_or_fd, offset, fmt, w, h, stride):
+        self.command("overlay_add", overlay_id, x, y, file_or_fd, offset, fmt, w, h, stride)
+
+    def overlay_remove(self, overlay_id):
+        self.command("overlay_remove", overlay_id)
+
+    def terminate(self):
+        if self._process.poll() is None:
+            logger.debug("Terminating mpv process")
+            self._process.terminate()
+            try:
+                self._process.wait(timeout=2.0)
+            except subprocess.TimeoutExpired:
+                self._process.kill()
@@ -1,15 +1,20 @@
+from collections.abc import Callable
+import functools
 import logging
 import os
 from pathlib import Path
 import queue
+import tempfile
+import threading
+import time
 from typing import Literal
 
-import mpv
 import numpy
 import numpy.typing
 import pygame
 import pygame.freetype
 
+from . import metrics
 from .config import Config
 from .constants import (
     ASPECT_MODE_STRETCH,
@@ -17,6 +22,8 @@ from .constants import (
     BLACK_SEETHRU,
     DATA_DIR,
     DOCKER_DEV_KEYBOARD_KEYS,
+    LAYER_NAMES,
+    MPV_BACKEND_PROCESS,
     TRANSPARENT,
     WHITE,
 )
@@ -46,6 +53,15 @@ LOG_LEVEL_MPV_MAPPING = {
     "TRACE": "debug",
 }
 
+GLYPH_ATLAS_CHARACTERS = "0123456789:%./- Volmuted"  # Everything in timestamps, channel numbers and volume
+GLYPH_ATLAS_FONTS = ((25, "regular"), (44, "regular"), (120, "bold"))  # (size, font) the OSD renders numbers in
+TEXT_CACHE_SIZE = 128  # Rendered text surfaces to keep around, per cache
+COMPOSED_TEXT_CACHE_SIZE = 16  # Small, since it's mostly timestamps that won't be seen again (durations and volume are)
+OVERLAY_RELEASE_SECONDS = 30.0  # Hidden overlays hand their buffer back to the pool after this long unused
+OVERLAY_POOL_MAX_IDLE = 1  # Unused buffers the pool holds on to, the rest get freed
+
+SHARED_MEMORY_DIR = "/dev/shm" if os.path.isdir("/dev/shm") else None  # None falls back to the temp directory
+
 
 def mpv_log(level, prefix, text):
     # Filter out ugly logs
@@ -53,37 +69,239 @@ def mpv_log(level, prefix, text):
         logger.log(MPV_LOG_LEVEL_MAPPING.get(level, logging.INFO), f"[mpv/{prefix}] {text.rstrip()}")
 
 
+class GlyphAtlas:
+    # Space Mono is monospaced and hinted to whole pixel advances, so once every glyph is rasterized, a string can be
+    # composed by placing each one at its pen position with numpy. No font rendering needed. The result has the same
+    # metrics as freetype's, which sizes text to the union of its glyphs' boxes (a space's box is its advance).
+    def __init__(self, font: pygame.freetype.Font, size: float, characters: str):
+        self.advance: int = round(font.get_metrics(characters[0], size=size)[0][4])
+        # Box relative to the pen position and baseline like freetype's (y is up), and coverage (0-255), None if empty
+        self._glyphs: dict[str, tuple[pygame.Rect, None | numpy.typing.NDArray]] = {}
+        for char in characters:
+            rect = font.get_rect(char, size=size)
+            coverage = None
+            if rect.width > 0 and rect.height > 0:
+                surf, rect = font.render(char, fgcolor=WHITE, size=size)
+                coverage = numpy.ascontiguousarray(pygame.surfarray.array_alpha(surf).T)
+            self._glyphs[char] = (rect, coverage)
+
+    def can_render(self, text: str) -> bool:
+        return bool(text) and all(char in self._glyphs for char in text)
+
+    def get_rect(self, text: str) -> pygame.Rect:
+        # Same as font.get_rect(text, size=size)
+        glyphs = [(i * self.advance, self._glyphs[char][0]) for i, char in enumerate(text)]
+        left = min(x + rect.x for x, rect in glyphs)
+        ascent = max(rect.y for _, rect in glyphs)
+        return pygame.Rect(
+            left,
+            ascent,
+            max(x + rect.right for x, rect in glyphs) - left,
+            ascent - min(rect.y - rect.height for _, rect in glyphs),
+        )
+
+    def compose(self, text: str, color, bgcolor, padding: tuple[int, int, int, int]) -> numpy.typing.NDArray:
+        text_rect = self.get_rect(text)
+        top, right, bottom, left = padding
+        coverage = numpy.zeros((text_rect.height + top + bottom, text_rect.width + left + right), dtype=numpy.uint8)
+        for i, char in enumerate(text):
+            rect, glyph = self._glyphs[char]
+            if glyph is not None:
+                x = left + i * self.advance + rect.x - text_rect.x
+                y = top + text_rect.y - rect.y
+                region = coverage[y : y + rect.height, x : x + rect.width]
+                numpy.maximum(region, glyph, out=region)  # In case glyphs ever overlap
+        # Every pixel is one of 256 colors, so look up whole BGRA pixels as uint32s (much faster than byte by byte)
+        pixels = self._blend_table(tuple(pygame.Color(color)), tuple(pygame.Color(bgcolor)))[coverage]
+        return pixels.view(numpy.uint8).reshape(*coverage.shape, 4)
+
+    @staticmethod
+    @functools.lru_cache(maxsize=TEXT_CACHE_SIZE)
+    def _blend_table(color: tuple[int, int, int, int], bgcolor: tuple[int, int, int, int]) -> numpy.typing.NDArray:
+        # BGRA pixel for each coverage value as a uint32, blended with the background color the way freetype does it
+        color, bgcolor = pygame.Color(color), pygame.Color(bgcolor)
+        if bgcolor.a == 0:  # Nothing to blend with, so edges keep the text's color
+            bgcolor = pygame.Color(color.r, color.g, color.b, 0)
+        fg_alpha = numpy.arange(0x100, dtype=numpy.float32) / 0xFF * (color.a / 0xFF)
+        channels = [
+            bg + (fg - bg) * fg_alpha
+            for fg, bg in ((color.b, bgcolor.b), (color.g, bgcolor.g), (color.r, bgcolor.r), (0xFF, bgcolor.a))
+        ]
+        return numpy.stack(channels, axis=-1).round().astype(numpy.uint8).view(numpy.uint32).ravel()
+
+
+class OverlayBuffer:
+    def __init__(
+        self, mpv: "MPV", array: None | numpy.typing.ArrayLike = None, shape: None | tuple[int, int, int] = None
+    ):
+        shape = shape or (mpv.shape if array is None else numpy.shape(array))
+        self._file = None
+        if mpv._shared_memory_overlays:
+            # mpv runs in another process, so hand it a file in shared memory rather than a pointer to our memory
+            self._file = tempfile.NamedTemporaryFile(prefix="vintage-pi-tv-overlay-", dir=SHARED_MEMORY_DIR)
+            self._file.truncate(shape[0] * shape[1] * shape[2])
+            self.array: numpy.typing.ArrayLike = numpy.memmap(self._file, dtype=numpy.uint8, shape=shape)
+            if array is not None:
+                self.array[:] = array
+            self.source: str = self._file.name
+        else:
+            self.array: numpy.typing.ArrayLike = numpy.zeros(shape, dtype=numpy.uint8) if array is None else array
+            self.source: str = f"&{self.array.ctypes.data}"
+        self.nbytes: int = self.array.nbytes
+
+
+class OverlayBufferPool:
+    # Every overlay is full screen (33MB each at 4K), but most are hidden most of the time. So overlays borrow their
+    # buffers from here when they draw, and hand them back after being hidden for a while.
+    def __init__(self, mpv: "MPV", max_idle: int = OVERLAY_POOL_MAX_IDLE):
+        self._mpv: "MPV" = mpv
+        self._max_idle: int = max_idle
+        self._idle: list[OverlayBuffer] = []
+        self._lock: threading.Lock = threading.Lock()
+        self.bytes_allocated: int = 0
+
+    def acquire(self) -> OverlayBuffer:
+        with self._lock:
+            if self._idle:
+                return self._idle.pop()
+        buffer = OverlayBuffer(self._mpv)
+        with self._lock:
+            self.bytes_allocated += buffer.nbytes
+        return buffer
+
+    def release(self, buffer: OverlayBuffer):
+        with self._lock:
+            if len(self._idle) < self._max_idle:
+                self._idle.append(buffer)
+            else:
+                self.bytes_allocated -= buffer.nbytes  # Freed (and its shared memory file deleted) once unreferenced
+
+    @property
+    def bytes_idle(self) -> int:
+        with self._lock:
+            return sum(buffer.nbytes for buffer in self._idle)
+
+
 class Overlay:
-    def __init__(self, mpv: "MPV", num: int, array: None | numpy.typing.ArrayLike, add_pygame_surface: bool = True):
+    def __init__(
+        self,
+        mpv: "MPV",
+        num: int,
+        array: None | numpy.typing.ArrayLike,
+        add_pygame_surface: bool = True,
+        draw: None | Callable[["Overlay"], None] = None,
+    ):
         # Instantiate via mpv.init_overlay()
-        self._array: numpy.typing.ArrayLike = numpy.zeros(mpv.shape, dtype=numpy.uint8) if array is None else array
-        self.surf: None | pygame.Surface = None
-        self.rect: None | pygame.Rect = None
-        if add_pygame_surface:
-            self.surf = pygame.image.frombuffer(self._array, mpv.size, "BGRA")
-            self.rect = self.surf.get_rect()
         self._mpv = mpv
         self._num = num
+        # Overlays with a fixed array own their buffer, everything else borrows one from the pool while in use
+        self._pooled: bool = array is None
+        self._buffer: None | OverlayBuffer = None if self._pooled else OverlayBuffer(mpv, array)
+        self._add_pygame_surface: bool = add_pygame_surface
+        # Called to redraw the overlay's content whenever a new buffer gets allocated, for overlays drawn once
+        self._draw: None | Callable[[Overlay], None] = draw
+        self._surf: None | pygame.Surface = None
+        self.rect: None | pygame.Rect = pygame.Rect((0, 0), mpv.size) if add_pygame_surface else None
+        # Bounding box of drawn content, only this part of the buffer gets submitted to mpv. Draw using the methods
+        # below rather than on self.surf directly, so it stays accurate.
+        self._bounding_rect: None | pygame.Rect = pygame.Rect((0, 0), mpv.size)
+        self._lock: threading.RLock = threading.RLock()
+        self._last_used: float = time.monotonic()
         self.shown = False
 
+    def _ensure_buffer(self):
+        self._last_used = time.monotonic()
+        if self._buffer is None:
+            self._buffer = self._mpv._overlay_pool.acquire()
+            # Pooled buffers contain whatever the last overlay drew, so the first transparent fill must erase it all
+            self._bounding_rect = pygame.Rect((0, 0), self._mpv.size)
+            if self._add_pygame_surface:
+                self._surf = pygame.image.frombuffer(self._buffer.array, self._mpv.size, "BGRA")
+            if self._draw is not None:
+                self._draw(self)
+        elif self._surf is None and self._add_pygame_surface:
+            self._surf = pygame.image.frombuffer(self._buffer.array, self._mpv.size, "BGRA")
+
+    @property
+    def surf(self) -> None | pygame.Surface:
+        with self._lock:
+            self._ensure_buffer()
+            return self._surf
+
+    @property
+    def nbytes(self) -> int:
+        buffer = self._buffer
+        return 0 if buffer is None else buffer.nbytes
+
+    def _grow_bounding_rect(self, rect: pygame.Rect):
+        rect = rect.clip(self.rect)
+        if rect.width > 0 and rect.height > 0:
+            self._bounding_rect = rect if self._bounding_rect is None else self._bounding_rect.union(rect)
+
+    def fill(self, color):
+        with self._lock:
+            self._ensure_buffer()
+            if pygame.Color(color).a == 0:
+                # Only what was drawn since the last transparent fill needs to be erased
+                if self._bounding_rect is not None:
+                    self._surf.fill(color, self._bounding_rect)
+                self._bounding_rect = None
+            else:
+                self._surf.fill(color)
+                self._bounding_rect = self.rect.copy()
+
+    def blit(self, source: pygame.Surface, dest) -> pygame.Rect:
+        with self._lock:
+            self._ensure_buffer()
+            rect = self._surf.blit(source, dest)
+            self._grow_bounding_rect(rect)
+            return rect
+
+    def draw_rect(self, color, rect: pygame.Rect, width: int = 0) -> pygame.Rect:
+        with self._lock:
+            self._ensure_buffer()
+            rect = pygame.draw.rect(self._surf, color, rect, width=width)
+            self._grow_bounding_rect(rect)
+            return rect
+
     def update(self):  # NOT THREADSAFE, should only be called from one thread because of self._show
-        self._mpv._player.overlay_add(
-            self._num,
-            self._mpv._margin_left,
-            self._mpv._margin_top,
-            f"&{self._array.ctypes.data}",
-            0,
-            "bgra",
-            self._mpv.width,
-            self._mpv.height,
-            self._mpv.width * 4,
-        )
-        self.shown = True
+        with self._lock:
+            self._ensure_buffer()
+            rect = self._bounding_rect
+            if rect is None:  # Nothing drawn, so it's hidden and its buffer can be reaped
+                self.clear()
+                return
+            stride = self._mpv.width * 4
+            self._mpv.add_overlay(
+                self._num,
+                rect.x,
+                rect.y,
+                self._buffer.source,
+                rect.y * stride + rect.x * 4,
+                rect.width,
+                rect.height,
+                stride,
+            )
+            self.shown = True
 
     def clear(self):
         if self.shown:
             self._mpv.clear_overlay(self._num)
             self.shown = False
+            self._last_used = time.monotonic()
+            self._mpv._wake_overlay_reaper()
+
+    def release(self, now: None | float = None) -> None | float:
+        # Hand a hidden overlay's buffer back to the pool, if it's been unused since now - OVERLAY_RELEASE_SECONDS.
+        # Returns when to try again if it hasn't been, otherwise None.
+        with self._lock:
+            if not self._pooled or self._buffer is None or self.shown:
+                return None
+            if now is not None and (release_at := self._last_used + OVERLAY_RELEASE_SECONDS) > now:
+                return release_at
+            self._mpv._overlay_pool.release(self._buffer)
+            self._buffer = self._surf = None
+            return None
 
 
 class MPV:
@@ -105,47 +323,39 @@ class MPV:
         if config.keyboard["enabled"] and is_docker():
             kwargs["input_vo_keyboard"] = True
 
+        if config.continuous_play:
+            # Demux the queued next video ahead of time, so the transition to it is gapless
+            kwargs.setdefault("prefetch_playlist", "yes")
+
         subtitle_font_path = Path("~").expanduser() / ".fonts" / "space-mono-regular.ttf"
         if not subtitle_font_path.exists():
             logger.info("Installing subtitle font")
             subtitle_font_path.parent.mkdir(parents=True, exist_ok=True)
             os.symlink(DATA_DIR / "fonts" / "space-mono-regular.ttf", subtitle_font_path)
 
-        logger.debug(f"Initializing MPV with arguments: {kwargs}")
-        try:
-            self._player: mpv.MPV = mpv.MPV(
-                embeddedfonts="no",
-                force_window="immediate",
-                log_handler=mpv_log,
-                loglevel=LOG_LEVEL_MPV_MAPPING[config.log_level],
-                sub_use_margins="no",
-                sub_font_size=50,
-                sub_pos=90,
-                sub_font="Space Mono",
-                **kwargs,
-            )
-        except Exception as e:
-            if (
-                len(e.args) == 3
-                and e.args[1] == mpv.ErrorCode.OPTION_NOT_FOUND
-                and len(e.args[2]) == 3
-                and isinstance(e.args[2][1], bytes)
-                and isinstance(e.args[2][2], bytes)
-            ):
-                logger.critical(
-                    f"Invalid mpv option: {e.args[2][1].decode()} = {e.args[2][2].decode()!r}! Exiting.", exc_info=True
-                )
-            else:
-                logger.critical(
-                    "Error initializing mpv. Are you sure 'mpv_options' are set properly? Exiting.", exc_info=True
-                )
-            exit(1, "mpv failed to initialize")
+        kwargs = {
+            "embeddedfonts": "no",
+            "force_window": "immediate",
+            "log_handler": mpv_log,
+            "loglevel": LOG_LEVEL_MPV_MAPPING[config.log_level],
+            "sub_use_margins": "no",
+            "sub_font_size": 50,
+            "sub_pos": 90,
+            "sub_font": "Space Mono",
+            **kwargs,
+        }
+        logger.debug(f"Initializing MPV ({config.mpv_backend} backend) with arguments: {kwargs}")
+        if config.mpv_backend == MPV_BACKEND_PROCESS:
+            self._init_process_player(kwargs)
+        else:
+            self._init_embedded_player(kwargs)
+        self._shared_memory_overlays: bool = getattr(self._player, "needs_shared_memory_overlays", False)
 
         self._event_queue: queue.Queue = event_queue
 
         @self._player.event_callback("file-loaded", "end-file")
-        def _(event: mpv.MpvEvent):
-            self._event_queue.put(event.as_dict(mpv.strict_decoder))
+        def _(event):
+            self._event_queue.put(event.as_dict(self._event_decoder))
 
         @self._player.event_callback("shutdown")
         def _(_):
@@ -163,6 +373,10 @@ class MPV:
         def _(_, value):
             self._event_queue.put({"event": "paused", "value": value})
 
+        @self._player.property_observer("speed")
+        def _(_, value):
+            self._event_queue.put({"event": "speed", "value": value or 1.0})
+
         if config.show_fps:
 
             @self._player.property_observer("estimated-vf-fps")
@@ -173,6 +387,8 @@ class MPV:
             def _(_, value):
                 self._event_queue.put({"event": "fps-video", "value": value or 0.0})
 
+        if config.show_fps or config.thumbnails["enabled"]:  # Thumbnails wait while frames are being dropped
+
             @self._player.property_observer("frame-drop-count")
             def _(_, value):
                 self._event_queue.put({"event": "fps-dropped", "value": value or 0})
@@ -204,30 +420,86 @@ class MPV:
 
         logger.info(f"MPV initialized (screen: {width}x{height}, with margins: {self.width}x{self.height})")
 
+        self._init_rendering()
+
+        self._done_overlay = self.create_overlay(63)
+        self._done_overlay.fill("black")
+        text, rect = self.render_text("Vintage Pi TV Loading...", 64, bgcolor=TRANSPARENT, font="bold-italic")
+        rect.center = self._done_overlay.rect.center
+        self._done_overlay.blit(text, rect)
+        self._done_overlay.update()
+        self._volume_cache: bool = 100
+        self._mute_cache: bool = False
+
+        if isinstance(config.starting_volume, bool):  # bool is always false (based on schema)
+            self.toggle_mute()
+        else:
+            self.set_volume(int(round(config.starting_volume / 5.0) * 5))
+
+    def _init_rendering(self):
+        # Everything needed to draw overlays, once self.width and self.height are known
         self.size: tuple[int, int] = (self.width, self.height)
         self.shape: tuple[int, int, int] = (self.width, self.height, 4)
         self._font_scale: float = min(self.width * 9 / 16, self.height) / 720
         self._pixel_scale: float = min(self.width * 9 / 16, self.height) / 360
+        self._overlays: list[Overlay] = []
+        self._overlay_pool: OverlayBufferPool = OverlayBufferPool(self)
+        self._overlay_reaper_condition: threading.Condition = threading.Condition()
+        self._overlay_reaper_pending: bool = False
+
+        self._render_text_cached = functools.lru_cache(maxsize=TEXT_CACHE_SIZE)(self._render_text)
+        self._render_multiple_lines_of_text_cached = functools.lru_cache(maxsize=TEXT_CACHE_SIZE)(
+            self._render_multiple_lines_of_text
+        )
+        self._compose_text_cached = functools.lru_cache(maxsize=COMPOSED_TEXT_CACHE_SIZE)(self._compose_text)
 
         pygame.freetype.init()
         self._fonts: dict[pygame.freetype.Font] = {
             name: pygame.freetype.Font(DATA_DIR / "fonts" / f"space-mono-{name}.ttf")
             for name in ("regular", "italic", "bold", "bold-italic")
         }
+        self._glyph_atlases: dict[tuple[int, str], GlyphAtlas] = {
+            (size, font): GlyphAtlas(self._fonts[font], size * self._font_scale, GLYPH_ATLAS_CHARACTERS)
+            for size, font in GLYPH_ATLAS_FONTS
+        }
 
-        self._done_overlay = self.create_overlay(63)
-        self._done_overlay.surf.fill("black")
-        text, rect = self.render_text("Vintage Pi TV Loading...", 64, bgcolor=TRANSPARENT, font="bold-italic")
-        rect.center = self._done_overlay.surf.get_rect().center
-        self._done_overlay.surf.blit(text, rect)
-        self._done_overlay.update()
-        self._volume_cache: bool = 100
-        self._mute_cache: bool = False
+    def _init_embedded_player(self, kwargs):
+        import mpv  # Imported here, since python-mpv fails to import when libmpv isn't installed
 
-        if isinstance(config.starting_volume, bool):  # bool is always false (based on schema)
-            self.toggle_mute()
-        else:
-            self.set_volume(int(round(config.starting_volume / 5.0) * 5))
+        try:
+            self._player = mpv.MPV(**kwargs)
+        except Exception as e:
+            if (
+                len(e.args) == 3
+                and e.args[1] == mpv.ErrorCode.OPTION_NOT_FOUND
+                and len(e.args[2]) == 3
+                and isinstance(e.args[2][1], bytes)
+                and isinstance(e.args[2][2], bytes)
+            ):
+                logger.critical(
+                    f"Invalid mpv option: {e.args[2][1].decode()} = {e.args[2][2].decode()!r}! Exiting.", exc_info=True
+                )
+            else:
+                logger.critical(
+                    "Error initializing mpv. Are you sure 'mpv_options' are set properly? Exiting.", exc_info=True
+                )
+            exit(1, "mpv failed to initialize")
+
+        self._event_decoder = mpv.strict_decoder
+
+    def _init_process_player(self, kwargs):
+        from .mpv_process import MPVProcess
+
+        try:
+            self._player = MPVProcess(**kwargs)
+        except Exception:
+            logger.critical(
+                "Error starting mpv process. Are you sure mpv is installed and 'mpv_options' are set properly?"
+                " Exiting.",
+                exc_info=True,
+            )
+            exit(1, "mpv process failed to start")
+        self._event_decoder = None
 
     def scale_pixels(self, *n: list[int | float]):
         if len(n) == 1:
@@ -247,7 +519,9 @@ class MPV:
         if all(p == 0 for p in padding):
             return (0, 0, 0, 0)
 
-        return self.scale_pixels(*padding)
+        return tuple(
+            round(p) for p in self.scale_pixels(*padding)
+        )  # Whole pixels, so both ways of rendering text agree
 
     def render_text(
         self,
@@ -258,6 +532,24 @@ class MPV:
         font: Literal["regular", "bold", "italic", "bold-italic"] = "regular",
         padding: int | tuple[int, int] | tuple[int, int, int, int] = 0,
     ) -> tuple[pygame.Surface, pygame.Rect]:
+        # Returned surface is shared with the cache, so it must NOT be drawn on. Copy it first if you need to.
+        if isinstance(padding, list):
+            padding = tuple(padding)
+
+        atlas = self._glyph_atlases.get((size, font))
+        if atlas is not None and atlas.can_render(text):
+            # Text that changes constantly (ie timestamps) would just churn the big cache, so compose it from the atlas
+            surf = self._compose_text_cached(text, size, color, bgcolor, font, padding)
+            return surf, surf.get_rect()
+
+        surf, rect = self._render_text_cached(text, size, color, bgcolor, font, padding)
+        return surf, rect.copy()
+
+    def _compose_text(self, text, size, color, bgcolor, font, padding) -> pygame.Surface:
+        array = self._glyph_atlases[size, font].compose(text, color, bgcolor, self._resolve_padding(padding))
+        return pygame.image.frombuffer(array, (array.shape[1], array.shape[0]), "BGRA")
+
+    def _render_text(self, text, size, color, bgcolor, font, padding) -> tuple[pygame.Surface, pygame.Rect]:
         top, right, bottom, left = self._resolve_padding(padding)
         has_padding = any(p != 0 for p in (top, left, bottom, left))
         surf, rect = self._fonts[font].render(
@@ -279,7 +571,18 @@ class MPV:
         padding: int | tuple[int, int] | tuple[int, int, int, int] = 0,
         padding_between: int = 0,
     ):
-        texts = [self.render_text(**kwargs) for kwargs in kwargs_to_render]
+        # Returned surface is shared with the cache, so it must NOT be drawn on. Copy it first if you need to.
+        if isinstance(padding, list):
+            padding = tuple(padding)
+        lines = tuple(
+            tuple(sorted((k, tuple(v) if isinstance(v, list) else v) for k, v in kwargs.items()))
+            for kwargs in kwargs_to_render
+        )
+        surf, rect = self._render_multiple_lines_of_text_cached(lines, align, bgcolor, padding, padding_between)
+        return surf, rect.copy()
+
+    def _render_multiple_lines_of_text(self, lines, align, bgcolor, padding, padding_between):
+        texts = [self.render_text(**dict(kwargs)) for kwargs in lines]
         width = max(text[1].width for text in texts)
         height = sum(text[1].height for text in texts)
         top, right, bottom, left = self._resolve_padding(padding)
@@ -305,19 +608,85 @@ class MPV:
 
         return surf, rect
 
+    def text_cache_info(self) -> dict:
+        return {
+            "render_text": self._render_text_cached.cache_info(),
+            "compose_text": self._compose_text_cached.cache_info(),
+            "render_multiple_lines_of_text": self._render_multiple_lines_of_text_cached.cache_info(),
+        }
+
     def create_overlay(
-        self, num: int, array: None | numpy.typing.ArrayLike = None, add_pygame_surface: bool = True
+        self,
+        num: int,
+        array: None | numpy.typing.ArrayLike = None,
+        add_pygame_surface: bool = True,
+        draw: None | Callable[[Overlay], None] = None,
     ) -> Overlay:
-        return Overlay(self, num, array, add_pygame_surface)
+        overlay = Overlay(self, num, array, add_pygame_surface, draw)
+        self._overlays.append(overlay)
+        return overlay
+
+    def add_overlay(self, num: int, x: int, y: int, source: str, offset: int, width: int, height: int, stride: int):
+        # Show a BGRA image from source (a file or &<memory address>) at x, y, relative to the overscan margins
+        metrics.overlay_updates.inc(label_value=LAYER_NAMES.get(num, str(num)))
+        self._player.overlay_add(
+            num, self._margin_left + x, self._margin_top + y, source, offset, "bgra", width, height, stride
+        )
 
     def clear_overlay(self, num: int):
         return self._player.overlay_remove(num)
 
+    def create_overlay_buffer(self, shape: tuple[int, int, int]) -> OverlayBuffer:
+        # A buffer of any size (rows, columns, 4), to be displayed full screen using show_overlay_buffer()
+        return OverlayBuffer(self, shape=shape)
+
+    def show_overlay_buffer(self, num: int, buffer: OverlayBuffer, x: int, y: int, size: tuple[int, int]):
+        # Display a size (width, height) region of buffer starting at x, y, scaled up by mpv to fill the screen. Needs
+        # mpv 0.35+ for overlay-add's dw and dh arguments, when size differs from the screen's.
+        stride = buffer.array.shape[1] * 4
+        args = [num, self._margin_left, self._margin_top, buffer.source, y * stride + x * 4, "bgra", *size, stride]
+        if size != self.size:
+            args.extend(self.size)
+        metrics.overlay_updates.inc(label_value=LAYER_NAMES.get(num, str(num)))
+        self._player.command("overlay_add", *args)
+
+    def overlay_memory_usage(self) -> dict:
+        # Bytes of overlay buffers held, per layer, and by the pool waiting to be reused. For /api/stats and /metrics.
+        layers = {}
+        for overlay in list(self._overlays):
+            name = LAYER_NAMES.get(overlay._num, str(overlay._num))
+            layers[name] = layers.get(name, 0) + overlay.nbytes
+        return {
+            "layers": layers,
+            "pool_idle": self._overlay_pool.bytes_idle,
+            "pool_allocated": self._overlay_pool.bytes_allocated,
+        }
+
+    def _wake_overlay_reaper(self):
+        with self._overlay_reaper_condition:
+            self._overlay_reaper_pending = True
+            self._overlay_reaper_condition.notify()
+
+    def overlay_reaper_thread(self):
+        while True:
+            now = time.monotonic()
+            deadlines = [deadline for overlay in list(self._overlays) if (deadline := overlay.release(now)) is not None]
+
+            with self._overlay_reaper_condition:
+                if not self._overlay_reaper_pending:
+                    # Sleeps indefinitely when no hidden overlay is holding on to a buffer
+                    self._overlay_reaper_condition.wait(
+                        max(min(deadlines) - time.monotonic(), 0) if deadlines else None
+                    )
+                self._overlay_reaper_pending = False
+
     def done_loading(self):
         self._done_overlay.clear()
+        self._done_overlay.release()  # Its buffer goes straight back to the pool for the OSD to reuse
+        self._overlays.remove(self._done_overlay)
         del self._done_overlay
 
-    def play(self, video: Video, pre_seek: None | float):
+    def play(self, video: Video, pre_seek: None | float, append: bool = False):
         kwargs = {}
         if pre_seek is not None and pre_seek > 0.0:
             kwargs["start"] = pre_seek
@@ -331,8 +700,14 @@ class MPV:
             kwargs["sid"] = video.subtitles
             logger.debug(f"Enabling subtitles sid={video.subtitles} for {video.path}")
 
-        self._player.loadfile(str(video.path), **kwargs)
-        self.resume()
+        if append:
+            self._player.loadfile(str(video.path), "append", **kwargs)
+        else:
+            self._player.loadfile(str(video.path), **kwargs)
+            self.resume()
+
+    def clear_queued(self):
+        self._player.playlist_clear()  # Removes everything except the currently playing video
 
     def stop(self):
         self._player.stop()
@@ -375,3 +750,17 @@ class MPV:
                     logger.warning(f"Blocked keypress {key} by player request in Docker mode")
                 else:
                     self._event_queue.put({"event": "user-action", "action": action, "extras": {}})
+
+
+class HeadlessMPV(MPV):
+    # Renders overlays exactly like MPV, but without an mpv player, handing overlay commands to player instead. Used
+    # to benchmark rendering.
+    def __init__(self, width: int, height: int, player, shared_memory_overlays: bool = False):
+        self._player = player
+        self._shared_memory_overlays: bool = shared_memory_overlays
+        self._margin_left = self._margin_top = 0
+        self.width: int = width
+        self.height: int = height
+        self._volume_cache: int = 100
+        self._mute_cache: bool = False
+        self._init_rendering()
@@ -1,4 +1,5 @@
 from functools import wraps
+import threading
 from time import monotonic as tick
 
 import pygame
@@ -18,7 +19,8 @@ from .constants import (
     PlayerState,
 )
 from .mpv_wrapper import MPV, Overlay
-from .utils import FPSClock, format_seconds
+from .state import StateSnapshot
+from .utils import format_seconds
 from .videos import Video
 
 
@@ -34,8 +36,14 @@ def cached_show_method(method):
 
 
 class OSD:
+    PAUSED_BLINK_PERIOD = 2.2
+    PAUSED_BLINK_ON = 1.6
+
     def __init__(self, config: Config, mpv: MPV, state_getter):
         self._state_getter = state_getter
+        self._last_state: None | StateSnapshot = None  # Last state the compositor drew
+        self._wake_condition: threading.Condition = threading.Condition()
+        self._wake_pending: bool = False
         self._config: Config = config
         self._mpv: MPV = mpv
         self._show_until: float = -1.0
@@ -49,14 +57,14 @@ class OSD:
         self._notify: Overlay = mpv.create_overlay(OSD_NOTIFY_LAYER)
 
     @cached_show_method
-    def _show_osd(self, state, cache_value):
-        video: Video = state["video"]
+    def _show_osd(self, state: StateSnapshot, cache_value):
+        video: Video = state.video
         if self._config.show_fps:
             channel, name, rating, fps = cache_try = (
                 video.display_channel,
                 video.name,
                 video.rating,
-                f"{state['fps_actual']:.2f}/{state['fps_video']:.2f}fps [{state['fps_dropped']} dropped]",
+                f"{state.fps_actual:.2f}/{state.fps_video:.2f}fps [{state.fps_dropped} dropped]",
             )
         else:
             channel, name, rating = cache_try = (video.display_channel, video.name, video.rating)
@@ -64,7 +72,7 @@ class OSD:
         if len(name) > 58:
             name = f"{name[:57]}\u2026"
         if not self._osd.shown or cache_try != cache_value:
-            self._osd.surf.fill(TRANSPARENT)
+            self._osd.fill(TRANSPARENT)
             text = [
                 {"text": str(channel), "size": 120, "padding": (10, 10, 6, 10), "font": "bold"},
                 {"text": name, "size": 32, "color": YELLOW, "padding": 8, "font": "italic"},
@@ -74,40 +82,41 @@ class OSD:
 
             surf, rect = self._mpv.render_multiple_lines_of_text(text, align="left")
             rect.topleft = self._mpv.scale_pixels(15, 15)
-            self._osd.surf.blit(surf, rect)
+            self._osd.blit(surf, rect)
 
             if rating:
                 color = video.rating_dict["color"]
                 surf, rect = self._mpv.render_text(rating, 80, color=color, padding=12)
+                surf = surf.copy()  # Don't draw on the cached surface
                 pygame.draw.rect(surf, color, rect, width=round(self._mpv.scale_pixels(4.25)))
                 rect.topright = (self._osd.rect.right - self._mpv.scale_pixels(15), self._mpv.scale_pixels(15))
-                self._osd.surf.blit(surf, rect)
+                self._osd.blit(surf, rect)
 
             self._osd.update()
         return cache_try
 
     @cached_show_method
-    def _show_progress_bar(self, state, cache_value):
-        is_paused = state["state"] == PlayerState.PAUSED
-        show_paused = is_paused and (tick() % 2.2) < 1.6
+    def _show_progress_bar(self, state: StateSnapshot, cache_value):
+        is_paused = state.state == PlayerState.PAUSED
+        show_paused = is_paused and (tick() % self.PAUSED_BLINK_PERIOD) < self.PAUSED_BLINK_ON
         position, duration, _, _ = cache_try = (
-            round(state["position"] or 0),
-            round(state["duration"] or 0),
+            round(state.position or 0),
+            round(state.duration or 0),
             is_paused,
             show_paused,
         )
         if not self._progress_bar.shown or cache_try != cache_value:
             color = RED if is_paused else WHITE
-            self._progress_bar.surf.fill(TRANSPARENT)
+            self._progress_bar.fill(TRANSPARENT)
             surf, pos_rect = self._mpv.render_text(format_seconds(position), 25, padding=5)
             pos_rect.bottomleft = (
                 self._mpv.scale_pixels(20),
                 self._progress_bar.rect.bottom - self._mpv.scale_pixels(20),
             )
-            self._progress_bar.surf.blit(surf, pos_rect)
+            self._progress_bar.blit(surf, pos_rect)
             surf, dur_rect = self._mpv.render_text(format_seconds(duration), 25, padding=5)
             dur_rect.bottomright = (self._progress_bar.rect.right - self._mpv.scale_pixels(20), pos_rect.bottom)
-            self._progress_bar.surf.blit(surf, dur_rect)
+            self._progress_bar.blit(surf, dur_rect)
             bar_rect = pygame.Rect(
                 0,
                 0,
@@ -116,15 +125,15 @@ class OSD:
             )
             bar_rect.centery = dur_rect.centery
             bar_rect.left = pos_rect.right + self._mpv.scale_pixels(10)
-            pygame.draw.rect(self._progress_bar.surf, color, bar_rect)
+            self._progress_bar.draw_rect(color, bar_rect)
             if duration > 0.0:
                 bar_rect.width = position / duration * bar_rect.width
-                pygame.draw.rect(self._progress_bar.surf, BLUE, bar_rect)
+                self._progress_bar.draw_rect(BLUE, bar_rect)
             if show_paused:
                 surf, paused_rect = self._mpv.render_text("PAUSED!", 40, padding=8, color=color, font="bold-italic")
                 paused_rect.centerx = self._progress_bar.rect.centerx
                 paused_rect.bottom = bar_rect.top - self._mpv.scale_pixels(5)
-                self._progress_bar.surf.blit(surf, paused_rect)
+                self._progress_bar.blit(surf, paused_rect)
 
             self._progress_bar.update()
         return cache_try
@@ -146,11 +155,11 @@ class OSD:
                 color = RED
 
         if not self._volume.shown or cache_try != cache_value:
-            self._volume.surf.fill(TRANSPARENT)
+            self._volume.fill(TRANSPARENT)
             surf, vol_rect = self._mpv.render_text(f"Vol: {volume_str}", 44, padding=9, color=color)
             vol_rect.top = self._mpv.scale_pixels(15)
             vol_rect.centerx = self._volume.rect.centerx
-            self._volume.surf.blit(surf, vol_rect)
+            self._volume.blit(surf, vol_rect)
 
             self._volume.update()
         return cache_try
@@ -162,10 +171,11 @@ class OSD:
             self._show_progress_bar_until = until
         if volume:
             self._show_volume_until = until
+        self._wake()
 
     def notify(self, text: str | list, duration: float = 10.0, **kwargs):
         self._show_notify_until = tick() + duration
-        self._notify.surf.fill(TRANSPARENT)
+        self._notify.fill(TRANSPARENT)
         kwargs = {"padding": 10, **kwargs}  # Sane defaults
         if isinstance(text, str):
             kwargs = {"size": 50, **kwargs}
@@ -175,31 +185,81 @@ class OSD:
             text, surf = self._mpv.render_multiple_lines_of_text(text, **kwargs)
 
         surf.center = self._notify.rect.center
-        self._notify.surf.blit(text, surf)
+        self._notify.blit(text, surf)
         self._notify.update()
+        self._wake()  # Compositor needs to know the new deadline to clear it
+
+    def _wake(self):
+        with self._wake_condition:
+            self._wake_pending = True
+            self._wake_condition.notify()
+
+    def state_updated(self, state: StateSnapshot):
+        # Called by the player for every new state version. Only wake up the compositor if something it draws (or
+        # whether it draws) would change, ie not for every single position update.
+        last = self._last_state
+        if (
+            last is None
+            or state.state != last.state
+            or state.video is not last.video
+            or (
+                self._progress_bar.shown
+                and (round(state.position), round(state.duration)) != (round(last.position), round(last.duration))
+            )
+            or (
+                self._config.show_fps
+                and not self._config.disable_osd
+                and self._osd.shown
+                and (state.fps_actual, state.fps_video, state.fps_dropped)
+                != (last.fps_actual, last.fps_video, last.fps_dropped)
+            )
+        ):
+            self._wake()
+
+    def _next_deadline(self, now: float, state: StateSnapshot) -> None | float:
+        deadlines = [
+            until
+            for until in (
+                self._show_until,
+                self._show_volume_until,
+                self._show_progress_bar_until,
+                self._show_notify_until,
+            )
+            if until > now
+        ]
+        if state.state == PlayerState.PAUSED and self._progress_bar.shown:  # Blink timer for "PAUSED!"
+            phase = now % self.PAUSED_BLINK_PERIOD
+            if phase < self.PAUSED_BLINK_ON:
+                deadlines.append(now - phase + self.PAUSED_BLINK_ON)
+            else:
+                deadlines.append(now - phase + self.PAUSED_BLINK_PERIOD)
+        return min(deadlines, default=None)
 
     def osd_thread(self):
         if not self._config.disable_osd:
             self._osd.clear()
         self._progress_bar.clear()
         self._volume.clear()
-        clock = FPSClock()
+        osd_version = None
 
         while True:
-            state = self._state_getter()
+            state: StateSnapshot = self._state_getter()
+            self._last_state = state
 
             now = tick()
-            is_paused = state["state"] == PlayerState.PAUSED
-            show_volume = self._show_volume_until >= now
-            show_progress_bar = is_paused or self._show_progress_bar_until >= now
-            show_osd = self._config.channel_osd_always_on or show_volume or show_progress_bar or self._show_until >= now
+            is_paused = state.state == PlayerState.PAUSED
+            show_volume = self._show_volume_until > now
+            show_progress_bar = is_paused or self._show_progress_bar_until > now
+            show_osd = self._config.channel_osd_always_on or show_volume or show_progress_bar or self._show_until > now
 
             if now > self._show_notify_until:
                 self._notify.clear()
 
-            if state["video"] and show_osd:
-                if not self._config.disable_osd:
+            if state.video and show_osd:
+                # Channel OSD only depends on state, so skip it entirely if no new version was published
+                if not self._config.disable_osd and (state.version != osd_version or not self._osd.shown):
                     self._show_osd(state)
+                    osd_version = state.version
                 if show_progress_bar:
                     self._show_progress_bar(state)
                 else:
@@ -215,4 +275,9 @@ class OSD:
                 self._progress_bar.clear()
                 self._volume.clear()
 
-            clock.tick(24)
+            # Sleep until woken by a state change or show/notify request, or until the next thing expires
+            deadline = self._next_deadline(now, state)
+            with self._wake_condition:
+                if not self._wake_pending:
+                    self._wake_condition.wait(None if deadline is None else max(deadline - tick(), 0.0))
+                self._wake_pending = False
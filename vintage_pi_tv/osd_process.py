@@ -0,0 +1,161 @@
+import atexit
+from dataclasses import dataclass, replace
+import logging
+import multiprocessing
+import multiprocessing.connection
+import threading
+import types
+
+from .config import Config
+from .mpv_wrapper import MPV, HeadlessMPV
+from .osd import OSD
+from .state import StateSnapshot
+from .utils import exit, init_logger, retry_thread_wrapper, set_log_level
+from .videos import Video
+
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class RenderedVideo:
+    # Just what the OSD draws of a Video, since a Video (and its VideosDB) can't be sent to another process
+    display_channel: int
+    name: str
+    rating: str | bool
+    rating_dict: None | dict
+
+    @classmethod
+    def from_video(cls, video: Video) -> "RenderedVideo":
+        return cls(video.display_channel, video.name, video.rating, getattr(video, "rating_dict", None))
+
+
+class PipePlayer:
+    # Stands in for mpv in the renderer process, asking the main process to submit overlays to mpv
+    def __init__(self, conn: multiprocessing.connection.Connection):
+        self._conn: multiprocessing.connection.Connection = conn
+        self._lock: threading.Lock = threading.Lock()
+
+    def _call(self, *message):
+        with self._lock:
+            self._conn.send(message)
+            self._conn.recv()  # Wait until mpv has read the buffer, so it isn't drawn on while being read
+
+    def overlay_add(self, overlay_id, x, y, file_or_fd, offset, fmt, w, h, stride):
+        self._call("overlay_add", overlay_id, x, y, file_or_fd, offset, w, h, stride)
+
+    def overlay_remove(self, overlay_id):
+        self._call("overlay_remove", overlay_id)
+
+
+def renderer_process(
+    commands: multiprocessing.connection.Connection,
+    overlays: multiprocessing.connection.Connection,
+    config: dict,
+    width: int,
+    height: int,
+    log_level: str,
+):
+    init_logger()
+    set_log_level(log_level)
+    logger.debug(f"OSD renderer process started ({width}x{height})")
+
+    mpv = HeadlessMPV(width, height, player=PipePlayer(overlays), shared_memory_overlays=True)
+    state = StateSnapshot()
+    osd = OSD(config=types.SimpleNamespace(**config), mpv=mpv, state_getter=lambda: state)
+    for target in (osd.osd_thread, mpv.overlay_reaper_thread):
+        name = target.__name__.removesuffix("_thread")
+        threading.Thread(target=retry_thread_wrapper(target), name=name, daemon=True).start()
+
+    while True:
+        try:
+            command, *args = commands.recv()
+        except EOFError:
+            logger.debug("Main process went away, exiting OSD renderer process")
+            break
+
+        if command == "state":
+            new_state = args[0]
+            if new_state.video == state.video:
+                new_state = replace(new_state, video=state.video)  # OSD compares videos by identity
+            state = new_state
+            osd.state_updated(state)
+        elif command == "show":
+            kwargs, (mpv._volume_cache, mpv._mute_cache) = args
+            osd.show(**kwargs)
+        elif command == "notify":
+            text, duration, kwargs = args
+            osd.notify(text, duration, **kwargs)
+
+
+class OSDProcess:
+    # Same interface as OSD for the player, but the OSD gets rendered in a separate process into overlay buffers in
+    # shared memory. Only small messages get sent to it, and it tells us which buffers mpv should show.
+    def __init__(self, config: Config, mpv: MPV):
+        self._mpv: MPV = mpv
+        self._send_lock: threading.Lock = threading.Lock()
+        self._last_sent_state: None | tuple = None
+        self._exiting: bool = False
+        atexit.register(self._set_exiting)  # Runs before multiprocessing terminates the renderer process
+
+        context = multiprocessing.get_context("spawn")  # Not fork, since libmpv's threads are running
+        child_commands, self._commands = context.Pipe(duplex=False)
+        self._overlays, child_overlays = context.Pipe()
+        osd_config = {key: getattr(config, key) for key in ("channel_osd_always_on", "disable_osd", "show_fps")}
+        self._process = context.Process(
+            target=renderer_process,
+            args=(child_commands, child_overlays, osd_config, mpv.width, mpv.height, config.log_level),
+            name="osd_renderer",
+            daemon=True,
+        )
+        self._process.start()
+        child_commands.close()
+        child_overlays.close()
+        logger.info(f"Started OSD renderer process (pid={self._process.pid})")
+
+    def _set_exiting(self):
+        self._exiting = True
+
+    def _send(self, *message):
+        with self._send_lock:
+            self._commands.send(message)
+
+    def show(self, duration=5.0, progress_bar=False, volume=False):
+        self._send("show", {"duration": duration, "progress_bar": progress_bar, "volume": volume}, self._mpv.volume)
+
+    def notify(self, text: str | list, duration: float = 10.0, **kwargs):
+        self._send("notify", text, duration, kwargs)
+
+    def state_updated(self, state: StateSnapshot):
+        # Position updates come in for every frame, the OSD only draws them rounded to the second
+        key = (
+            state.state,
+            state.video,
+            round(state.position),
+            round(state.duration),
+            state.fps_actual,
+            state.fps_video,
+            state.fps_dropped,
+        )
+        if key != self._last_sent_state:
+            self._last_sent_state = key
+            video = state.video and RenderedVideo.from_video(state.video)
+            self._send("state", replace(state, video=video))
+
+    def osd_thread(self):
+        # Relays the renderer process's overlay commands to mpv
+        while True:
+            try:
+                command, *args = self._overlays.recv()
+            except EOFError:
+                if self._exiting:
+                    return
+                exit(1, "OSD renderer process exited")
+
+            try:
+                if command == "overlay_add":
+                    self._mpv.add_overlay(*args)
+                elif command == "overlay_remove":
+                    self._mpv.clear_overlay(*args)
+            finally:
+                self._overlays.send(None)
@@ -1,6 +1,9 @@
 from collections import defaultdict
+from collections.abc import Callable
 from contextlib import contextmanager
+from dataclasses import replace
 import logging
+import math
 from pathlib import Path
 import queue
 import random
@@ -9,13 +12,15 @@ import threading
 import time
 
 import numpy
-import numpy.typing
 
-from .config import Config
-from .constants import BLACK, NO_FILES_LAYER, RED, STATIC_LAYER, PlayerState
+from . import metrics
+from .config import Config, ConfigDiff
+from .constants import BLACK, NO_FILES_LAYER, OSD_RENDERER_PROCESS, RED, STATIC_LAYER, PlayerState
 from .keyboard import Keyboard
-from .mpv_wrapper import MPV, Overlay
+from .mpv_wrapper import MPV, Overlay, OverlayBuffer
 from .osd import OSD
+from .osd_process import OSDProcess
+from .state import StateSnapshot
 from .utils import FPSClock, exit, is_docker
 from .videos import Video, VideosDB
 
@@ -23,44 +28,55 @@ from .videos import Video, VideosDB
 logger = logging.getLogger(__name__)
 
 
+ANCHOR_DRIFT_SECONDS = 0.5  # How far playback can wander from its anchor before clients are sent a new one
+WEBSOCKET_IGNORED_STATE = {"position"}  # Clients extrapolate position from the anchor instead
+WEBSOCKET_FPS_STATE = {"fps_video", "fps_actual", "fps_dropped"}  # Only sent to clients with show-fps
+
+
 class BreakVideoPlayLoop(Exception):
     pass
 
 
 class Static:
-    NUM_OVERLAYS = 15
-    NUM_NO_REPEATS = 7
+    TILE_MAX_WIDTH = 960  # Static is generated at no more than this width, and scaled up to the screen by mpv
+    TILE_PAN = 64  # Extra columns of noise, so frames can be panned horizontally as well as vertically
 
     def __init__(self, config: Config, mpv: MPV):
         self._event: threading.Event = threading.Event()
-        self._overlays: list[Overlay] = []
         self._mpv: MPV = mpv
         self._config: Config = config
-        logger.debug(f"Generating {self.NUM_OVERLAYS} random static overlays ({mpv.width}x{mpv.height})")
-        for _ in range(self.NUM_OVERLAYS):
-            array = numpy.random.randint(0, 0xFF + 1, mpv.shape, dtype=numpy.uint8)
-            array[:, :, -1] = 0xFF
-            overlay = mpv.create_overlay(STATIC_LAYER, array, add_pygame_surface=False)  # All the same layer num
-            self._overlays.append(overlay)
-        logger.debug(f"Done generating {self.NUM_OVERLAYS} random static overlays")
+        self._buffer: None | OverlayBuffer = None
+        self._size: tuple[int, int] = mpv.size
+        self._generate(scale=max(2, math.ceil(mpv.width / self.TILE_MAX_WIDTH)))
+
+    def _generate(self, scale: int):
+        # One block of noise, twice the height of a frame. Every frame of static is a random window into it, since any
+        # window into random noise is random noise too, so nothing gets generated or copied per frame.
+        width, height = max(self._mpv.width // scale, 1), max(self._mpv.height // scale, 1)
+        logger.debug(f"Generating random static ({width}x{height}, scaled up {scale}x)")
+        self._buffer = None  # Free the old block first
+        buffer = self._mpv.create_overlay_buffer((height * 2, width + self.TILE_PAN, 4))
+        buffer.array[:] = numpy.random.randint(0, 0xFF + 1, buffer.array.shape, dtype=numpy.uint8)
+        buffer.array[:, :, -1] = 0xFF
+        self._buffer, self._size = buffer, (width, height)
 
     def static_thread(self):
         self._mpv.clear_overlay(STATIC_LAYER)
-        indexes = set(range(self.NUM_OVERLAYS))
         clock = FPSClock()
 
         while True:
             self._event.wait()
-            last_indexes: int = []
 
             while self._event.is_set():
-                no_repeat_indexes = list(indexes ^ set(last_indexes))
-                index = random.choice(no_repeat_indexes)
-                self._overlays[index].update()
-
-                last_indexes.append(index)
-                if len(last_indexes) > self.NUM_NO_REPEATS:
-                    last_indexes.pop(0)
+                x, y = random.randint(0, self.TILE_PAN), random.randint(0, self._size[1])
+                try:
+                    self._mpv.show_overlay_buffer(STATIC_LAYER, self._buffer, x, y, self._size)
+                except Exception:
+                    if self._size == self._mpv.size:
+                        raise
+                    logger.warning("mpv can't scale overlays (needs v0.35+), generating static at full resolution")
+                    self._generate(scale=1)
+                    continue
 
                 clock.tick(random.randint(18, 30))
             self._mpv.clear_overlay(STATIC_LAYER)
@@ -107,26 +123,34 @@ class Player:
         self._event_queue: queue.Queue = event_queue
         self._keyboard: None | Keyboard = keyboard
         self._current_rating: False | str = self._config.starting_rating
-        self.state: dict[str, Video | PlayerState | float]
+        self.state: StateSnapshot = StateSnapshot()
+        self.websocket_state_version: int = 0  # Last version queued for the websocket, which skips most updates
         self._websocket_updates_queue: queue.Queue = websocket_updates_queue
-        if self._config.save_place_while_browsing:
-            self._places: defaultdict[Path, float] = defaultdict(float)
+        self._queued_video: None | Video = None  # Only used in continuous play mode
+        self._static_timer: None | threading.Timer = None
+        self._places: defaultdict[Path, float] = defaultdict(float)  # Used if save-place-while-browsing is on
+        self.state_listeners: list[Callable[[StateSnapshot], None]] = []  # Called with every new state version
 
-        self._reset_state()
-        self.osd: OSD = OSD(config=config, mpv=mpv, state_getter=self._state_getter)
+        if config.osd_renderer == OSD_RENDERER_PROCESS:
+            self.osd: OSD | OSDProcess = OSDProcess(config=config, mpv=mpv)
+        else:
+            self.osd: OSD | OSDProcess = OSD(config=config, mpv=mpv, state_getter=self._state_getter)
         self.static: Static = Static(config=config, mpv=mpv)
         self._generate_no_videos_overlay()
+        self._reset_state()
 
-        self._num_state_keys = len(self.state)
         self._websocket_updates_queue.put({"type": "current_rating", "data": self._current_rating})
         self._websocket_updates_queue.put({"type": "volume", "data": self._mpv.volume})
 
-    def _state_getter(self) -> dict:
+    def _state_getter(self) -> StateSnapshot:
         return self.state
 
     def _generate_no_videos_overlay(self):
-        self._no_videos_overlay: Overlay = self._mpv.create_overlay(NO_FILES_LAYER)
-        self._no_videos_overlay.surf.fill(BLACK)
+        # Drawn lazily, since it's rarely shown, and redrawn if its buffer gets released while hidden
+        self._no_videos_overlay: Overlay = self._mpv.create_overlay(NO_FILES_LAYER, draw=self._draw_no_videos_overlay)
+
+    def _draw_no_videos_overlay(self, overlay: Overlay):
+        overlay.fill(BLACK)
         text, rect = self._mpv.render_multiple_lines_of_text(
             (
                 {"text": "No video files detected!", "size": 58, "color": RED, "bgcolor": BLACK, "font": "bold"},
@@ -139,8 +163,8 @@ class Player:
             ),
             padding_between=20,
         )
-        rect.center = self._no_videos_overlay.rect.center
-        self._no_videos_overlay.surf.blit(text, rect)
+        rect.center = overlay.rect.center
+        overlay.blit(text, rect)
 
     def _no_videos_text(self, show=True):
         if show and not self._no_videos_overlay.shown:
@@ -149,33 +173,46 @@ class Player:
             self._no_videos_overlay.clear()
 
     def _update_state(self, **kwargs):
-        self.state = {**self.state, **kwargs}
-        if len(self.state) != self._num_state_keys:
-            raise Exception("State should only contain 4 keys! Something went wrong!")
-        self._publish_state()
+        state = self.state
+        if all(getattr(state, key) == value for key, value in kwargs.items()):
+            return  # Nothing changed, no need to publish a new version
+        new_state = state.evolve(**kwargs)
+
+        # Re-anchor on discontinuities (load, pause, seek, speed change) or once playback has drifted, which also
+        # covers seeks and stalls since they show up as the position jumping away from where it should be
+        now = time.monotonic()
+        reanchor = (
+            new_state.state != state.state
+            or new_state.video is not state.video
+            or new_state.speed != state.speed
+            or abs(new_state.position - state.position_at(now)) > ANCHOR_DRIFT_SECONDS
+        )
+        if reanchor:
+            new_state = replace(new_state, anchor_position=new_state.position, anchor_time=now)
+
+        self.state = new_state  # Single assignment, so publishing is atomic for reader threads
+        ignored = WEBSOCKET_IGNORED_STATE if self._config.show_fps else WEBSOCKET_IGNORED_STATE | WEBSOCKET_FPS_STATE
+        self._publish_state(websocket=reanchor or not kwargs.keys() <= ignored)
 
     def _reset_state(self):
-        state = {"duration": 0.0, "position": 0.0, "state": PlayerState.LOADING, "video": None}
-        if self._config.show_fps:
-            state.update({"fps_video": 0.0, "fps_actual": 0.0, "fps_dropped": 0})
-        self.state = state
+        self.state = StateSnapshot(version=self.state.version + 1, anchor_time=time.monotonic())
         self._publish_state()
 
-    def _publish_state(self):
+    def _publish_state(self, websocket: bool = True):
         state = self.state
         if (
             self._config.save_place_while_browsing
-            and state["video"] is not None
-            and state["state"] in (PlayerState.PLAYING, PlayerState.PAUSED)
+            and state.video is not None
+            and state.state in (PlayerState.PLAYING, PlayerState.PAUSED)
         ):
-            self._places[state["video"].path] = state["position"]
-        self._websocket_updates_queue.put({
-            "type": "state",
-            "data": {
-                **state,
-                "video": state["video"] and state["video"].serialize(),
-            },
-        })
+            self._places[state.video.path] = state.position
+        self.osd.state_updated(state)
+        for listener in self.state_listeners:
+            listener(state)
+        if websocket:
+            # Serialized by the websocket publisher, which can skip snapshots that have already been superseded
+            self.websocket_state_version = state.version
+            self._websocket_updates_queue.put({"type": "state", "data": state})
 
     def _event_queue_iter(self):
         while True:
@@ -200,9 +237,9 @@ class Player:
                 self._update_state(video=None, state=PlayerState.LOADING)
                 self._mpv.stop()
             case "pause":
-                if self.state["state"] == PlayerState.PAUSED:
+                if self.state.state == PlayerState.PAUSED:
                     self._mpv.resume()
-                elif self.state["state"] == PlayerState.PLAYING:
+                elif self.state.state == PlayerState.PLAYING:
                     self._mpv.pause()
             case "up" | "down":
                 self._update_state(video=None, state=PlayerState.LOADING)
@@ -286,9 +323,37 @@ class Player:
                 align="right",
             )
             self._websocket_updates_queue.put({"type": "current_rating", "data": rating})
+            if self._queued_video is not None and not self._queued_video.is_viewable_based_on_rating(rating):
+                self._mpv.clear_queued()
+                self._queue_next_video()
         else:
             logger.warning(f"Won't set rating to {rating}, since it doesn't exist!")
 
+    def _config_reloaded(self, diff: ConfigDiff):
+        # Config has already been updated. Only what the player thread owns needs applying here.
+        if "ratings_dict" in diff and self._current_rating not in self._config.ratings_dict:
+            if self._config.ratings:
+                self.set_rating(self._config.starting_rating)
+            else:
+                logger.info("Ratings were disabled")
+                self._current_rating = False
+                self._websocket_updates_queue.put({"type": "current_rating", "data": False})
+
+    def _queue_next_video(self):
+        # Append the next video to mpv's playlist, so that it's already prefetched when the current one ends
+        self._queued_video = self._videos_db.get_random_video(current_rating=self._current_rating)
+        if self._queued_video is not None:
+            logger.debug(f"Queued {self._queued_video.path} to play next")
+            pre_seek = None
+            if self._config.save_place_while_browsing:
+                pre_seek = self._places[self._queued_video.path]
+            self._mpv.play(self._queued_video, pre_seek=pre_seek, append=True)
+
+    def _cancel_static_timer(self):
+        if self._static_timer is not None:
+            self._static_timer.cancel()
+            self._static_timer = None
+
     def player_thread(self):
         video: None | Video = None
         next_video: None | Video = None
@@ -301,6 +366,8 @@ class Player:
 
         while True:
             self._reset_state()
+            self._cancel_static_timer()
+            self._queued_video = None
             static_time = None
 
             self.static.start()  # May as well show a tiny bit of static during loading, even if it's disabled
@@ -329,6 +396,7 @@ class Player:
                 if self._config.save_place_while_browsing:
                     pre_seek = self._places[video.path]
                 self._mpv.play(video, pre_seek=pre_seek)
+                continued = False  # Set when mpv continued to the queued video, and static should be shown
 
                 try:
                     while True:
@@ -339,28 +407,55 @@ class Player:
                                     self._update_state(
                                         video=video, position=0.0, duration=0.0, state=PlayerState.PLAYING
                                     )
-                                    self.static.stop()
+                                    if continued:  # Let the static play over the start of the next video
+                                        self._static_timer = threading.Timer(self._config.static_time, self.static.stop)
+                                        self._static_timer.start()
+                                        continued = False
+                                    else:
+                                        self.static.stop()
                                     self.osd.show()
-                                case "position" | "duration" | "fps-video" | "fps-actual" | "fps-dropped":
+                                    if self._config.continuous_play:
+                                        self._queue_next_video()
+                                case "position" | "duration" | "speed" | "fps-video" | "fps-actual":
                                     self._update_state(**{event["event"].replace("-", "_"): event["value"]})
+                                case "fps-dropped":
+                                    # mpv's count starts over for each video
+                                    if event["value"] > self.state.fps_dropped:
+                                        metrics.frames_dropped.inc(event["value"] - self.state.fps_dropped)
+                                    self._update_state(fps_dropped=event["value"])
                                 case "paused":
-                                    if event["value"] and self.state["state"] == PlayerState.PLAYING:
+                                    if event["value"] and self.state.state == PlayerState.PLAYING:
                                         self._update_state(state=PlayerState.PAUSED)
-                                    elif not event["value"] and self.state["state"] == PlayerState.PAUSED:
+                                    elif not event["value"] and self.state.state == PlayerState.PAUSED:
                                         self._update_state(state=PlayerState.PLAYING)
                                 case "end-file":
                                     if (
-                                        self.state["state"] == PlayerState.PLAYING
+                                        self.state.state == PlayerState.PLAYING
                                         and self._config.save_place_while_browsing
                                     ):
                                         self._places[video.path] = 0.0  # Reset place to zero
                                     if event["reason"] == "error":
                                         logger.warning(f"Error with video {video.path}. Disabling it.")
                                         self._videos_db.mark_bad_video(video)
+                                    # On an error, mpv also moves on to the queued video by itself, so follow it
+                                    # rather than replacing it with another one
+                                    if event["reason"] in ("eof", "error") and self._queued_video is not None:
+                                        logger.info(
+                                            f"Ending playback of {video.path}, continuing to queued video"
+                                            f" {self._queued_video.path}"
+                                        )
+                                        video, self._queued_video = self._queued_video, None
+                                        self._update_state(video=None, state=PlayerState.LOADING)
+                                        if self._config.static_time > 0.0:
+                                            self.static.start()
+                                            continued = True
+                                        continue
                                     logger.info(f"Ending playback of {video.path}")
                                     raise BreakVideoPlayLoop
                                 case "user-action":
                                     next_video = self._handle_user_action(video, event["action"], event["extras"])
+                                case "config-reloaded":
+                                    self._config_reloaded(event["diff"])
                                 case "crash-player-thread":
                                     raise Exception("Crashed player thread on purpose.")
                                 case _:
@@ -0,0 +1,119 @@
+from contextlib import contextmanager
+import importlib.abc
+import logging
+import sys
+import threading
+import time
+
+
+logger = logging.getLogger(__name__)
+
+
+class _Import:
+    def __init__(self, name: str, depth: int):
+        self.name: str = name
+        self.depth: int = depth
+        self.cumulative: float = 0.0
+        self.children: float = 0.0
+
+
+class _TimedLoader(importlib.abc.Loader):
+    def __init__(self, loader, profiler: "ImportProfiler"):
+        self._loader = loader
+        self._profiler: ImportProfiler = profiler
+
+    def __getattr__(self, name):
+        return getattr(self._loader, name)  # Loaders may have extra methods, ie get_data(), get_resource_reader()
+
+    def create_module(self, spec):
+        return self._loader.create_module(spec)
+
+    def exec_module(self, module):
+        with self._profiler.timed(module.__name__):
+            self._loader.exec_module(module)
+
+
+class ImportProfiler(importlib.abc.MetaPathFinder):
+    # Times every module's execution, like python -X importtime, but installable after the interpreter started
+    def __init__(self):
+        self.start: float = time.monotonic()
+        self.imports: list[_Import] = []  # In the order they finished importing, like -X importtime
+        self._local: threading.local = threading.local()
+
+    def find_spec(self, fullname, path, target=None):
+        for finder in sys.meta_path:
+            if finder is self or not hasattr(finder, "find_spec"):
+                continue
+            spec = finder.find_spec(fullname, path, target)
+            if spec is not None:
+                if spec.loader is not None and hasattr(spec.loader, "exec_module"):
+                    spec.loader = _TimedLoader(spec.loader, self)
+                return spec
+        return None
+
+    @contextmanager
+    def timed(self, name: str):
+        stack = self._stack()
+        entry = _Import(name, depth=len(stack))
+        stack.append(entry)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            entry.cumulative = time.perf_counter() - start
+            stack.pop()
+            if stack:
+                stack[-1].children += entry.cumulative
+            self.imports.append(entry)
+
+    def _stack(self) -> list[_Import]:
+        if not hasattr(self._local, "stack"):
+            self._local.stack = []
+        return self._local.stack
+
+    def install(self):
+        sys.meta_path.insert(0, self)
+
+    def uninstall(self):
+        if self in sys.meta_path:
+            sys.meta_path.remove(self)
+
+    def report(self) -> str:
+        lines = ["import time: self [us] | cumulative | imported package"]
+        for entry in self.imports:
+            self_us, cumulative_us = round((entry.cumulative - entry.children) * 1e6), round(entry.cumulative * 1e6)
+            lines.append(f"import time: {self_us:>9} | {cumulative_us:>10} | {'  ' * entry.depth}{entry.name}")
+        return "\n".join(lines)
+
+
+_profiler: None | ImportProfiler = None
+_report_path: None | str = None
+
+
+def start_profiling(path: str):
+    # Needs to be called before anything heavy gets imported, so as early as possible in __main__.py
+    global _profiler, _report_path
+    _profiler, _report_path = ImportProfiler(), path
+    _profiler.install()
+
+
+def write_report(phase_timer):
+    # Called once startup is complete, does nothing unless started with --profile-startup
+    global _profiler
+    if _profiler is None:
+        return
+    _profiler.uninstall()
+    elapsed = time.monotonic() - _profiler.start
+    imports_total = sum(entry.cumulative for entry in _profiler.imports if entry.depth == 0)
+
+    phases = sorted(phase_timer.phases.items(), key=lambda item: item[1][0])
+    with open(_report_path, "w") as file:
+        file.write(f"Startup took {elapsed:.3f}s, {imports_total:.3f}s of it importing modules\n\n")
+        file.write("Init phases (wall clock, relative to start of init, phases may overlap):\n")
+        for name, (start, end) in phases:
+            file.write(f"  {name:<16} {end - start:>8.3f}s  (from {start:.3f}s to {end:.3f}s)\n")
+        file.write(f"\nImports ({len(_profiler.imports)} modules):\n")
+        file.write(_profiler.report())
+        file.write("\n")
+    logger.info(f"Wrote startup profile to {_report_path}")
+    _profiler = None
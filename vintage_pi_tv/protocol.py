@@ -0,0 +1,114 @@
+from collections import deque
+import logging
+import secrets
+from time import monotonic as tick
+from typing import Any
+
+
+logger = logging.getLogger(__name__)
+
+TOPIC_HISTORY_SIZE = 32  # Messages kept per topic, for clients resuming after a reconnect
+
+
+class Topic:
+    # A piece of data clients are subscribed to. Every change bumps its version, and goes out to clients as a patch
+    # against the previous version where possible. Dicts are patched key by key, anything else is sent in full.
+    def __init__(self, name: str):
+        self.name: str = name
+        self.version: int = 0
+        self.data: Any = None
+        self._history: deque[dict] = deque(maxlen=TOPIC_HISTORY_SIZE)
+
+    def update(self, data: Any) -> None | dict:
+        # Returns the message to send clients, or None if nothing changed
+        old, self.data = self.data, data
+        if self.version > 0 and old == data:
+            return None
+        self.version += 1
+
+        message = {"topic": self.name, "version": self.version}
+        if self.version > 1 and isinstance(old, dict) and isinstance(data, dict):
+            changed = {key: value for key, value in data.items() if key not in old or old[key] != value}
+            removed = [key for key in old.keys() if key not in data]
+            if len(changed) + len(removed) < len(data):  # Otherwise, the whole thing is smaller
+                message.update({"base": self.version - 1, "patch": {"changed": changed, "removed": removed}})
+                self._history.append(message)
+                return message
+
+        message["data"] = data
+        self._history.append(message)
+        return message
+
+    def since(self, version: int) -> list[dict]:
+        # Messages that bring a client at version up to date: none, the ones it missed if we still have them all, or
+        # else just the current data
+        if version == self.version:
+            return []
+        missed = [message for message in self._history if message["version"] > version]
+        if 0 < version < self.version and missed and missed[0]["version"] == version + 1:
+            return missed
+        return [{"topic": self.name, "version": self.version, "data": self.data}]
+
+    def snapshot(self) -> dict:
+        return {"version": self.version, "data": self.data}
+
+
+class Topics:
+    def __init__(self, *topics: Topic):
+        self._topics: dict[str, Topic] = {topic.name: topic for topic in topics}
+        # Versions only mean something to a client for this run of the server, so it gets a new session every time
+        self.session: str = secrets.token_urlsafe(12)
+
+    def update(self, name: str, data: Any) -> None | dict:
+        topic = self._topics.get(name)
+        if topic is None:
+            topic = self._topics[name] = Topic(name)
+        return topic.update(data)
+
+    def has(self, *names: str) -> bool:
+        return all(name in self._topics and self._topics[name].version > 0 for name in names)
+
+    def get(self, name: str) -> Any:
+        return self._topics[name].data
+
+    def hello(self) -> dict:
+        # Full copy of every topic, sent on connect and when a client finds it missed a version
+        return {
+            "hello": {name: topic.snapshot() for name, topic in self._topics.items() if topic.version > 0},
+            "session": self.session,
+            "time": tick(),  # So clients can extrapolate from playback anchors, which use the same clock
+        }
+
+    def resume(self, session: Any, versions: Any) -> None | dict:
+        # For a reconnecting client with the versions it last saw. Returns only what it missed (an empty list if it's
+        # up to date), or None if it's from another session and needs a hello instead.
+        if session != self.session or not isinstance(versions, dict):
+            return None
+        messages = []
+        for name, topic in self._topics.items():
+            if topic.version > 0:
+                version = versions.get(name)
+                messages.extend(topic.since(version if isinstance(version, int) else 0))
+        return {"resume": messages, "time": tick()}
+
+
+def apply_message(topics: dict[str, dict], message: dict) -> bool:
+    # Client side of the above, same as applyMessage() in web/src/lib/websocket.js. Applies a message to topics
+    # ({name: {version, data}}) and returns False if a patch was for a version we don't have, meaning we missed
+    # something and need a resync.
+    if "hello" in message:
+        topics.clear()
+        topics.update(message["hello"])
+    elif "resume" in message:
+        return all(apply_message(topics, resume_message) for resume_message in message["resume"])
+    elif "patch" in message:
+        topic = topics.get(message["topic"])
+        if topic is None or topic["version"] != message["base"]:
+            return False
+        data = {**topic["data"], **message["patch"]["changed"]}
+        for key in message["patch"]["removed"]:
+            data.pop(key, None)
+        topics[message["topic"]] = {"version": message["version"], "data": data}
+    else:
+        topics[message["topic"]] = {"version": message["version"], "data": message["data"]}
+    return True
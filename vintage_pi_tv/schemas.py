@@ -14,6 +14,10 @@ from .constants import (
     DEFAULT_MPV_OPTIONS,
     DEFAULT_RATINGS,
     LOG_LEVELS,
+    MPV_BACKEND_EMBEDDED,
+    MPV_BACKENDS,
+    OSD_RENDERER_THREAD,
+    OSD_RENDERERS,
 )
 from .keyboard import is_valid_key
 from .utils import is_docker, is_raspberry_pi
@@ -116,6 +120,7 @@ config_schema = Schema(
         Optional("channel-osd-always-on", default=False): bool,
         Optional("disable-osd", default=False): bool,
         Optional("save-place-while-browsing", default=True): bool,
+        Optional("continuous-play", default=False): bool,
         Optional("starting-volume", default=100): Or(False, And(int, lambda i: 0 <= i <= 100)),
         Optional("static-time-between-channels", default=0.5): Or(
             And(Or(False, 0, 0.0), Use(lambda _: -1.0)), And(Use(float), lambda f: f > 0.0)
@@ -143,6 +148,26 @@ config_schema = Schema(
             Schema({direction: And(Use(int), lambda i: i >= 0) for direction in ("top", "right", "bottom", "left")}),
         ),
         Optional("valid-file-extensions", default="defaults"): Or([NON_EMPTY_STRING], "defaults"),
+        Optional(
+            "mpv-backend",
+            default=MPV_BACKEND_EMBEDDED,
+            description=f"How mpv is run. Must be one of {', '.join(MPV_BACKENDS)}",
+        ): And(
+            str,
+            Use(lambda s: s.strip().lower()),
+            Or(*MPV_BACKENDS),
+            error=f"Invalid 'mpv-backend'. Must be one of {', '.join(MPV_BACKENDS)}",
+        ),
+        Optional(
+            "osd-renderer",
+            default=OSD_RENDERER_THREAD,
+            description=f"Where the OSD is rendered. Must be one of {', '.join(OSD_RENDERERS)}",
+        ): And(
+            str,
+            Use(lambda s: s.strip().lower()),
+            Or(*OSD_RENDERERS),
+            error=f"Invalid 'osd-renderer'. Must be one of {', '.join(OSD_RENDERERS)}",
+        ),
         Optional("mpv-options", default=MPV_OPTIONS): Schema({
             **{Optional(k, default=v): MPV_OPTION for k, v in MPV_OPTIONS.items()},
             # Catch-all for any other strings
@@ -155,6 +180,11 @@ config_schema = Schema(
                 for k, v in DEFAULT_KEYBOARD_KEYS.items()
             },
         }),
+        Optional("thumbnails", default={"enabled": False, "dir": False, "workers": 1}): Schema({
+            Optional("enabled", default=False): bool,
+            Optional("dir", default=False): Or(False, NON_EMPTY_PATH),
+            Optional("workers", default=1): And(int, lambda i: 1 <= i <= 8, error="'workers' must be between 1 and 8"),
+        }),
         Optional("ir-remote", default={"enabled": False}): Schema({
             Optional("enabled", default=False): bool,
             Optional("protocol", default="nec"): str,
@@ -0,0 +1,52 @@
+from dataclasses import dataclass, replace
+
+from .constants import PlayerState
+from .videos import Video
+
+
+@dataclass(frozen=True, slots=True)
+class StateSnapshot:
+    # Immutable, so readers in other threads (OSD, websocket publisher) never see a partially updated state. A new
+    # snapshot is published by a single attribute assignment, with a higher version number.
+    version: int = 0
+    state: PlayerState = PlayerState.LOADING
+    video: None | Video = None
+    position: float = 0.0
+    duration: float = 0.0
+    fps_video: float = 0.0
+    fps_actual: float = 0.0
+    fps_dropped: int = 0
+    speed: float = 1.0
+    # Where playback was at a moment in time (monotonic clock), which clients extrapolate from. Only moved when
+    # playback jumps or drifts, so steady playback doesn't publish anything to clients.
+    anchor_position: float = 0.0
+    anchor_time: float = 0.0
+
+    def evolve(self, **kwargs) -> "StateSnapshot":
+        return replace(self, version=self.version + 1, **kwargs)
+
+    @property
+    def advancing(self) -> bool:
+        return self.state == PlayerState.PLAYING
+
+    def position_at(self, when: float) -> float:
+        # Where the anchor says playback should be
+        if not self.advancing:
+            return self.anchor_position
+        return self.anchor_position + (when - self.anchor_time) * self.speed
+
+    def serialize(self, show_fps: bool = False) -> dict:
+        data = {
+            "anchor": {
+                "position": self.anchor_position,
+                "time": self.anchor_time,
+                "rate": self.speed,
+                "paused": not self.advancing,
+            },
+            "duration": self.duration,
+            "state": self.state,
+            "video": self.video and self.video.serialize(),
+        }
+        if show_fps:
+            data.update({"fps_video": self.fps_video, "fps_actual": self.fps_actual, "fps_dropped": self.fps_dropped})
+        return data
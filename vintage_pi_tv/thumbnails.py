@@ -0,0 +1,346 @@
+from collections import deque
+from collections.abc import Callable
+from concurrent.futures import Future, ThreadPoolExecutor
+import hashlib
+import logging
+import os
+from pathlib import Path
+import queue
+import re
+import shutil
+import signal
+import subprocess
+import tempfile
+import threading
+import time
+
+import pygame
+
+from .config import Config
+from .constants import DEFAULT_AUDIO_FILE_EXTENSIONS, THUMBNAIL_STRIP_FRAMES, PlayerState
+from .state import StateSnapshot
+from .videos import VideosDB
+
+
+logger = logging.getLogger(__name__)
+
+POSTER_WIDTH = 320
+POSTER_POSITION = 0.1  # Fraction of the way into the video, past any black frames or title cards at the start
+STRIP_FRAME_WIDTH = 160
+COMMAND_TIMEOUT = 120.0  # Seconds a command can run for, not counting time spent paused
+CHECK_INTERVAL = 1.0  # While there's work to do, how often to check if it should be paused or resumed
+DROPPED_FRAMES_COOLDOWN = 30.0  # Seconds of playback without dropped frames before generating resumes
+PUBLISH_INTERVAL = 10.0  # Seconds between telling clients there are new thumbnails, so they don't refetch constantly
+FILENAME_RE = re.compile(r"^[0-9a-f]{40}(-strip)?\.jpg$")
+# Filenames are a signature of the video, so never change. Private, since they're behind the password.
+CACHE_CONTROL = "private, max-age=31536000, immutable"
+DURATION_PREFIX = "VINTAGE_PI_TV_DURATION="
+
+
+def default_thumbnails_dir() -> Path:
+    return Path(os.environ.get("XDG_CACHE_HOME") or "~/.cache").expanduser() / "vintage-pi-tv" / "thumbnails"
+
+
+def stat_signature(path: Path) -> None | str:
+    # Changes whenever the file does, without having to read it
+    try:
+        stat = path.stat()
+    except OSError:
+        return None
+    return hashlib.sha1(f"{path}\0{stat.st_size}\0{stat.st_mtime_ns}".encode()).hexdigest()
+
+
+class Thumbnails:
+    # Generates a poster frame and a strip of frames to scrub through for each video in the library, for the web UI.
+    # Commands run at the lowest CPU and IO priority and get stopped (SIGSTOP) while the player is loading or dropping
+    # frames, so they never compete with playback.
+    def __init__(
+        self,
+        config: Config,
+        videos_db: VideosDB,
+        state_getter: Callable[[], StateSnapshot],
+        websocket_updates_queue: None | queue.Queue = None,
+    ):
+        self.dir: Path = config.thumbnails["dir"] or default_thumbnails_dir()
+        self._workers: int = config.thumbnails["workers"]
+        self._videos_db: VideosDB = videos_db
+        self._state_getter: Callable[[], StateSnapshot] = state_getter
+        self._websocket_updates_queue: None | queue.Queue = websocket_updates_queue
+
+        if shutil.which("ffmpeg") and shutil.which("ffprobe"):
+            self.tool: None | str = "ffmpeg"
+        elif shutil.which("mpv"):
+            self.tool = "mpv"
+        else:
+            self.tool = None
+        self._nice: tuple[str, ...] = ()
+        if shutil.which("nice"):
+            self._nice += ("nice", "-n", "19")
+        if shutil.which("ionice"):
+            self._nice += ("ionice", "-c", "3")
+
+        # Guards everything below it, which worker threads change
+        self._lock: threading.Lock = threading.Lock()
+        self._processes: set[subprocess.Popen] = set()
+        self._paused: bool = False
+        self._ready: dict[Path, str] = {}  # Video path to signature, for videos with both images in the cache
+        self._failed: set[str] = set()  # Signatures of videos that couldn't be generated, so they aren't retried
+        self.generated: int = 0
+
+        self._wake_event: threading.Event = threading.Event()
+        self._stop_event: threading.Event = threading.Event()
+        self._working: bool = False  # Whether there's work queued, running or not yet published
+        self._last_state: None | StateSnapshot = None
+
+    @property
+    def available(self) -> bool:
+        return self.tool is not None
+
+    def signature(self, path: Path) -> None | str:
+        return self._ready.get(path)
+
+    def path(self, filename: str) -> None | Path:
+        if FILENAME_RE.match(filename) and (path := self.dir / filename).exists():
+            return path
+        return None
+
+    def wake(self):
+        # Called after every library rebuild
+        self._wake_event.set()
+
+    def state_updated(self, state: StateSnapshot):
+        # Called by the player for every new state version. Only wakes up the generating thread if it's working, and
+        # playback started or stopped loading or dropped frames, ie not for every position update.
+        last, self._last_state = self._last_state, state
+        if self._working and (last is None or state.state != last.state or state.fps_dropped > last.fps_dropped):
+            self._wake_event.set()
+
+    def _set_paused(self, paused: bool):
+        with self._lock:
+            if paused == self._paused:
+                return
+            self._paused = paused
+            for process in self._processes:
+                try:
+                    process.send_signal(signal.SIGSTOP if paused else signal.SIGCONT)
+                except ProcessLookupError:
+                    pass
+        logger.debug(f"{'Paused' if paused else 'Resumed'} generating thumbnails")
+
+    def _run(self, *args: str) -> str:
+        process = subprocess.Popen(
+            (*self._nice, *args), stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True
+        )
+        with self._lock:
+            self._processes.add(process)
+            if self._stop_event.is_set():  # Started after shutdown() killed everything else
+                process.kill()
+            elif self._paused:
+                process.send_signal(signal.SIGSTOP)
+
+        try:
+            running = 0.0
+            while True:
+                try:
+                    stdout, stderr = process.communicate(timeout=CHECK_INTERVAL)
+                    break
+                except subprocess.TimeoutExpired:
+                    if not self._paused:
+                        running += CHECK_INTERVAL
+                    if running >= COMMAND_TIMEOUT:
+                        process.kill()
+                        process.communicate()
+                        raise
+        finally:
+            with self._lock:
+                self._processes.discard(process)
+
+        if process.returncode != 0:
+            raise subprocess.CalledProcessError(process.returncode, args, stdout, stderr)
+        return stdout
+
+    def _probe_duration(self, path: Path) -> float:
+        if self.tool == "ffmpeg":
+            output = self._run(
+                "ffprobe", "-v", "error", "-show_entries", "format=duration", "-of", "csv=p=0", str(path)
+            )
+        else:
+            output = self._run(
+                "mpv",
+                "--no-config",
+                "--msg-level=all=no,cplayer=info",
+                f"--term-playing-msg={DURATION_PREFIX}${{=duration}}",
+                "--vo=null",
+                "--ao=null",
+                "--frames=1",
+                "--",
+                str(path),
+            )
+            output = next((line for line in output.splitlines() if line.startswith(DURATION_PREFIX)), "")
+            output = output.removeprefix(DURATION_PREFIX)
+        return float(output.strip())
+
+    def _extract_frame(self, path: Path, position: float, width: int, out_dir: Path) -> Path:
+        out_dir.mkdir()
+        if self.tool == "ffmpeg":
+            out = out_dir / "frame.jpg"
+            self._run(
+                "ffmpeg",
+                "-nostdin",
+                "-v",
+                "error",
+                "-ss",
+                f"{position:.3f}",
+                "-i",
+                str(path),
+                "-frames:v",
+                "1",
+                "-vf",
+                f"scale={width}:-2",
+                "-q:v",
+                "4",
+                "-y",
+                str(out),
+            )
+        else:
+            out = out_dir / "00000001.jpg"
+            self._run(
+                "mpv",
+                "--no-config",
+                "--msg-level=all=no",
+                "--no-audio",
+                f"--start={position:.3f}",
+                "--frames=1",
+                f"--vf=scale={width}:-2",
+                "--vo=image",
+                "--vo-image-format=jpg",
+                f"--vo-image-outdir={out_dir}",
+                "--",
+                str(path),
+            )
+        if not out.exists():
+            raise ValueError(f"{self.tool} didn't output a frame at {position:.3f}s")
+        return out
+
+    def _generate(self, path: Path, signature: str):
+        if self._stop_event.is_set():
+            return
+        start = time.monotonic()
+        try:
+            # Inside the cache dir, so the finished images can be moved into place atomically
+            with tempfile.TemporaryDirectory(dir=self.dir, prefix=".tmp-") as tmp_dir:
+                tmp_dir = Path(tmp_dir)
+                duration = self._probe_duration(path)
+                poster = self._extract_frame(path, duration * POSTER_POSITION, POSTER_WIDTH, tmp_dir / "poster")
+
+                frames = [
+                    pygame.image.load(
+                        self._extract_frame(
+                            path,
+                            duration * (i + 0.5) / THUMBNAIL_STRIP_FRAMES,
+                            STRIP_FRAME_WIDTH,
+                            tmp_dir / f"strip-{i}",
+                        )
+                    )
+                    for i in range(THUMBNAIL_STRIP_FRAMES)
+                ]
+                strip = pygame.Surface((sum(frame.get_width() for frame in frames), frames[0].get_height()))
+                strip.blits((frame, (i * STRIP_FRAME_WIDTH, 0)) for i, frame in enumerate(frames))
+                pygame.image.save(strip, tmp_dir / "strip.jpg")
+
+                os.replace(tmp_dir / "strip.jpg", self.dir / f"{signature}-strip.jpg")
+                os.replace(poster, self.dir / f"{signature}.jpg")
+        except (subprocess.SubprocessError, OSError, ValueError, pygame.error) as e:
+            if self._stop_event.is_set():
+                return  # Killed by shutdown(), not a problem with the video
+            logger.warning(f"Couldn't generate thumbnails for {path}: {e}")
+            with self._lock:
+                self._failed.add(signature)
+        else:
+            with self._lock:
+                self._ready[path] = signature
+                self.generated += 1
+            logger.debug(f"Generated thumbnails for {path} in {time.monotonic() - start:.1f}s")
+
+    def _scan(self) -> deque[tuple[Path, str]]:
+        # Finds videos already in the cache, and returns the ones that aren't
+        with self._lock:
+            failed = set(self._failed)
+        ready, todo, signatures = {}, deque(), {}
+        for video in self._videos_db.videos:
+            if video.path.suffix.lower().removeprefix(".") in DEFAULT_AUDIO_FILE_EXTENSIONS:
+                continue  # Nothing to show
+            signature = signatures[video.path] = stat_signature(video.path)
+            if signature is None or signature in failed:
+                continue
+            if (self.dir / f"{signature}.jpg").exists() and (self.dir / f"{signature}-strip.jpg").exists():
+                ready[video.path] = signature
+            else:
+                todo.append((video.path, signature))
+
+        with self._lock:
+            # Workers that were still running may have finished videos after they were checked above
+            ready.update(
+                (path, signature) for path, signature in self._ready.items() if signatures.get(path) == signature
+            )
+            self._ready = ready
+        return deque((path, signature) for path, signature in todo if path not in ready)
+
+    def _publish(self):
+        if self._websocket_updates_queue is not None:
+            data = {"generated": self.generated, "ready": len(self._ready)}
+            self._websocket_updates_queue.put({"type": "thumbnails", "data": data})
+
+    def thumbnails_thread(self):
+        self.dir.mkdir(parents=True, exist_ok=True)
+        logger.info(f"Generating thumbnails using {self.tool} into {self.dir}")
+
+        version, todo = None, deque()
+        futures: set[Future] = set()
+        last_dropped, last_drop_time = 0, float("-inf")
+        published, last_published = None, float("-inf")
+
+        with ThreadPoolExecutor(max_workers=self._workers, thread_name_prefix="thumbnails") as executor:
+            while not self._stop_event.is_set():
+                self._wake_event.clear()  # Before looking at anything, so changes from here on wake up the wait below
+                now, state = time.monotonic(), self._state_getter()
+                if state.fps_dropped > last_dropped and self._working:  # Drops while asleep weren't slowing anything
+                    last_drop_time = now
+                last_dropped = state.fps_dropped  # Goes back to zero for each video
+                busy = state.state == PlayerState.LOADING or (
+                    state.state == PlayerState.PLAYING and now - last_drop_time < DROPPED_FRAMES_COOLDOWN
+                )
+                self._set_paused(busy)
+
+                if self._videos_db.version != version:
+                    version = self._videos_db.version
+                    todo = self._scan()
+                    logger.debug(f"{len(self._ready)} videos have thumbnails, {len(todo)} to generate")
+
+                futures = {future for future in futures if not future.done()}
+                while not busy and todo and len(futures) < self._workers:
+                    future = executor.submit(self._generate, *todo.popleft())
+                    future.add_done_callback(lambda _: self._wake_event.set())
+                    futures.add(future)
+
+                if (self.generated, len(self._ready)) != published and now - last_published >= PUBLISH_INTERVAL:
+                    published, last_published = (self.generated, len(self._ready)), now
+                    self._publish()
+
+                # Only poll while there's work to pause, resume or publish, otherwise sleep until woken up
+                self._working = bool(todo or futures or (self.generated, len(self._ready)) != published)
+                self._wake_event.wait(CHECK_INTERVAL if self._working else None)
+
+            executor.shutdown(cancel_futures=True)
+        logger.info("Stopped generating thumbnails")
+
+    def shutdown(self):
+        # Otherwise stopped commands would be left behind
+        self._stop_event.set()
+        self._wake_event.set()
+        with self._lock:
+            for process in self._processes:
+                try:
+                    process.kill()  # Works on stopped processes too
+                except ProcessLookupError:
+                    pass
@@ -1,18 +1,26 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
 import logging
 from pathlib import Path
 import queue
 import threading
+import tomllib
 
-from .config import Config
+from .config import LIBRARY_SETTINGS, Config, ConfigDiff
+from .exceptions import InvalidConfigError
 from .keyboard import KEYBOARD_AVAILABLE, Keyboard
 from .mpv_wrapper import MPV
 from .player import Player
+from .thumbnails import Thumbnails
 from .utils import (
+    PhaseTimer,
     get_vintage_pi_tv_version,
     init_logger,
     is_docker,
     is_raspberry_pi,
     resolve_config_file,
+    restart,
+    retry_task_wrapper,
     retry_thread_wrapper,
     set_log_level,
 )
@@ -32,6 +40,7 @@ class VintagePiTV:
         extra_search_dirs: list | tuple = (),
         log_level_override: None | str = None,
     ):
+        self.startup_timer: PhaseTimer = PhaseTimer()
         init_logger()
         logger.info(f"Starting Vintage Pi TV version: {get_vintage_pi_tv_version()}")
 
@@ -39,14 +48,15 @@ class VintagePiTV:
         self._websocket_updates_queue: queue.Queue = websocket_updates_queue
         self._log_level_override = log_level_override
         self._extra_search_dirs = extra_search_dirs
-        config_file = resolve_config_file(config_file, config_wait)
-        logger.info(f"Using config file: {config_file if config_file is not None else '(none, using defaults)'}")
-        self.config: Config = Config(
-            path=resolve_config_file(config_file, config_wait),
-            websocket_updates_queue=self._websocket_updates_queue,
-            extra_search_dirs=self._extra_search_dirs,
-            log_level_override=self._log_level_override,
-        )
+        with self.startup_timer.phase("config"):
+            config_file = resolve_config_file(config_file, config_wait)
+            logger.info(f"Using config file: {config_file if config_file is not None else '(none, using defaults)'}")
+            self.config: Config = Config(
+                path=resolve_config_file(config_file, config_wait),
+                websocket_updates_queue=self._websocket_updates_queue,
+                extra_search_dirs=self._extra_search_dirs,
+                log_level_override=self._log_level_override,
+            )
 
         set_log_level(self.config.log_level)
         logger.debug(f"Changed log level to {self.config.log_level}")
@@ -55,46 +65,148 @@ class VintagePiTV:
         logger.debug(f"Running in mode: {is_docker()=}, {is_raspberry_pi()=}")
 
         self.keyboard: Keyboard | None = None
+        self._disable_unavailable_inputs(self.config)
+        # Config file as last loaded. Ahead of self.config when settings that need a restart changed, but restarting
+        # wasn't possible, so those are only reported once.
+        self._loaded_config: Config = self.config
         if self.config.keyboard["enabled"]:
             if KEYBOARD_AVAILABLE:
                 logger.info("Enabling keyboard")
                 self.keyboard = Keyboard(config=self.config, event_queue=event_queue)
-            elif is_docker():
-                logger.info("Enabling keyboard in Docker mode")
             else:
-                logger.warning("Can't enable keyboard since it's not available on this platform")
-                self.config.keyboard["enabled"] = False
-
-        if (not self.config.keyboard["enabled"] or is_docker()) and self.config.ir_remote["enabled"]:
-            logger.warning("Can't enable IR remote if keyboard is disabled (or in Docker dev mode)!")
-            self.config.ir_remote["enabled"] = False
-
-        # Initialize videos first, since it may exit and no sense opening an MPV window
-        self.videos: VideosDB = VideosDB(config=self.config, websocket_updates_queue=websocket_updates_queue)
-        self.mpv: MPV = MPV(config=self.config, event_queue=event_queue)
-        self.player: Player = Player(
-            config=self.config,
-            videos_db=self.videos,
-            mpv=self.mpv,
-            keyboard=self.keyboard,
-            event_queue=event_queue,
-            websocket_updates_queue=websocket_updates_queue,
+                logger.info("Enabling keyboard in Docker mode")
+
+        # Initialize videos search dirs first, since it may exit and no sense opening an MPV window
+        self.videos: VideosDB = VideosDB(
+            config=self.config, websocket_updates_queue=websocket_updates_queue, scan=False
         )
 
+        # Scanning the library is mostly waiting on the filesystem, and mpv init and generating overlays are mostly
+        # waiting on libmpv and numpy, so they all run concurrently
+        with ThreadPoolExecutor(max_workers=1, thread_name_prefix="startup") as executor:
+            scan = executor.submit(self.startup_timer.timed("videos_scan", self.videos.scan))
+            with self.startup_timer.phase("mpv"):
+                self.mpv: MPV = MPV(config=self.config, event_queue=event_queue)
+            with self.startup_timer.phase("player"):
+                self.player: Player = Player(
+                    config=self.config,
+                    videos_db=self.videos,
+                    mpv=self.mpv,
+                    keyboard=self.keyboard,
+                    event_queue=event_queue,
+                    websocket_updates_queue=websocket_updates_queue,
+                )
+            scan.result()
+
+        self.thumbnails: None | Thumbnails = None
+        if self.config.thumbnails["enabled"]:
+            self.thumbnails = Thumbnails(
+                config=self.config,
+                videos_db=self.videos,
+                state_getter=lambda: self.player.state,
+                websocket_updates_queue=websocket_updates_queue,
+            )
+            if not self.thumbnails.available:
+                logger.warning("Can't generate thumbnails since neither ffmpeg nor mpv are installed")
+                self.thumbnails = None
+            else:
+                self.player.state_listeners.append(self.thumbnails.state_updated)
+                self.videos.rebuild_listeners.append(self.thumbnails.wake)
+
+        self._tasks: list[asyncio.Task] = []
         self.mpv.done_loading()
+        logger.info(f"Startup phases took {self.startup_timer.summary()}")
         logger.debug("Done initializing objects")
 
-    def startup(self):
+    @staticmethod
+    def _disable_unavailable_inputs(config: Config, log: bool = True):
+        # Also done to reloaded configs, so these don't show up as changes needing a restart
+        if config.keyboard["enabled"] and not KEYBOARD_AVAILABLE and not is_docker():
+            if log:
+                logger.warning("Can't enable keyboard since it's not available on this platform")
+            config.keyboard["enabled"] = False
+
+        if (not config.keyboard["enabled"] or is_docker()) and config.ir_remote["enabled"]:
+            if log:
+                logger.warning("Can't enable IR remote if keyboard is disabled (or in Docker dev mode)!")
+            config.ir_remote["enabled"] = False
+
+    async def _watch_config_task(self):
+        import watchfiles
+
+        path = self.config.path
+        logger.debug(f"Watching config file {path} for changes")
+        # Watches the directory, since editors often save by replacing the file
+        async for _ in watchfiles.awatch(path.parent, watch_filter=lambda _, changed: Path(changed) == path):
+            try:
+                config = await asyncio.to_thread(self.config.reload)
+            except (InvalidConfigError, tomllib.TOMLDecodeError, OSError) as e:
+                logger.error(f"Config file changed, but it's invalid. Keeping the current config. {e}")
+                continue
+            try:
+                self.videos.resolve_search_dirs(config.search_dirs, log=False)
+            except InvalidConfigError as e:
+                logger.error(f"Config file changed, but it's invalid. Keeping the current config. {e}")
+                continue
+
+            self._disable_unavailable_inputs(config, log=False)
+            diff = self.config.diff(config)
+            # Only what changed since the last load, and isn't back to what's running
+            restart_reasons = set(self._loaded_config.diff(config).restart_reasons) & set(diff.restart_reasons)
+            if reasons := ", ".join(sorted(reason.replace("_", "-") for reason in restart_reasons)):
+                if restart(f"Changed settings that need a restart: {reasons}"):
+                    return
+            self._loaded_config = config
+
+            # Restarting isn't possible when running with --reload, so anything that needs one waits for the next
+            # time it starts. The rest still gets applied.
+            diff = diff.without_restart()
+            if not diff:
+                if not reasons:
+                    logger.info("Config file changed, but no settings did")
+            else:
+                if applied := [
+                    setting.replace("_", "-") for setting in diff.changed if setting not in diff.next_startup
+                ]:
+                    logger.info(f"Config file changed, applying changes to: {', '.join(applied)}")
+                if next_startup := [setting.replace("_", "-") for setting in diff.next_startup]:
+                    logger.warning(
+                        f"Config file changed, but changes to {', '.join(next_startup)} only take effect the next time"
+                        " Vintage Pi TV starts"
+                    )
+                self.config.update(diff)
+                await self._apply_config_diff(diff)
+
+    async def _apply_config_diff(self, diff: ConfigDiff):
+        # Settings read each time they're used need nothing, see RELOADABLE_SETTINGS in config.py
+        if "log_level" in diff:
+            set_log_level(self.config.log_level)
+        if "ratings" in diff:
+            self._websocket_updates_queue.put({"type": "ratings", "data": self.config.ratings})
+        if "keyboard" in diff and self.keyboard:
+            self.keyboard.reload_keys()
+        if "search_dirs" in diff:
+            await self.videos.reload_search_dirs()
+        elif diff.touches(LIBRARY_SETTINGS):
+            self.videos.request_rebuild()
+        self._event_queue.put({"event": "config-reloaded", "diff": diff})
+
+    async def startup(self):
+        # Watching for changes and rebuilding happen on the event loop, which uvicorn is already running
+        self.videos.start_watching()
+        if self.config.path is not None:
+            self._tasks.append(asyncio.create_task(retry_task_wrapper(self._watch_config_task)(), name="watch_config"))
+
         threads = [
-            (self.videos.watch_dirs_thread, {"kwargs": {"recursive": False}, "daemon": False}),
-            (self.videos.watch_dirs_thread, {"name": "watch_dirs_rec", "kwargs": {"recursive": True}, "daemon": False}),
-            self.videos.rebuild_channels_thread,
             self.player.osd.osd_thread,
+            self.mpv.overlay_reaper_thread,
             self.player.static.static_thread,
             (self.player.player_thread, {"exc_cleanup_func": self.player.player_thread_cleanup}),
         ]
         if self.keyboard:
             threads.append(self.keyboard.keyboard_thread)
+        if self.thumbnails:
+            threads.append(self.thumbnails.thumbnails_thread)
 
         for thread in threads:
             target, kwargs = thread if isinstance(thread, tuple) else (thread, {})
@@ -111,6 +223,10 @@ class VintagePiTV:
 
         logger.info("Loading complete!")
 
-    def shutdown(self):
-        # Using a threading.Event for watchfiles prevents weird "FATAL: exception not rethrown" log messages
-        self.videos.watch_stop_event.set()
+    async def shutdown(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        await self.videos.stop_watching()
+        if self.thumbnails:
+            self.thumbnails.shutdown()
@@ -1,3 +1,5 @@
+import asyncio
+from contextlib import contextmanager
 from functools import cache, wraps
 import logging
 import os
@@ -9,15 +11,17 @@ import sys
 import threading
 import time
 
-from uvicorn.logging import TRACE_LOG_LEVEL as TRACE, ColourizedFormatter
-
-from .constants import DEFAULT_CONFIG_PATHS, DETERMINISTIC_SEED, ENV_RELOAD_PID_NAME
+from .constants import DEFAULT_CONFIG_PATHS, DETERMINISTIC_SEED, ENV_RELOAD_PID_NAME, ENV_RESTART_NAME
 
 
 logger = logging.getLogger(__name__)
 
+TRACE = 5  # Same as uvicorn.logging.TRACE_LOG_LEVEL, without importing uvicorn for it
+
 
 def init_logger():
+    from uvicorn.logging import ColourizedFormatter
+
     def trace(self, message, *args, **kwargs):
         if self.isEnabledFor(TRACE):
             self._log(TRACE, message, args, **kwargs)
@@ -85,6 +89,38 @@ class FPSClock:
         self.last_tick = time.monotonic()
 
 
+class PhaseTimer:
+    # Wall clock timings of named phases, which may run concurrently in different threads
+    def __init__(self):
+        self.start: float = time.monotonic()
+        self.phases: dict[str, tuple[float, float]] = {}  # name: (start, end), relative to self.start
+        self._lock: threading.Lock = threading.Lock()
+
+    @contextmanager
+    def phase(self, name: str):
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.phases[name] = (start - self.start, time.monotonic() - self.start)
+
+    def timed(self, name: str, func):
+        @wraps(func)
+        def wrapped(*args, **kwargs):
+            with self.phase(name):
+                return func(*args, **kwargs)
+
+        return wrapped
+
+    def summary(self) -> str:
+        with self._lock:
+            phases = sorted(self.phases.items(), key=lambda item: item[1][0])
+        total = max((end for _, (_, end) in phases), default=0.0)
+        breakdown = ", ".join(f"{name}={end - start:.3f}s (@{start:.3f}s)" for name, (start, end) in phases)
+        return f"{total:.3f}s total: {breakdown}"
+
+
 @cache
 def is_docker():
     return Path("/.dockerenv").exists()
@@ -144,6 +180,25 @@ def retry_thread_wrapper(func, exc_cleanup_func=None):
     return wrapped
 
 
+def retry_task_wrapper(func):
+    # Same as retry_thread_wrapper(), for asyncio tasks
+    @wraps(func)
+    async def wrapped(*args, **kwargs):
+        task_name = asyncio.current_task().get_name()
+        logger.debug(f"Task {task_name} started")
+        while True:
+            try:
+                await func(*args, **kwargs)
+            except Exception:
+                logger.exception(f"Task {task_name} threw an exception. Restarting soon.")
+                await asyncio.sleep(0.25)
+            else:
+                logger.warning(f"Task {task_name} returned cleanly. Not restarting.")
+                break
+
+    return wrapped
+
+
 def exit(status: int = 0, reason: str = "unspecified", force: bool = False):
     logger.critical(f"Exiting with status code: {status} (Reason: {reason})")
     reload_pid = os.environ.get(ENV_RELOAD_PID_NAME)
@@ -158,6 +213,18 @@ def exit(status: int = 0, reason: str = "unspecified", force: bool = False):
         sys.exit(status)
 
 
+def restart(reason: str = "unspecified") -> bool:
+    # Shuts down uvicorn gracefully, and then __main__.py starts the process over. Returns False if that's not
+    # possible, since with --reload uvicorn's reloader owns the process.
+    if os.environ.get(ENV_RELOAD_PID_NAME):
+        logger.warning(f"Can't restart when running with --reload. Restart manually! (Reason: {reason})")
+        return False
+    logger.critical(f"Restarting (Reason: {reason})")
+    os.environ[ENV_RESTART_NAME] = "1"
+    os.kill(os.getpid(), signal.SIGTERM)
+    return True
+
+
 def resolve_config_file(config_file: None | Path = None, config_wait: int = 0) -> Path:
     if config_file is not None:
         tries = (config_file,)
@@ -1,3 +1,5 @@
+import asyncio
+from collections.abc import Callable
 import logging
 import os
 from pathlib import Path
@@ -7,8 +9,7 @@ import threading
 import time
 from typing import Literal
 
-import watchfiles
-
+from . import metrics
 from .config import Config
 from .constants import (
     CHANNEL_MODE_ALPHABETICAL,
@@ -19,7 +20,8 @@ from .constants import (
     CHANNEL_MODE_RANDOM,
     CHANNEL_MODE_RANDOM_DETERMINISTIC,
 )
-from .utils import exit, listdir_recursive, normalize_filename, shuffle_deterministic
+from .exceptions import InvalidConfigError
+from .utils import exit, listdir_recursive, normalize_filename, retry_task_wrapper, shuffle_deterministic
 
 
 logger = logging.getLogger(__name__)
@@ -103,48 +105,79 @@ class Video:
         return f"Video(name={self.name!r}, path={self.path!r}, channel={self.channel})"
 
 
+LIBRARY_PAGE_SIZE = 100
+LIBRARY_MAX_PAGE_SIZE = 500
+LIBRARY_SORT_KEYS = {
+    "channel": lambda video: video.channel,
+    "name": lambda video: video.name.casefold(),
+    "filename": lambda video: video.filename,
+    "rating": lambda video: video.rating_dict["num"] if video.rating else -1,
+}
+
+
 class VideosDB:
-    def __init__(self, config: Config, websocket_updates_queue: None | queue.Queue = None):
+    def __init__(self, config: Config, websocket_updates_queue: None | queue.Queue = None, scan: bool = True):
         self.config: Config = config
         self._search_dirs: list[Path] = []
         self._search_dirs_recursive: list[Path] = []
         self._exclude_dirs: list[Path] = []
-        self._wants_channel_rebuild: bool = True
-        self._rebuild_event: threading.Event = threading.Event()
+        self._bad_video_paths: set[Path] = set()  # Kept when 'search-dirs' changes, since the files are still bad
+        self._loop: None | asyncio.AbstractEventLoop = None  # Set once watching starts
+        self._rebuild_event: asyncio.Event = asyncio.Event()
+        self._tasks: list[asyncio.Task] = []
+        self._watch_tasks: list[asyncio.Task] = []  # Separate, since they're replaced when 'search-dirs' changes
         self._channel_lock: threading.Lock = threading.Lock()
-        self.watch_stop_event: threading.Event = threading.Event()
         self.has_videos_event: threading.Event = threading.Event()
         self._websocket_updates_queue: queue.Queue = websocket_updates_queue
+        self._videos: dict = {"objects": [], "channels": {}, "search": []}
+        self.version: int = 0  # Bumped on every rebuild, so clients know when to refetch the library
+        self.rebuild_listeners: list[Callable[[], None]] = []  # Called after every rebuild
 
         self._init_dirs()
-        self._rebuild_channels()
+        if scan:  # Otherwise call scan() later, ie concurrently with the rest of startup
+            self.scan()
 
+    def scan(self):
+        self._rebuild_channels()
         logger.info("Videos DB fully initialized")
 
-    def _init_dirs(self):
-        self._bad_video_paths = set()
-        self._search_dirs = list()
-        self._search_dirs_recursive = list()
-        self._exclude_dirs = list()
-
-        for info in self.config.search_dirs:
+    @staticmethod
+    def resolve_search_dirs(
+        search_dirs: list[dict[str, Path | bool]], log: bool = True
+    ) -> tuple[list[Path], list[Path], list[Path]]:
+        # Returns (search dirs, recursive search dirs, ignore dirs). Raises InvalidConfigError if none can be searched.
+        dirs, dirs_recursive, exclude_dirs = [], [], []
+        for info in search_dirs:
             if info["ignore"]:
-                logger.debug(f"Adding ignore dir: {info['path']}")
-                self._exclude_dirs.append(info["path"])
+                if log:
+                    logger.debug(f"Adding ignore dir: {info['path']}")
+                exclude_dirs.append(info["path"])
             elif info["path"].is_dir():
                 if info["recurse"]:
-                    logger.debug(f"Adding recursive search dir: {info['path']}")
-                    self._search_dirs_recursive.append(info["path"])
+                    if log:
+                        logger.debug(f"Adding recursive search dir: {info['path']}")
+                    dirs_recursive.append(info["path"])
                 else:
-                    logger.debug(f"Adding search dir: {info['path']}")
-                    self._search_dirs.append(info["path"])
-            else:
+                    if log:
+                        logger.debug(f"Adding search dir: {info['path']}")
+                    dirs.append(info["path"])
+            elif log:
                 logger.warning(f"Path in 'search-dirs' {info['path']} is not a directory. Skipping.")
 
-        if not self._search_dirs and not self._search_dirs_recursive:
-            logger.critical("No 'search-dirs' are actually valid directories.")
+        if not dirs and not dirs_recursive:
+            raise InvalidConfigError("No 'search-dirs' are actually valid directories.")
+        return dirs, dirs_recursive, exclude_dirs
+
+    def _init_dirs(self):
+        try:
+            dirs = self.resolve_search_dirs(self.config.search_dirs)
+        except InvalidConfigError as e:
+            logger.critical(str(e))
             exit(1, "Videos DB failed to initialize (no search dirs)")
+        self._set_dirs(*dirs)
 
+    def _set_dirs(self, dirs: list[Path], dirs_recursive: list[Path], exclude_dirs: list[Path]):
+        self._search_dirs, self._search_dirs_recursive, self._exclude_dirs = dirs, dirs_recursive, exclude_dirs
         logger.info(
             f"Added {len(self._search_dirs) + len(self._search_dirs_recursive)} search dirs,"
             f" {len(self._exclude_dirs)} ignore dirs"
@@ -188,6 +221,7 @@ class VideosDB:
 
     def _rebuild_channels(self):
         logger.info("Rebuilding channel list...")
+        start = time.perf_counter()
 
         videos = []  # List of kwargs for video objects
         seen_paths = set()
@@ -248,12 +282,23 @@ class VideosDB:
         videos = [Video(videos_db=self, from_config=from_config, **video) for from_config, video in videos]
         # Operation should be atomic, assign both at same time
         with self._channel_lock:
-            self._videos = {"objects": videos, "channels": {v.path: i for i, v in enumerate(videos)}}
+            self._videos = {
+                "objects": videos,
+                "channels": {v.path: i for i, v in enumerate(videos)},
+                "search": [f"{v.name}\n{v.filename}".casefold() for v in videos],
+            }
+            self.version += 1
             if self._websocket_updates_queue is not None:
-                self._websocket_updates_queue.put({"type": "videos_db", "data": [v.serialize() for v in self.videos]})
+                self._websocket_updates_queue.put(
+                    {"type": "library", "data": {"version": self.version, "count": len(videos)}}
+                )
             else:
                 logger.critical("No websocket queue! Something went wrong (or using --generate_videos_config).")
-            logger.info(f"Generated {len(self.videos)} channels, ignored {ignored_files} files")
+            took = time.perf_counter() - start
+            metrics.library_rebuilds.inc()
+            metrics.library_rebuild_seconds.inc(took)
+            metrics.library_last_rebuild_seconds.set(took)
+            logger.info(f"Generated {len(self.videos)} channels, ignored {ignored_files} files in {took:.3f}s")
             if videos:
                 self.has_videos_event.set()
             else:
@@ -261,6 +306,8 @@ class VideosDB:
         # Let go of lock, could have good jumbled logs but it's a trace so it doesn't matter
         for path, channel in self.channels.items():
             logger.trace(f"Mapped {path} to channel {channel + 1}")
+        for listener in self.rebuild_listeners:
+            listener()
 
     @property
     def videos(self) -> list[Video]:
@@ -276,6 +323,31 @@ class VideosDB:
         else:
             return self.videos
 
+    def query(
+        self,
+        search: str = "",
+        rating: Literal[False] | str = False,
+        sort: str = "channel",
+        offset: int = 0,
+        limit: int = LIBRARY_PAGE_SIZE,
+    ) -> tuple[int, int, list[Video]]:
+        # Returns (version, total matching, a page of matching videos)
+        descending = sort.startswith("-")
+        sort = sort.removeprefix("-")
+        terms = search.casefold().split()
+
+        with self._channel_lock:
+            version, videos = self.version, self._videos
+        matches = [
+            video
+            for video, search_text in zip(videos["objects"], videos["search"])
+            if all(term in search_text for term in terms) and video.is_viewable_based_on_rating(rating)
+        ]
+        if sort != "channel" or descending:
+            key = LIBRARY_SORT_KEYS[sort]
+            matches.sort(key=key, reverse=descending)
+        return version, len(matches), matches[offset : offset + limit]
+
     def get_random_video(self, current_rating: Literal[False] | str = False) -> Video:
         with self._channel_lock:  # Prevents self.videos from being modified while working here
             videos = self.videos_for_rating(current_rating)
@@ -321,18 +393,62 @@ class VideosDB:
                 return None
             return self.videos[channel]
 
-    def rebuild_channels_thread(self):
+    def start_watching(self):
+        # Runs on the event loop, with rebuilds in its default executor so they don't block it. Stopped by
+        # stop_watching().
+        self._loop = asyncio.get_running_loop()
+        self._tasks.append(
+            asyncio.create_task(retry_task_wrapper(self._rebuild_channels_task)(), name="rebuild_channels")
+        )
+        self._watch_dirs()
+
+    def _watch_dirs(self):
+        for recursive, search_dirs in ((False, self._search_dirs), (True, self._search_dirs_recursive)):
+            if search_dirs:
+                name = f"watch_dirs{'_rec' if recursive else ''}"
+                self._watch_tasks.append(
+                    asyncio.create_task(retry_task_wrapper(self._watch_dirs_task)(search_dirs, recursive), name=name)
+                )
+            else:
+                logger.debug(f"No need to watch search directories for {recursive=}")
+
+    async def reload_search_dirs(self):
+        # After 'search-dirs' changed in the config. Watches the new dirs instead, and rebuilds. Unlike at startup, the
+        # current dirs are kept if none of the new ones are valid, rather than exiting.
+        try:
+            dirs = self.resolve_search_dirs(self.config.search_dirs)
+        except InvalidConfigError as e:
+            logger.error(f"{e} Keeping the current ones.")
+            return
+        await self._cancel(self._watch_tasks)
+        self._set_dirs(*dirs)
+        self._watch_dirs()
+        self._rebuild_event.set()
+
+    async def stop_watching(self):
+        await self._cancel(self._watch_tasks)
+        await self._cancel(self._tasks)
+
+    @staticmethod
+    async def _cancel(tasks: list[asyncio.Task]):
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        tasks.clear()
+
+    async def _rebuild_channels_task(self):
         while True:
-            self._rebuild_event.wait()
-            time.sleep(1)  # Wait a second for udisks2 to mount properly, and debounce
+            await self._rebuild_event.wait()
+            await asyncio.sleep(1)  # Wait a second for udisks2 to mount properly, and debounce
             self._rebuild_event.clear()
-            self._rebuild_channels()
+            await self._loop.run_in_executor(None, self._rebuild_channels)
+
+    async def _watch_dirs_task(self, search_dirs: list[Path], recursive: bool):
+        import watchfiles  # Not needed by --generate-videos-config
 
-    def _watch_thread_helper(self, search_dirs: list[Path], recursive: bool):
         logger.debug(f"Watching search directories ({recursive=}): {', '.join(map(str, search_dirs))}")
-        for changes in watchfiles.watch(
+        async for changes in watchfiles.awatch(
             *search_dirs,
-            stop_event=self.watch_stop_event,
             # New folders should trigger a rebuild, since that's what happens when a filesystem is mounted
             # Therefore we can't filter by extension
             watch_filter=lambda _, path: self._is_valid_video_path(Path(path), filter_by_extension=False),
@@ -343,13 +459,11 @@ class VideosDB:
                 logger.debug(f"Detected file change ({change.name}): {path}")
             self._rebuild_event.set()
 
-    def watch_dirs_thread(self, recursive: bool):
-        search_dirs = self._search_dirs_recursive if recursive else self._search_dirs
-        if search_dirs:
-            self._watch_thread_helper(search_dirs, recursive)
-        else:
-            logger.debug(f"No need to start watch-dirs thread for {recursive=}")
+    def request_rebuild(self) -> None:
+        # Thread safe. Ignored before watching starts, but the player thread (the only caller) starts after that.
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._rebuild_event.set)
 
     def mark_bad_video(self, video: Video) -> None:
         self._bad_video_paths.add(video.path)
-        self._rebuild_event.set()
+        self.request_rebuild()
@@ -0,0 +1,8 @@
+import { decode } from "@msgpack/msgpack"
+import { encodings } from "../../../constants.json"
+
+// We can decode everything the server can encode (see vintage_pi_tv/fanout.py), and it picks from this list
+export const supportedEncodings = encodings
+
+// Server sends JSON as text frames and anything else as binary frames, so no need to remember what was negotiated
+export const decodeMessage = (data) => (typeof data === "string" ? JSON.parse(data) : decode(data))
@@ -0,0 +1,111 @@
+import { get, writable } from "svelte/store"
+import { password_header } from "../../../constants.json"
+import { defaultServerUrl, password, serverUrl } from "./websocket"
+
+const PAGE_SIZE = 100
+const MAX_PAGE_SIZE = 500 // Matches vintage_pi_tv/videos.py:LIBRARY_MAX_PAGE_SIZE
+
+const libraryReset = {
+  videos: [], // Loaded so far, in channel order
+  total: 0, // Total matching search
+  version: null, // Library version the loaded pages are from
+  search: "",
+  loading: false
+}
+
+// Same host as the websocket, over HTTP
+const apiUrl = (path, params) => {
+  const url = new URL(get(serverUrl) || defaultServerUrl)
+  url.protocol = url.protocol === "wss:" ? "https:" : "http:"
+  url.pathname = path
+  url.search = new URLSearchParams(params)
+  return url
+}
+
+// GET from the API, with the password
+export const fetchApi = async (path, params = {}, headers = {}) =>
+  await fetch(apiUrl(path, params), { headers: { [password_header]: get(password), ...headers } })
+
+const createLibrary = () => {
+  const { subscribe, set, update } = writable(libraryReset)
+  const libraryGet = () => get({ subscribe })
+
+  let etag = null // ETag of the first page, for the search and size it was loaded with
+  let etagKey = null
+  let requestId = 0 // Responses for anything but the latest request are ignored
+
+  const fetchPage = async (search, offset, limit = PAGE_SIZE, headers = {}) => {
+    return await fetchApi("/api/videos", { q: search, offset, limit }, headers)
+  }
+
+  return {
+    subscribe,
+    reset() {
+      requestId++
+      etag = etagKey = null
+      set(libraryReset)
+    },
+    async load(search = libraryGet().search, limit = PAGE_SIZE) {
+      // (Re)load the first page, which doesn't transfer anything if the library and search haven't changed
+      const id = ++requestId
+      const key = `${search}\n${limit}`
+      update((data) => ({ ...data, search, loading: true }))
+      try {
+        const response = await fetchPage(search, 0, limit, etag && etagKey === key ? { "If-None-Match": etag } : {})
+        if (id !== requestId) {
+          return
+        } else if (response.status === 304) {
+          update((data) => ({ ...data, loading: false }))
+          return
+        } else if (!response.ok) {
+          throw new Error(`Got HTTP ${response.status}`)
+        }
+        const page = await response.json()
+        if (id === requestId) {
+          etag = response.headers.get("ETag")
+          etagKey = key
+          set({ videos: page.videos, total: page.total, version: page.version, search, loading: false })
+        }
+      } catch (err) {
+        console.error("Error loading videos", err)
+        if (id === requestId) {
+          update((data) => ({ ...data, loading: false }))
+        }
+      }
+    },
+    async refresh() {
+      // Reload everything loaded so far, eg to pick up newly generated thumbnails without losing our place
+      const { videos, search } = libraryGet()
+      await this.load(search, Math.min(Math.max(videos.length, PAGE_SIZE), MAX_PAGE_SIZE))
+    },
+    async loadMore() {
+      const { videos, search, version, loading } = libraryGet()
+      if (loading) {
+        return
+      }
+      const id = ++requestId
+      update((data) => ({ ...data, loading: true }))
+      try {
+        const response = await fetchPage(search, videos.length)
+        if (!response.ok) {
+          throw new Error(`Got HTTP ${response.status}`)
+        }
+        const page = await response.json()
+        if (id !== requestId) {
+          return
+        } else if (page.version !== version) {
+          this.load(search) // Library changed under us, so start over
+        } else {
+          update((data) => ({ ...data, videos: [...data.videos, ...page.videos], total: page.total, loading: false }))
+        }
+      } catch (err) {
+        console.error("Error loading more videos", err)
+        if (id === requestId) {
+          update((data) => ({ ...data, loading: false }))
+        }
+      }
+    }
+  }
+}
+
+export const library = createLibrary()
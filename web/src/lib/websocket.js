@@ -2,6 +2,7 @@ import ReconnectingWebSocket from "reconnecting-websocket"
 import { persisted } from "svelte-persisted-store"
 import { get, writable } from "svelte/store"
 import { protocol_version } from "../../../constants.json"
+import { decodeMessage, supportedEncodings } from "./encoding"
 import { capitalize } from "./utils"
 
 export const password = persisted("password", "")
@@ -18,20 +19,70 @@ const dataReset = {
   connecting: false, // Is currently connected
   connected: false, // Is currently connecting
   failure: null, // If connection failed, here's why
-  // state variables below - Matches what comes from API vintage_pi_tv/app.py:REQUIRED_BROADCAST_DATA_KEYS_TO_START
+  // state variables below - Matches what comes from API vintage_pi_tv/app.py:REQUIRED_TOPICS_TO_START
   current_rating: null,
+  fleet: null, // Only from a server in fleet mode (see vintage_pi_tv/fleet.py), along with library and version
+  library: null, // Just version and count, videos are fetched over HTTP (see library.js)
   ratings: null,
   state: null,
+  thumbnails: null, // Optional, only if thumbnails are enabled
   version: null,
-  videos_db: null,
   volume: null
 }
 
+// Apply a message from the server to topics ({name: {version, data}}). Returns false if a patch was for a version
+// we don't have, meaning we missed something and need a full resync.
+const applyMessage = (topics, msg) => {
+  if (msg.hello) {
+    Object.keys(topics).forEach((name) => delete topics[name])
+    Object.assign(topics, msg.hello)
+  } else if (msg.resume) {
+    return msg.resume.every((resumeMsg) => applyMessage(topics, resumeMsg))
+  } else if (msg.patch) {
+    const topic = topics[msg.topic]
+    if (!topic || topic.version !== msg.base) {
+      return false
+    }
+    const data = { ...topic.data, ...msg.patch.changed }
+    msg.patch.removed.forEach((key) => delete data[key])
+    topics[msg.topic] = { version: msg.version, data }
+  } else {
+    topics[msg.topic] = { version: msg.version, data: msg.data }
+  }
+  return true
+}
+
+// Local clock (seconds) minus the server's monotonic clock, set from the time in each hello or resume message
+let serverClockOffset = 0
+
+// Where playback is right now, extrapolated from the last playback anchor the server sent
+export const anchorPosition = (anchor, now = performance.now() / 1000) => {
+  if (!anchor) {
+    return 0
+  } else if (anchor.paused) {
+    return anchor.position
+  }
+  return anchor.position + (now - serverClockOffset - anchor.time) * anchor.rate
+}
+
+const topicsToStore = (topics) => Object.fromEntries(Object.entries(topics).map(([name, { data }]) => [name, data]))
+
+// Topics a message changed, for updating the store
+const changedTopics = (topics, msg) => {
+  if (msg.hello) {
+    return topics
+  }
+  const names = msg.resume ? msg.resume.map(({ topic }) => topic) : [msg.topic]
+  return Object.fromEntries(names.map((name) => [name, topics[name]]))
+}
+
 const createWebsocket = () => {
   const { subscribe, set, update } = writable(dataReset)
   const websocketGet = () => get({ subscribe })
 
   let ws = null
+  let topics = {}
+  let session = null // From the last hello, so a reconnect can resume from the versions in topics
 
   return {
     subscribe,
@@ -54,6 +105,8 @@ const createWebsocket = () => {
         ws = null
         _ws.close()
       }
+      topics = {}
+      session = null
       set({ ...dataReset, failure: reason })
     },
     connect() {
@@ -78,14 +131,32 @@ const createWebsocket = () => {
         minReconnectionDelay: 1000,
         maxReconnectionDelay: 2000
       })
+      ws.binaryType = "arraybuffer"
 
       ws.onopen = () => {
-        this.send({ password: get(password), protocol_version })
+        const greeting = { password: get(password), protocol_version, encodings: supportedEncodings }
+        if (session) {
+          const versions = Object.fromEntries(Object.entries(topics).map(([name, { version }]) => [name, version]))
+          greeting.resume = { session, versions }
+        }
+        this.send(greeting)
       }
 
       ws.onmessage = (event) => {
-        const msg = JSON.parse(event.data)
-        update((data) => ({ ...data, ...msg, authenticated: true, connecting: false, connected: true, failure: null }))
+        const msg = decodeMessage(event.data)
+        if (msg.hello) {
+          session = msg.session
+        }
+        if (msg.hello || msg.resume) {
+          serverClockOffset = performance.now() / 1000 - msg.time
+        }
+        if (!applyMessage(topics, msg)) {
+          console.warn(`Missed an update to ${msg.topic || "a topic"}, resyncing`)
+          this.action("resync")
+          return
+        }
+        const changed = topicsToStore(changedTopics(topics, msg))
+        update((data) => ({ ...data, ...changed, authenticated: true, connecting: false, connected: true, failure: null }))
       }
 
       ws.onclose = (event) => {
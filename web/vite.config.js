@@ -3,6 +3,7 @@ import { execSync } from "node:child_process"
 import fs from "node:fs"
 import path from "node:path"
 import { env } from "node:process"
+import zlib from "node:zlib"
 import { defineConfig } from "vite"
 
 let version = "unknown"
@@ -22,6 +23,45 @@ if (env.VINTAGE_PI_TV_VERSION) {
   }
 }
 
+// Writes a .br and .gz next to each file in the build worth compressing, so vintage_pi_tv/assets.py can serve them
+// without compressing anything on the Pi
+const COMPRESSIBLE_RE = /\.(css|html|js|json|map|svg|txt|webmanifest)$/i
+const MIN_COMPRESS_SIZE = 1024
+
+const precompress = () => {
+  let outDir
+  return {
+    name: "precompress",
+    apply: "build",
+    configResolved(config) {
+      outDir = path.resolve(config.root, config.build.outDir)
+    },
+    closeBundle() {
+      for (const file of fs.readdirSync(outDir, { recursive: true })) {
+        const filePath = path.join(outDir, file)
+        if (!COMPRESSIBLE_RE.test(file) || fs.statSync(filePath).size < MIN_COMPRESS_SIZE) {
+          continue
+        }
+        const data = fs.readFileSync(filePath)
+        const variants = {
+          br: zlib.brotliCompressSync(data, {
+            params: {
+              [zlib.constants.BROTLI_PARAM_QUALITY]: zlib.constants.BROTLI_MAX_QUALITY,
+              [zlib.constants.BROTLI_PARAM_SIZE_HINT]: data.length
+            }
+          }),
+          gz: zlib.gzipSync(data, { level: zlib.constants.Z_BEST_COMPRESSION })
+        }
+        for (const [extension, compressed] of Object.entries(variants)) {
+          if (compressed.length < data.length) {
+            fs.writeFileSync(`${filePath}.${extension}`, compressed)
+          }
+        }
+      }
+    }
+  }
+}
+
 export default defineConfig({
   server: {
     fs: {
@@ -31,5 +71,5 @@ export default defineConfig({
   define: {
     __VERSION__: JSON.stringify(version)
   },
-  plugins: [svelte()]
+  plugins: [svelte(), precompress()]
 })